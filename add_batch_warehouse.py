@@ -0,0 +1,72 @@
+import sqlite3
+import os
+
+# Migrasi: batch FIFO per gudang.
+# - batches.warehouse_id (backfill ke gudang 'main')
+# - inventory_stocks unik per (product_id, warehouse_id), baris duplikat digabung
+# - stock_valuations dibangun ulang per (product_id, warehouse_id)
+
+def upgrade_db():
+    db_path = 'instance/warehouse.db'
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    # 1. Add warehouse_id to Batches
+    try:
+        c.execute("ALTER TABLE batches ADD COLUMN warehouse_id INTEGER REFERENCES warehouses(id)")
+        print("Added warehouse_id to batches.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped batches.warehouse_id: {e}")
+
+    # 2. Default warehouse for existing batches
+    row = c.execute("SELECT id FROM warehouses ORDER BY (type = 'main') DESC, id ASC LIMIT 1").fetchone()
+    if row:
+        main_id = row[0]
+    else:
+        c.execute("INSERT INTO warehouses (name, location, type) VALUES ('Gudang Utama', '', 'main')")
+        main_id = c.lastrowid
+        print("Created default main warehouse.")
+
+    c.execute("UPDATE batches SET warehouse_id = ? WHERE warehouse_id IS NULL", (main_id,))
+    print(f"Backfilled {c.rowcount} batches to warehouse {main_id}.")
+
+    c.execute("CREATE INDEX IF NOT EXISTS ix_batches_product_warehouse ON batches (product_id, warehouse_id, current_quantity)")
+
+    # 3. Merge duplicate inventory_stocks rows, then enforce uniqueness
+    c.execute("""
+        UPDATE inventory_stocks SET quantity = (
+            SELECT SUM(s2.quantity) FROM inventory_stocks s2
+            WHERE s2.product_id = inventory_stocks.product_id AND s2.warehouse_id = inventory_stocks.warehouse_id
+        )
+        WHERE id IN (SELECT MIN(id) FROM inventory_stocks GROUP BY product_id, warehouse_id HAVING COUNT(*) > 1)
+    """)
+    c.execute("""
+        DELETE FROM inventory_stocks
+        WHERE id NOT IN (SELECT MIN(id) FROM inventory_stocks GROUP BY product_id, warehouse_id)
+    """)
+    if c.rowcount:
+        print(f"Merged {c.rowcount} duplicate inventory_stocks rows.")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_inventory_stocks_product_warehouse ON inventory_stocks (product_id, warehouse_id)")
+
+    # 4. Rebuild valuation ledger per warehouse
+    try:
+        c.execute("DELETE FROM stock_valuations")
+        c.execute("""
+            INSERT INTO stock_valuations (product_id, warehouse_id, quantity, value, updated_at)
+            SELECT product_id, COALESCE(warehouse_id, 0), SUM(current_quantity), SUM(current_quantity * cost_price), CURRENT_TIMESTAMP
+            FROM batches GROUP BY product_id, COALESCE(warehouse_id, 0)
+        """)
+        print("Rebuilt stock_valuations per warehouse.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped stock_valuations rebuild: {e}")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    upgrade_db()
@@ -0,0 +1,36 @@
+import sqlite3
+import os
+
+# Migrasi: products.last_counted_at untuk cycle count planner
+# (diisi setiap opname, full maupun cycle count).
+
+def upgrade_db():
+    db_path = 'instance/warehouse.db'
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    try:
+        c.execute("ALTER TABLE products ADD COLUMN last_counted_at DATETIME")
+        print("Added last_counted_at to products.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped products.last_counted_at: {e}")
+
+    # Backfill: opname selisih terakhir per produk (hitungan tanpa selisih tidak tercatat)
+    c.execute("""
+        UPDATE products SET last_counted_at = (
+            SELECT MAX(t.created_at) FROM transactions t
+            WHERE t.product_id = products.id AND t.transaction_type = 'OPNAME'
+        ) WHERE last_counted_at IS NULL
+    """)
+    print(f"Backfilled last_counted_at ({c.rowcount} products checked).")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    upgrade_db()
@@ -0,0 +1,57 @@
+import sqlite3
+import os
+
+# Migrasi: tabel document_sequences (counter nomor dokumen per prefix & periode, SequenceService)
+# dan isi awal counter dari nomor yang sudah ada, supaya nomor baru tidak bentrok dengan data lama.
+# Format lama yang diteruskan: SO/PO/PR/RET-YYYYMM-NNNN, REQ-YYYYMMDD-NNNN.
+
+SOURCES = [
+    # (tabel, kolom, prefix, panjang periode)
+    ('sales_orders', 'order_number', 'SO', 6),
+    ('purchase_orders', 'po_number', 'PO', 6),
+    ('purchase_requests', 'pr_number', 'PR', 6),
+    ('sales_returns', 'return_number', 'RET', 6),
+    ('purchase_returns', 'return_number', 'RET', 6),
+    ('material_requests', 'request_number', 'REQ', 8),
+]
+
+def upgrade_db(db_path='instance/warehouse.db'):
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS document_sequences (
+            id INTEGER NOT NULL PRIMARY KEY,
+            prefix VARCHAR(10) NOT NULL,
+            period VARCHAR(8) NOT NULL,
+            last_value INTEGER NOT NULL,
+            CONSTRAINT uq_document_sequences_prefix_period UNIQUE (prefix, period)
+        )
+    """)
+
+    for table, column, prefix, period_len in SOURCES:
+        start = len(prefix) + 2 # posisi periode (1-based) setelah 'PREFIX-'
+        try:
+            c.execute(f"""
+                INSERT INTO document_sequences (prefix, period, last_value)
+                SELECT ?, substr({column}, {start}, {period_len}),
+                       MAX(CAST(substr({column}, {start + period_len + 1}) AS INTEGER))
+                FROM {table}
+                WHERE {column} LIKE ? || '-%' AND length({column}) > {start + period_len}
+                GROUP BY substr({column}, {start}, {period_len})
+                ON CONFLICT (prefix, period) DO UPDATE SET last_value = MAX(last_value, excluded.last_value)
+            """, (prefix, prefix))
+            print(f"Seeded {prefix} counters from {table}.{column} ({c.rowcount} periods).")
+        except sqlite3.OperationalError as e:
+            print(f"Skipped {table}: {e}")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    upgrade_db()
@@ -0,0 +1,23 @@
+from app import create_app, db
+from app.models import Product
+from sqlalchemy import text
+
+app = create_app()
+
+# Migrasi pencarian produk (typeahead /inventory/api/products/search):
+#  - index NOCASE pada products (sku) dan (name) untuk pencarian prefix tanpa scan tabel
+#    (db.create_all() tidak menambah index ke tabel yang sudah ada)
+# Aman dijalankan ulang.
+
+with app.app_context():
+    with db.engine.connect() as conn:
+        for index in sorted(Product.__table__.indexes, key=lambda i: i.name):
+            try:
+                index.create(bind=conn, checkfirst=True)
+                print(f"  OK  {index.name} ({', '.join(str(e) for e in index.expressions)})")
+            except Exception as e:
+                print(f"  ERR {index.name}: {e}")
+
+        conn.execute(text("ANALYZE products"))
+        conn.commit()
+    print("Migrasi index pencarian produk selesai.")
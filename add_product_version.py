@@ -0,0 +1,27 @@
+import sqlite3
+import os
+
+# Migrasi: products.version untuk optimistic check pada StockService
+# (naik setiap stock_quantity berubah).
+
+def upgrade_db():
+    db_path = 'instance/warehouse.db'
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    try:
+        c.execute("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        print("Added version to products.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped products.version: {e}")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    upgrade_db()
@@ -0,0 +1,28 @@
+import sqlite3
+import os
+
+# Migrasi: products.reserved_quantity (cache total reservasi aktif, ATP = stock - reserved).
+# Tabel stock_reservations dibuat otomatis oleh db.create_all().
+# Draft SO lama tidak direservasi; kekurangannya dicek ke ATP saat dikonfirmasi.
+
+def upgrade_db():
+    db_path = 'instance/warehouse.db'
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    try:
+        c.execute("ALTER TABLE products ADD COLUMN reserved_quantity INTEGER NOT NULL DEFAULT 0")
+        print("Added reserved_quantity to products.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped products.reserved_quantity: {e}")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    upgrade_db()
@@ -0,0 +1,30 @@
+import sqlite3
+import os
+
+# Migrasi: sales_orders.external_ref (no. order marketplace / B2B dari import massal)
+# + unique index, supaya file yang sama tidak membuat order dobel.
+
+def upgrade_db():
+    db_path = 'instance/warehouse.db'
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    try:
+        c.execute("ALTER TABLE sales_orders ADD COLUMN external_ref VARCHAR(64)")
+        print("Added external_ref to sales_orders.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped sales_orders.external_ref: {e}")
+
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_sales_orders_external_ref ON sales_orders (external_ref)")
+    print("Ensured index ix_sales_orders_external_ref.")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    upgrade_db()
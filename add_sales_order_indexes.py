@@ -0,0 +1,50 @@
+import argparse
+from app import create_app, db
+from app.models import SalesOrder, SalesOrderItem
+from app.services.sales_service import SalesService
+from sqlalchemy import text
+
+app = create_app()
+
+# Migrasi daftar Sales Order:
+#  - index keyset / filter sales_orders (created_at, id), (status, created_at, id) dan sales_order_items (sales_order_id)
+#    (db.create_all() tidak menambah index ke tabel yang sudah ada)
+#  - created_at kosong pada order lama diisi dari tanggal order (kunci urutan keyset)
+#  - tabel sales_order_status_counts diisi dari data yang ada (counter di halaman Penjualan)
+# Aman dijalankan ulang; --counts-only untuk memperbaiki counter saja.
+#   python add_sales_order_indexes.py
+#   python add_sales_order_indexes.py --counts-only
+
+def main():
+    parser = argparse.ArgumentParser(description='Index & counter status Sales Order')
+    parser.add_argument('--counts-only', action='store_true', help='Hanya hitung ulang counter status')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+
+        if not args.counts_only:
+            with db.engine.connect() as conn:
+                filled = conn.execute(text(
+                    "UPDATE sales_orders SET created_at = COALESCE(date, CURRENT_TIMESTAMP) WHERE created_at IS NULL"
+                )).rowcount
+                print(f"created_at diisi untuk {filled:,} order lama.")
+
+                indexes = list(SalesOrder.__table__.indexes) + list(SalesOrderItem.__table__.indexes)
+                for index in sorted(indexes, key=lambda i: i.name):
+                    try:
+                        index.create(bind=conn, checkfirst=True)
+                        print(f"  OK  {index.name} ({', '.join(c.name for c in index.columns)})")
+                    except Exception as e:
+                        print(f"  ERR {index.name}: {e}")
+
+                conn.execute(text("ANALYZE sales_orders"))
+                conn.execute(text("ANALYZE sales_order_items"))
+                conn.commit()
+
+        counts = SalesService.rebuild_status_counts()
+        db.session.commit()
+        print("Counter status: " + (', '.join(f"{s}={n:,}" for s, n in sorted(counts.items(), key=lambda i: str(i[0]))) or 'kosong'))
+
+if __name__ == '__main__':
+    main()
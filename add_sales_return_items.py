@@ -0,0 +1,27 @@
+from app import create_app, db
+from app.models import BatchTransaction, SalesReturnItem
+from sqlalchemy import text
+
+app = create_app()
+
+# Migrasi retur penjualan per item:
+#  - tabel sales_return_items (db.create_all)
+#  - index batch_transactions (transaction_id) untuk mencari batch asal pengiriman saat retur
+#    (db.create_all() tidak menambah index ke tabel yang sudah ada)
+# Retur lama (hanya nominal, tanpa item) tetap tampil; stoknya tidak dihitung ulang.
+
+with app.app_context():
+    db.create_all()
+
+    with db.engine.connect() as conn:
+        indexes = list(BatchTransaction.__table__.indexes) + list(SalesReturnItem.__table__.indexes)
+        for index in sorted(indexes, key=lambda i: i.name):
+            try:
+                index.create(bind=conn, checkfirst=True)
+                print(f"  OK  {index.name} ({', '.join(c.name for c in index.columns)})")
+            except Exception as e:
+                print(f"  ERR {index.name}: {e}")
+
+        conn.execute(text("ANALYZE batch_transactions"))
+        conn.commit()
+    print("Migrasi retur per item selesai.")
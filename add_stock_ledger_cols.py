@@ -0,0 +1,53 @@
+import re
+import sqlite3
+import os
+
+# Migrasi: kolom transactions untuk snapshot stok & replay kartu stok.
+# - warehouse_id : gudang yang stoknya bergerak (NULL = belum terikat)
+# - stock_delta  : efek bertanda ke stok, diisi ulang untuk baris OPNAME lama
+#                  dari catatan "System: x -> Real: y"
+# Setelah migrasi jalankan: python build_stock_snapshots.py
+
+OPNAME_NOTE = re.compile(r'System:\s*(-?\d+)\s*->\s*Real:\s*(-?\d+)')
+
+def upgrade_db():
+    db_path = 'instance/warehouse.db'
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    # 1. Add warehouse_id & stock_delta to Transactions
+    try:
+        c.execute("ALTER TABLE transactions ADD COLUMN warehouse_id INTEGER REFERENCES warehouses(id)")
+        print("Added warehouse_id to transactions.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped transactions.warehouse_id: {e}")
+
+    try:
+        c.execute("ALTER TABLE transactions ADD COLUMN stock_delta INTEGER")
+        print("Added stock_delta to transactions.")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped transactions.stock_delta: {e}")
+
+    # 2. Backfill direction of old OPNAME rows
+    updates = []
+    unknown = 0
+    for trx_id, quantity, note in c.execute(
+            "SELECT id, quantity, supplier FROM transactions WHERE transaction_type = 'OPNAME' AND stock_delta IS NULL"):
+        match = OPNAME_NOTE.search(note or '')
+        if match:
+            updates.append((int(match.group(2)) - int(match.group(1)), trx_id))
+        else:
+            unknown += 1
+    c.executemany("UPDATE transactions SET stock_delta = ? WHERE id = ?", updates)
+    print(f"Backfilled stock_delta for {len(updates)} OPNAME rows ({unknown} without note, counted as 0).")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    upgrade_db()
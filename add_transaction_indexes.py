@@ -0,0 +1,30 @@
+from app import create_app, db
+from app.models import Transaction, TRANSACTION_INDEX_VERSION
+from sqlalchemy import text
+
+app = create_app()
+
+# Membangun Index Pack tabel transactions (lihat Transaction.__table_args__) pada database lama.
+# db.create_all() tidak menambah index ke tabel yang sudah ada, jadi script ini harus dijalankan sekali
+# setiap TRANSACTION_INDEX_VERSION naik. Versi yang sudah terpasang disimpan di PRAGMA user_version.
+
+with app.app_context():
+    with db.engine.connect() as conn:
+        installed = conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+        if installed >= TRANSACTION_INDEX_VERSION:
+            print(f"Index pack transactions sudah versi {installed}. Tidak ada yang perlu dilakukan.")
+        else:
+            print(f"Upgrade index pack transactions: v{installed} -> v{TRANSACTION_INDEX_VERSION}")
+            for index in sorted(Transaction.__table__.indexes, key=lambda i: i.name):
+                try:
+                    index.create(bind=conn, checkfirst=True)
+                    print(f"  OK  {index.name} ({', '.join(c.name for c in index.columns)})")
+                except Exception as e:
+                    print(f"  ERR {index.name}: {e}")
+
+            # Statistik baru agar query planner SQLite memilih index yang tepat
+            conn.execute(text("ANALYZE transactions"))
+            conn.execute(text(f"PRAGMA user_version = {TRANSACTION_INDEX_VERSION}"))
+            conn.commit()
+            print("Index pack transactions selesai dibangun.")
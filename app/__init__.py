@@ -14,6 +14,10 @@ def create_app():
     db.init_app(app)
     oauth.init_app(app)
 
+    # Session server-side: cookie hanya membawa session id
+    from app.session_store import init_session_store
+    init_session_store(app, db)
+
     with app.app_context():
         # --- 1. IMPORT BLUEPRINT (Pastikan nama file benar) ---
         from app.controllers.auth_controller import auth_bp
@@ -4,6 +4,7 @@ import os
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 import os
+from datetime import timedelta
 
 class Config:
     SECRET_KEY = 'rahasia-pergudangan'
@@ -19,6 +20,21 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Pool koneksi: satu koneksi per request (session server-side ditulis setelah koneksi request dilepas)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_POOL_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    }
+
+    # Session server-side (app/session_store.py): 'sqlite' (tabel server_sessions), 'filesystem', atau 'cookie'
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+    SESSION_FILE_DIR = os.environ.get('SESSION_FILE_DIR') # Default: instance/sessions
+    SESSION_TTL = timedelta(hours=int(os.environ.get('SESSION_TTL_HOURS', 12)))
+
+    # Reservasi stok Draft SO (ReservationService): lepas otomatis setelah TTL
+    RESERVATION_TTL = timedelta(hours=int(os.environ.get('RESERVATION_TTL_HOURS', 48)))
+
     # Setting Email (Biarkan saja)
     MAIL_SERVER = 'smtp.gmail.com'
     MAIL_PORT = 587
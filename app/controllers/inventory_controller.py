@@ -1,9 +1,8 @@
-from flask import Blueprint, request, jsonify, redirect, url_for, flash, session, render_template
-from app.models import Product, Transaction, MaterialRequest, Warehouse, Category, Unit, InventoryStock, PurchaseOrder, PurchaseOrderItem
+from flask import Blueprint, request, jsonify, redirect, url_for, flash, session, render_template, Response, stream_with_context, send_file
+from app.models import Product, Transaction, MaterialRequest, Warehouse, Category, Unit, InventoryStock, PurchaseOrder, PurchaseOrderItem, PrintMetadata
 from app import db
-from datetime import datetime
-from sqlalchemy import func
-import random
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_
 
 inventory_bp = Blueprint('inventory', __name__, url_prefix='/inventory')
 
@@ -82,8 +81,9 @@ def restock_product_web():
         
         product = Product.query.get_or_404(p_id)
         
-        # 1. Tambah Stok
-        product.stock_quantity += amount
+        # 1. Tambah Stok (atomic UPDATE, aman untuk penulis bersamaan)
+        from app.services.stock_service import StockService
+        StockService.adjust(product.id, amount)
         
         # 2. Catat Transaksi Masuk (IN)
         transaction = Transaction(
@@ -133,63 +133,28 @@ def receiving_process():
         
         # Group ID for Printing (Optional, using Reference is easier)
         
-        from app.services.inventory_engine import SmartInventoryEngine
-        from app.services.accounting_service import AccountingService
-
-        created_trxs = []
-
-        for item in items:
-            p_id = item['product_id']
-            qty = int(item['quantity'])
-            cost = float(item.get('cost', 0)) # Item specific cost
-            
-            product = Product.query.get(p_id)
-            if not product: continue
+        # Batches, stock, ledger & ONE purchase journal for the whole document
+        from app.services.receiving_service import ReceivingService
+        result = ReceivingService.receive(
+            lines=items,
+            supplier=supplier,
+            reference=ref,
+            expiry_date=expiry_date
+        )
 
-            # 1. Update Stock & Create Batch
-            SmartInventoryEngine.process_inbound(
-                product_id=product.id,
-                quantity=qty,
-                cost_price=cost if cost > 0 else product.cost,
-                expiry_date=expiry_date,
-                auto_commit=False 
-            )
-            
-            # Update Master Stock
-            product.stock_quantity += qty
-            
-            # 2. Record Transaction
-            trx = Transaction(
-                product_id=product.id,
-                transaction_type='IN',
-                quantity=qty,
-                total_amount=0, 
-                supplier=supplier,    
-                reference=ref         
-            )
-            db.session.add(trx)
-            db.session.flush() # Get ID
-            created_trxs.append(trx)
-
-            # 3. Accounting
-            try:
-                 total_purchase_cost = (cost if cost > 0 else product.cost) * qty
-                 AccountingService.record_purchase(
-                     reference=ref or f"RCV-{trx.id}",
-                     amount=total_purchase_cost,
-                     supplier=supplier
-                 )
-            except Exception as e:
-                 print(f"Accounting Error (Purchase): {e}")
-
-        # Save print address
+        # Save print address (per dokumen di tabel print_metadata, bukan di session)
         if print_address:
             session['last_print_address'] = print_address
-            session[f'print_addr_ref_{ref}'] = print_address # Key by Reference
+            meta = PrintMetadata.query.filter_by(reference=ref).first() or PrintMetadata(reference=ref, doc_type='receiving')
+            meta.print_address = print_address
+            meta.created_by = session.get('user_id')
+            db.session.add(meta)
 
         db.session.commit()
         
-        flash(f'Penerimaan {len(items)} item barang berhasil. Silakan cetak bukti.', 'success')
+        if result['accounting_error']:
+            flash(f"Warning: Accounting entry failed ({result['accounting_error']})", 'warning')
+        flash(f'Penerimaan {result["lines"]} item barang berhasil. Silakan cetak bukti.', 'success')
         return redirect(url_for('inventory.receiving_success_by_ref', ref=ref))
         
     except Exception as e:
@@ -204,7 +169,8 @@ def receiving_success(id):
     
     # Legacy Support or Single Item view
     trx = Transaction.query.get_or_404(id)
-    print_address = session.get(f'print_addr_{id}') or session.get('last_print_address')
+    meta = PrintMetadata.query.filter_by(reference=trx.reference).first() if trx.reference else None
+    print_address = (meta.print_address if meta else None) or session.get('last_print_address')
     
     # Pass as list
     return render_template('inventory/receipt_success.html', transactions=[trx], print_address=print_address, now=datetime.now())
@@ -221,7 +187,8 @@ def receiving_success_by_ref(ref):
         flash('Data transaksi tidak ditemukan untuk dicetak.', 'warning')
         return redirect(url_for('web.inventory'))
         
-    print_address = session.get(f'print_addr_ref_{ref}') or session.get('last_print_address')
+    meta = PrintMetadata.query.filter_by(reference=ref).first()
+    print_address = (meta.print_address if meta else None) or session.get('last_print_address')
     
     # Determine Supplier from first trx
     supplier_name = transactions[0].supplier if transactions else '-'
@@ -302,14 +269,39 @@ def transfer_page():
         flash('Anda tidak memiliki akses ke fitur ini.', 'danger')
         return redirect(url_for('web.index'))
         
-    products = Product.query.order_by(Product.name).all()
+    # Page shell only: products (typeahead), pending requests & transfer history load via JSON
     warehouses = Warehouse.query.order_by(Warehouse.name).all()
-    pending_requests = MaterialRequest.query.filter_by(status='PENDING').order_by(MaterialRequest.created_at.desc()).all()
     
-    # Get Transfer History (Explicit TF)
-    transfers = Transaction.query.filter(Transaction.reference.like('TF-%')).order_by(Transaction.created_at.desc()).limit(20).all()
+    return render_template('transfer.html', warehouses=warehouses)
+
+@inventory_bp.route('/api/material_requests')
+def api_material_requests():
+    """Material requests by status (default PENDING), newest first, keyset cursor ?after=<id>."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    status = (request.args.get('status') or 'PENDING').upper()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    after = request.args.get('after', type=int)
     
-    return render_template('transfer.html', products=products, warehouses=warehouses, requests=pending_requests, transfers=transfers)
+    # Product columns joined in the same SELECT (no lazy load per request)
+    query = db.session.query(
+        MaterialRequest.id, MaterialRequest.request_number, MaterialRequest.quantity,
+        MaterialRequest.branch_name, MaterialRequest.created_at, Product.sku, Product.name
+    ).join(Product, Product.id == MaterialRequest.product_id).filter(MaterialRequest.status == status)
+    if after:
+        query = query.filter(MaterialRequest.id < after)
+    rows = query.order_by(MaterialRequest.id.desc()).limit(limit + 1).all()
+    
+    return jsonify({
+        'success': True,
+        'rows': [{
+            'id': r.id, 'request_number': r.request_number, 'quantity': r.quantity, 'branch_name': r.branch_name,
+            'created_at': r.created_at.strftime('%d/%m %H:%M') if r.created_at else None,
+            'sku': r.sku, 'product_name': r.name
+        } for r in rows[:limit]],
+        'next_cursor': rows[limit - 1].id if len(rows) > limit else None
+    })
 
 @inventory_bp.route('/request_material', methods=['POST'])
 def request_material():
@@ -321,10 +313,9 @@ def request_material():
         branch_name = request.form['branch_name']
         
         # Generate Auto Request Number
-        # Format: REQ-YYYYMMDD-Random4Digit
-        req_date = datetime.now().strftime('%Y%m%d')
-        req_rand = random.randint(1000, 9999)
-        req_no = f"REQ-{req_date}-{req_rand}"
+        # Format: REQ-YYYYMMDD-0001 (counter per day)
+        from app.services.sequence_service import SequenceService
+        req_no = SequenceService.next_number('REQ')
         
         new_request = MaterialRequest(
             request_number=req_no,
@@ -363,9 +354,14 @@ def process_request(req_id):
     req = MaterialRequest.query.get_or_404(req_id)
     
     if action == 'reject':
-        req.status = 'REJECTED'
+        # Same guarded claim as approve: only a PENDING request can be rejected
+        rejected = MaterialRequest.query.filter(MaterialRequest.id == req.id, MaterialRequest.status == 'PENDING')\
+            .update({'status': 'REJECTED'}, synchronize_session=False)
         db.session.commit()
-        flash('Request ditolak.', 'warning')
+        if rejected:
+            flash('Request ditolak.', 'warning')
+        else:
+            flash(f'Request ini sudah {req.status}.', 'danger')
         return redirect(url_for('inventory.transfer_page'))
         
     # If Approve, we process it as a TRANSFER_IN (We are receiving the item requested)
@@ -399,8 +395,15 @@ def process_request(req_id):
             
             product = Product.query.get(req.product_id)
             
-            # Add Stock
-            product.stock_quantity += req.quantity
+            # Claim the request first (PENDING only), so a double submit or a rejected request cannot add stock
+            claimed = MaterialRequest.query.filter(MaterialRequest.id == req.id, MaterialRequest.status == 'PENDING')\
+                .update({'status': 'PROCESSED'}, synchronize_session=False)
+            if not claimed:
+                raise ValueError(f"Request ini sudah {req.status}.")
+            
+            # Add Stock (atomic UPDATE)
+            from app.services.stock_service import StockService
+            StockService.adjust(product.id, req.quantity)
             
             # Log Transaction
             trx = Transaction(
@@ -412,7 +415,6 @@ def process_request(req_id):
                 branch_name=req.branch_name
             )
             
-            req.status = 'PROCESSED'
             db.session.add(trx)
             db.session.commit()
             
@@ -429,84 +431,97 @@ def process_transfer():
     if 'user_id' not in session:
         return redirect(url_for('auth.login_web'))
 
-
-
     try:
-        # New Logic: Warehouse to Warehouse
+        # Warehouse to Warehouse, many lines per document (product_id[] / quantity[] or items_json)
         source_id = int(request.form['source_warehouse_id'])
         dest_id = int(request.form['destination_warehouse_id'])
-        product_id = int(request.form['product_id'])
-        quantity = int(request.form['quantity'])
-        reference = request.form.get('reference', f"TF-{datetime.now().strftime('%Y%m%d%H%M')}")
+        reference = request.form.get('reference') or None
         notes = request.form.get('notes', '')
 
         if source_id == dest_id:
             flash('Gudang asal dan tujuan tidak boleh sama.', 'warning')
             return redirect(url_for('inventory.transfer_page'))
 
-        product = Product.query.get_or_404(product_id)
-        
-        # 1. Validation: Check Source Stock
-        source_stock = InventoryStock.query.filter_by(warehouse_id=source_id, product_id=product_id).first()
-        
-        if not source_stock or source_stock.quantity < quantity:
-            flash(f'Gagal! Stok di gudang asal tidak cukup. Sisa: {source_stock.quantity if source_stock else 0}', 'danger')
-            return redirect(url_for('inventory.transfer_page'))
+        if request.form.get('items_json'):
+            import json
+            lines = json.loads(request.form['items_json'])
+        else:
+            lines = [{'product_id': p_id, 'quantity': qty}
+                     for p_id, qty in zip(request.form.getlist('product_id'), request.form.getlist('quantity')) if p_id]
 
-        # 2. Execute Transfer (Atomic)
-        # Reduce Source
-        source_stock.quantity -= quantity
-        
-        # Increase Dest (Create if not exists)
-        dest_stock = InventoryStock.query.filter_by(warehouse_id=dest_id, product_id=product_id).first()
-        if not dest_stock:
-            dest_stock = InventoryStock(warehouse_id=dest_id, product_id=product_id, quantity=0)
-            db.session.add(dest_stock)
+        from app.services.transfer_service import TransferService
+        doc = TransferService.create_transfer(lines, source_id, dest_id, reference=reference, notes=notes,
+                                              user_id=session.get('user_id'))
+        db.session.commit()
         
-        dest_stock.quantity += quantity
+        flash(f'Transfer {doc.reference} berhasil! {doc.line_count} barang ({doc.total_quantity} unit) dipindahkan '
+              f'dari {doc.source_warehouse.name} ke {doc.destination_warehouse.name}.', 'success')
         
-        # 3. Record Transactions (OUT from Source, IN to Dest) -- OR Single Transfer Record
-        # To maintain checking history, we record 2 transactions or 1 specialized.
-        # Let's record 2 for clear flow in movement history.
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Gagal Transfer: {str(e)}', 'danger')
         
-        source_wh = Warehouse.query.get(source_id)
-        dest_wh = Warehouse.query.get(dest_id)
+    return redirect(url_for('inventory.transfer_page'))
 
-        # OUT Transaction
-        trx_out = Transaction(
-            product_id=product_id,
-            transaction_type='OUT', # Or 'TRANSFER_OUT'
-            quantity=quantity,
-            total_amount=0,
-            reference=reference,
-            branch_name=f"Transfer to {dest_wh.name}", # abusing branch_name for context
-            supplier=f"From {source_wh.name}" # abuse supplier field strictly for context
-        )
-        
-        # IN Transaction
-        trx_in = Transaction(
-            product_id=product_id,
-            transaction_type='IN', # Or 'TRANSFER_IN'
-            quantity=quantity,
-            total_amount=0,
-            reference=reference,
-            branch_name=f"Transfer from {source_wh.name}",
-            supplier=f"To {dest_wh.name}"
+@inventory_bp.route('/transfer/upload', methods=['POST'])
+def upload_transfer():
+    if 'user_id' not in session:
+        return redirect(url_for('auth.login_web'))
+
+    try:
+        file = request.files.get('file')
+        if not file or not file.filename:
+            raise ValueError("Pilih file CSV/JSON terlebih dahulu.")
+
+        from app.services.transfer_service import TransferService
+        lines = TransferService.parse_upload(file.filename, file.read())
+        doc = TransferService.create_transfer(
+            lines,
+            request.form['source_warehouse_id'],
+            request.form['destination_warehouse_id'],
+            reference=request.form.get('reference') or None,
+            notes=request.form.get('notes', ''),
+            user_id=session.get('user_id')
         )
-        
-        db.session.add(trx_out)
-        db.session.add(trx_in)
-        
         db.session.commit()
-        
-        flash(f'Transfer berhasil! {quantity} {product.unit} dipindahkan dari {source_wh.name} ke {dest_wh.name}.', 'success')
-        
+
+        flash(f'Upload transfer {doc.reference} berhasil: {doc.line_count} baris, {doc.total_quantity} unit.', 'success')
+
     except Exception as e:
         db.session.rollback()
-        flash(f'Gagal Transfer: {str(e)}', 'danger')
-        
+        flash(f'Gagal Upload Transfer: {str(e)}', 'danger')
+
     return redirect(url_for('inventory.transfer_page'))
 
+@inventory_bp.route('/api/transfers', methods=['POST'])
+def api_create_transfer():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        from app.services.transfer_service import TransferService
+        doc = TransferService.create_transfer(
+            data.get('lines') or [],
+            data.get('source_warehouse_id'),
+            data.get('destination_warehouse_id'),
+            reference=data.get('reference'),
+            notes=data.get('notes'),
+            user_id=session.get('user_id')
+        )
+        db.session.commit()
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'id': doc.id,
+        'reference': doc.reference,
+        'line_count': doc.line_count,
+        'total_quantity': doc.total_quantity
+    }), 201
+
 @inventory_bp.route('/print_transfer/<int:trx_id>')
 def print_transfer(trx_id):
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
@@ -514,6 +529,16 @@ def print_transfer(trx_id):
     return render_template('print_transfer.html', trx=trx)
 
 # --- [BARU] Laporan Stock Ageing (Smart Inventory) ---
+def _ageing_filters():
+    sort = request.args.get('sort', 'age_days')
+    direction = request.args.get('dir', 'desc')
+    return {
+        'bucket': request.args.get('bucket') or None,
+        'category': request.args.get('category') or None,
+        'sort': sort if sort in ('age_days', 'qty', 'value', 'product', 'expiry') else 'age_days',
+        'direction': 'asc' if direction == 'asc' else 'desc',
+    }
+
 @inventory_bp.route('/aging_report')
 def aging_report():
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
@@ -525,15 +550,81 @@ def aging_report():
 
     from app.services.inventory_engine import SmartInventoryEngine
     
-    # Get Aging Data
-    aging_data = SmartInventoryEngine.get_stock_ageing_report()
+    filters = _ageing_filters()
+    page = request.args.get('page', 1, type=int)
+
+    # Get Aging Data (1 halaman, bucketing & sorting di SQL)
+    aging_page = SmartInventoryEngine.get_stock_ageing_report(page=page, per_page=50, **filters)
+    bucket_rollup = SmartInventoryEngine.get_stock_ageing_rollup('bucket', category=filters['category'])
+    category_rollup = SmartInventoryEngine.get_stock_ageing_rollup('category', bucket=filters['bucket'])
     
-    # Calculate Total Valuation
+    # Calculate Total Valuation (from valuation ledger)
     total_valuation = SmartInventoryEngine.calculate_valuation_fifo()
+    category_valuation = SmartInventoryEngine.get_valuation_by_category()
     
     return render_template('inventory_aging.html', 
-                           aging_data=aging_data, 
-                           total_valuation=total_valuation)
+                           aging_data=aging_page.items,
+                           aging_page=aging_page,
+                           bucket_rollup=bucket_rollup,
+                           category_rollup=category_rollup,
+                           buckets=[b[0] for b in SmartInventoryEngine.AGEING_BUCKETS],
+                           filters=filters,
+                           total_valuation=total_valuation,
+                           category_valuation=category_valuation)
+
+@inventory_bp.route('/aging_report/export')
+def export_aging_report():
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+
+    if session.get('role') not in ['admin', 'manager'] and 'inventory' not in session.get('features', []):
+        flash('Anda tidak memiliki akses ke fitur ini.', 'danger')
+        return redirect(url_for('web.index'))
+
+    from app.services.inventory_engine import SmartInventoryEngine
+    import csv
+    import io
+
+    filters = _ageing_filters()
+    export_format = request.args.get('format', 'csv')
+    header = ['Produk', 'SKU', 'Kategori Produk', 'Batch', 'Qty', 'Nilai (FIFO)', 'Kadaluarsa', 'Umur (Hari)', 'Status']
+
+    def to_row(r):
+        return [r.product, r.sku, r.product_category, r.batch, r.qty, r.value,
+                r.expiry.strftime('%Y-%m-%d') if r.expiry else '', r.age_days, r.category]
+
+    stamp = datetime.now().strftime('%Y%m%d_%H%M')
+
+    if export_format == 'xlsx':
+        # Write-only workbook: baris ditulis satu per satu, tanpa DataFrame
+        from openpyxl import Workbook
+        import tempfile
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Stock Ageing')
+        ws.append(header)
+        for r in SmartInventoryEngine.iter_stock_ageing_rows(**filters):
+            ws.append(to_row(r))
+
+        output = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        wb.save(output)
+        output.seek(0)
+        return send_file(output, download_name=f"Stock_Ageing_{stamp}.xlsx", as_attachment=True,
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for i, r in enumerate(SmartInventoryEngine.iter_stock_ageing_rows(**filters), start=1):
+            writer.writerow(to_row(r))
+            if i % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=Stock_Ageing_{stamp}.csv'})
 
 # --- [BARU] Stock Opname Feature ---
 
@@ -543,103 +634,139 @@ def opname_form():
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
     products = Product.query.order_by(Product.rack_location).all()
     warehouses = Warehouse.query.all()
-    # Auto-ref
-    ref = f"OPN-{datetime.now().strftime('%Y%m%d%H%M')}"
-    return render_template('opname.html', products=products, warehouses=warehouses, ref_number=ref)
+    # Ref. opname is numbered when posted (OPN-YYYYMMDD-0001), not on every page view
+    return render_template('opname.html', products=products, warehouses=warehouses)
+
+@inventory_bp.route('/cycle_count')
+def cycle_count():
+    """Daily cycle-count list (ABC by movement value, balanced per rack zone)."""
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    from app.services.cycle_count_service import CycleCountService
+    
+    try:
+        count_date = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        count_date = datetime.now().date()
+    
+    tasks = CycleCountService.get_plan(count_date)
+    return render_template('inventory/cycle_count.html', tasks=tasks, count_date=count_date,
+                           planned=any(t.count_date == count_date for t in tasks),
+                           overdue=sum(1 for t in tasks if t.count_date < count_date),
+                           pending=sum(1 for t in tasks if t.status == 'Pending'))
+
+@inventory_bp.route('/cycle_count/generate', methods=['POST'])
+def generate_cycle_count():
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    from app.services.cycle_count_service import CycleCountService
+    
+    try:
+        count_date = datetime.strptime(request.form.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        count_date = datetime.now().date()
+    
+    try:
+        total = CycleCountService.generate_plan(count_date, budget=request.form.get('budget', type=int))
+        db.session.commit()
+        flash(f'Daftar hitung {count_date.strftime("%d/%m/%Y")}: {total} produk.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Gagal membuat daftar hitung: {str(e)}', 'danger')
+    
+    return redirect(url_for('inventory.cycle_count', date=count_date.isoformat()))
 
 @inventory_bp.route('/process_opname', methods=['POST'])
 def process_opname():
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
     
     try:
-        ref = request.form['reference']
+        ref = request.form.get('reference') or None # Kosong = nomor otomatis (OPN / CC)
+        prefix = 'CC' if request.form.get('cycle_date') else 'OPN'
         notes = request.form.get('notes', '')
         
-        # Iterate through submitted products
-        # Form structure: real_qty_{product_id}
-        
-        updated_count = 0
-        
-        for key, value in request.form.items():
-            if key.startswith('real_qty_') and value:
-                product_id = int(key.split('_')[2])
-                real_qty = int(value)
-                
-                product = Product.query.get(product_id)
-                system_qty = product.stock_quantity
-                
-                diff = real_qty - system_qty
-                
-                if diff != 0:
-                    # Adjustment needed
-                    
-                    # 1. Update Master Stock
-                    product.stock_quantity = real_qty
-                    
-                    # 2. Create Transaction (Adjustment)
-                    # Diff > 0 means FOUND extra items (IN)
-                    # Diff < 0 means LOST items (OUT or LOSS)
-                    # We just label it 'OPNAME' and store the signed quantity or handle strictly
-                    
-                    # Store absolute quantity for transaction record usually, BUT
-                    # For accounting, we need to know if it's + or -
-                    # Let's simple use 'OPNAME' and store the DIFF as quantity (can be negative? No, usually quantity is unsigned in many systems, 
-                    # but check data type. If signed allowed fine. If not, use Types 'OPNAME_IN' / 'OPNAME_OUT')
-                    
-                    # DB Schema: quantity is Integer. SQLite allows negative.
-                    # But Logic usually: Transaction Type defines direction.
-                    
-                    t_type = 'OPNAME'
-                    
-                    trx = Transaction(
-                        product_id=product.id,
-                        transaction_type=t_type,
-                        quantity=abs(diff), # Store magnitude
-                        total_amount=0, # Adjustment has 0 revenue/cost usually, or calculated
-                        reference=ref,
-                        supplier=f"System: {system_qty} -> Real: {real_qty}", # Abuse supplier field for notes
-                        branch_name=notes
-                    )
-                    
-                    # Special handling: if diff is negative, it's effectively an OUT equivalent for stock calc
-                    # But we already forced product.stock_quantity = real_qty.
-                    # The transaction log allows us to reconstruct.
-                    # If we used the transaction to DRIVE the stock, we would add/subtract `diff`.
-                    # Since we Force Set, the transaction is just a Receipt/Log.
-                    
-                    db.session.add(trx)
-                    updated_count += 1
-                    
-                    # --- ACCOUNTING HOOK (ADJUSTMENT) ---
-                    try:
-                        from app.services.accounting_service import AccountingService
-                        # diff is Real - System.
-                        # If diff < 0 (Real < System): LOSS (Missing stock). is_loss=True
-                        # If diff > 0 (Real > System): GAIN (Found stock). is_loss=False
-                        is_loss = diff < 0
-                        amount_abs = abs(diff) * product.cost # Valuation based on cost
-                        
-                        AccountingService.record_adjustment(
-                            reference=f"{ref} ({product.sku})",
-                            amount=amount_abs,
-                            is_loss=is_loss
-                        )
-                    except Exception as e:
-                        print(f"Accounting Error (Opname): {e}")
+        # Form structure: real_qty_{product_id} (kosong = tidak dihitung)
+        counts = {
+            int(key.split('_')[2]): int(value)
+            for key, value in request.form.items()
+            if key.startswith('real_qty_') and value
+        }
         
-        db.session.commit()
+        from app.services.opname_service import OpnameService
+        from app.services.stock_service import StockService
         
-        if updated_count > 0:
-            flash(f'Stock Opname Selesai! {updated_count} produk disesuaikan.', 'success')
+        # One unit of work: if another writer changes a product mid-opname (version check),
+        # everything is rolled back and recomputed from fresh system quantities.
+        report = StockService.run_with_retry(lambda: OpnameService.post_counts(counts, ref, notes=notes, prefix=prefix))
+        
+        if report['adjusted'] > 0:
+            flash(f"Stock Opname {report['reference']} Selesai! {report['adjusted']} produk disesuaikan.", 'success')
         else:
             flash('Tidak ada perbedaan stok yang ditemukan.', 'info')
             
     except Exception as e:
         db.session.rollback()
         flash(f'Error Opname: {str(e)}', 'danger')
-        
+    
+    if request.form.get('cycle_date'):
+        return redirect(url_for('inventory.cycle_count', date=request.form['cycle_date']))
     return redirect(url_for('web.inventory'))
 
+@inventory_bp.route('/opname/upload', methods=['POST'])
+def upload_opname():
+    """Counted sheet (CSV/XLSX) for a full-warehouse count; shows the variance report."""
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    
+    file = request.files.get('file')
+    if not file or not file.filename:
+        flash('Pilih file hasil hitung (CSV/XLSX) terlebih dahulu.', 'warning')
+        return redirect(url_for('inventory.opname_form'))
+    
+    try:
+        from app.services.opname_service import OpnameService
+        warehouse_id = request.form.get('warehouse_id', type=int)
+        report = OpnameService.import_sheet(
+            file.filename, file.stream,
+            reference=request.form.get('reference') or None,
+            warehouse_id=warehouse_id,
+            notes=request.form.get('notes', '')
+        )
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error Opname: {str(e)}', 'danger')
+        return redirect(url_for('inventory.opname_form'))
+    
+    warehouse = Warehouse.query.get(warehouse_id) if warehouse_id else None
+    return render_template('inventory/opname_variance.html', report=report, warehouse=warehouse)
+
+@inventory_bp.route('/opname/variance.csv')
+def opname_variance_csv():
+    """Variance report of a posted opname reference (streamed from the OPNAME rows)."""
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    
+    import csv
+    import io
+
+    ref = request.args.get('reference', '')
+    query = db.session.query(
+        Product.sku, Product.name, Transaction.stock_delta, Transaction.supplier, Product.cost
+    ).join(Product, Product.id == Transaction.product_id).filter(
+        Transaction.reference == ref, Transaction.transaction_type == 'OPNAME'
+    ).order_by(Product.sku).yield_per(1000)
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['SKU', 'Nama Barang', 'Selisih', 'Keterangan', 'Estimasi Nilai'])
+        for i, (sku, name, delta, note, cost) in enumerate(query, start=1):
+            writer.writerow([sku, name, delta, note, round((delta or 0) * (cost or 0), 2)])
+            if i % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=Opname_Variance_{ref}.csv'})
+
 # --- INVENTORY MANAGEMENT FEATURES ---
 
 @inventory_bp.route('/attributes')
@@ -698,38 +825,154 @@ def add_warehouse():
         flash(f'Gagal: {e}', 'danger')
     return redirect(url_for('inventory.manage_attributes'))
 
+STOCK_CARD_PAGE_SIZE = 100
+
+def _stock_card_filters():
+    # Periode kartu stok (default 30 hari terakhir)
+    today = datetime.now().date()
+    try:
+        start_date = datetime.strptime(request.args.get('start_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        start_date = today - timedelta(days=30)
+    try:
+        end_date = datetime.strptime(request.args.get('end_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        end_date = today
+    return {'start_date': start_date, 'end_date': end_date, 'warehouse_id': request.args.get('warehouse_id', type=int)}
+
 @inventory_bp.route('/stock_card/<int:product_id>')
 def stock_card(product_id):
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
     
     product = Product.query.get_or_404(product_id)
     
-    # Get transactions sorted by date
-    # Optional: Filter by Warehouse if we implement that fully.
-    # Currently viewing GLOBAL stock movement.
-    transactions = Transaction.query.filter_by(product_id=product_id)\
-        .order_by(Transaction.created_at.desc()).limit(100).all()
+    # Halaman pertama; halaman berikutnya lewat stock_card_rows (infinite scroll)
+    from app.services.stock_ledger import StockLedgerService
+    filters = _stock_card_filters()
+    card = StockLedgerService.get_stock_card(product_id, filters['start_date'], filters['end_date'],
+                                             warehouse_id=filters['warehouse_id'], limit=STOCK_CARD_PAGE_SIZE)
         
     # Warehouse Stocks breakdown
     # Make sure we have stocks for this product in all warehouses
     # Query InventoryStock
     stocks = InventoryStock.query.filter_by(product_id=product_id).all()
+    warehouses = Warehouse.query.all()
+    
+    return render_template('inventory/stock_card.html', product=product, card=card, stocks=stocks,
+                           warehouses=warehouses, filters=filters)
+
+@inventory_bp.route('/stock_card/<int:product_id>/rows')
+def stock_card_rows(product_id):
+    """Next page of the stock card (JSON, keyset cursor = id and balance of the last row shown)."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    from app.services.stock_ledger import StockLedgerService
+    filters = _stock_card_filters()
+    card = StockLedgerService.get_stock_card(product_id, filters['start_date'], filters['end_date'],
+                                             warehouse_id=filters['warehouse_id'],
+                                             after_id=request.args.get('after', type=int),
+                                             after_balance=request.args.get('balance', type=int),
+                                             limit=min(request.args.get('limit', STOCK_CARD_PAGE_SIZE, type=int), 500))
     
-    return render_template('inventory/stock_card.html', product=product, transactions=transactions, stocks=stocks)
+    return jsonify({
+        'success': True,
+        'rows': [{
+            'id': row['transaction'].id,
+            'created_at': row['transaction'].created_at.strftime('%d/%m/%Y %H:%M'),
+            'type': row['transaction'].transaction_type,
+            'reference': row['transaction'].reference,
+            'note': row['transaction'].branch_name or row['transaction'].supplier or '',
+            'delta': row['delta'],
+            'balance': row['balance']
+        } for row in card['rows']],
+        'next_cursor': card['next_cursor'],
+        'next_balance': card['next_balance']
+    })
 
 @inventory_bp.route('/report/movements')
 def movement_history():
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    from app.services.movement_service import MovementService
     
-    products = Product.query.order_by(Product.name).all()
+    # Filter (halaman pertama; berikutnya lewat api_movements)
+    filters = MovementService.parse_filters(request.args)
+    rows, next_cursor = MovementService.page(filters)
     
-    # Filter
-    p_id = request.args.get('product_id', type=int)
+    selected_product = db.session.get(Product, filters['product_id']) if filters['product_id'] else None
+    warehouses = Warehouse.query.order_by(Warehouse.name).all()
     
-    query = Transaction.query.order_by(Transaction.created_at.desc())
-    if p_id:
-        query = query.filter_by(product_id=p_id)
-        
-    transactions = query.limit(200).all()
+    return render_template('inventory/movement_history.html', rows=rows, next_cursor=next_cursor,
+                           filters=filters, selected_product=selected_product, warehouses=warehouses,
+                           movement_types=MovementService.MOVEMENT_TYPES)
+
+@inventory_bp.route('/api/movements')
+def api_movements():
+    """Movement history as JSON: same filters as the page, keyset cursor ?after=<id>."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    from app.services.movement_service import MovementService
+    
+    filters = MovementService.parse_filters(request.args)
+    rows, next_cursor = MovementService.page(filters, after_id=request.args.get('after', type=int),
+                                             limit=min(request.args.get('limit', MovementService.PAGE_SIZE, type=int), 500))
+    
+    return jsonify({'success': True, 'rows': [MovementService.to_dict(r) for r in rows], 'next_cursor': next_cursor})
+
+@inventory_bp.route('/report/movements/export')
+def export_movements():
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    from app.services.movement_service import MovementService
+    import csv
+    import io
+    
+    filters = MovementService.parse_filters(request.args)
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Tanggal', 'SKU', 'Produk', 'Tipe', 'Qty', 'Efek Stok', 'Gudang', 'Referensi', 'Cabang', 'Supplier/Ket.'])
+        for i, r in enumerate(MovementService.iter_rows(filters), start=1):
+            writer.writerow([r.created_at.strftime('%Y-%m-%d %H:%M:%S') if r.created_at else '', r.sku, r.product_name,
+                             r.transaction_type, r.quantity, int(r.delta or 0), r.warehouse_name or '',
+                             r.reference or '', r.branch_name or '', r.supplier or ''])
+            if i % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    
+    stamp = datetime.now().strftime('%Y%m%d_%H%M')
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=Movement_History_{stamp}.csv'})
+
+@inventory_bp.route('/api/products/search')
+def api_search_products():
+    """
+    Server-side product typeahead: SKU or name prefix (case-insensitive), max 20 results.
+    Prefixes are ranges on the NOCASE indexes, so a keystroke is two index seeks
+    instead of a LIKE scan over the whole products table.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
-    return render_template('inventory/movement_history.html', transactions=transactions, products=products, selected_product=p_id)
\ No newline at end of file
+    q = (request.args.get('q') or '').strip()
+    if len(q) < 2:
+        return jsonify({'success': True, 'results': []})
+    
+    limit = min(request.args.get('limit', 20, type=int), 50)
+    warehouse_id = request.args.get('warehouse_id', type=int)
+    
+    # Optional warehouse_id: stock in that warehouse instead of the company total
+    stock_col = func.coalesce(InventoryStock.quantity, 0) if warehouse_id else Product.stock_quantity
+    query = db.session.query(Product.id, Product.sku, Product.name, Product.unit, stock_col.label('stock'))
+    if warehouse_id:
+        query = query.outerjoin(InventoryStock, (InventoryStock.product_id == Product.id) & (InventoryStock.warehouse_id == warehouse_id))
+    # Prefix as a range (uses ix_products_sku_nocase / ix_products_name_nocase, unlike LIKE on SQLite)
+    sku, name = Product.sku.collate('NOCASE'), Product.name.collate('NOCASE')
+    rows = query.filter(or_(and_(sku >= q, sku < q + '\uffff'), and_(name >= q, name < q + '\uffff')))\
+        .order_by(Product.name).limit(limit).all()
+    
+    return jsonify({'success': True, 'results': [
+        {'id': r.id, 'sku': r.sku, 'name': r.name, 'stock': r.stock, 'unit': r.unit} for r in rows
+    ]})
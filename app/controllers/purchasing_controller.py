@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from app.models import Supplier, PurchaseOrder, PurchaseOrderItem, Product, PurchaseReturn, db, Transaction, PurchaseRequest, PurchaseRequestItem
 from app.services.accounting_service import AccountingService
+from app.services.sequence_service import SequenceService
 from datetime import datetime
 import json
 
@@ -51,8 +52,7 @@ def create_po():
             date_str = request.form['date']
             items_json = request.form['items_json']
             
-            po_count = PurchaseOrder.query.filter(PurchaseOrder.date == date_str).count() + 1
-            po_number = f"PO-{datetime.now().strftime('%Y%m')}-{po_count:04d}"
+            po_number = SequenceService.next_number('PO')
             
             new_po = PurchaseOrder(
                 po_number=po_number,
@@ -122,27 +122,35 @@ def receive_po(id):
 
     try:
         from app.services.inventory_engine import SmartInventoryEngine
+        from app.services.stock_service import StockService
+        
+        # Claim the PO first, so a double submit cannot receive it twice
+        claimed = PurchaseOrder.query.filter(PurchaseOrder.id == po.id, PurchaseOrder.status != 'Received')\
+            .update({'status': 'Received'}, synchronize_session=False)
+        if not claimed:
+            raise ValueError("PO ini sudah diterima.")
         
         # Full Receive Logic (Assume all items arrived)
-        for item in po.items:
-            # Skip if already fully received (though UI checks status, safe implementation)
-            if item.received_qty >= item.quantity:
-                continue
-                
+        # Skip if already fully received (though UI checks status, safe implementation)
+        open_items = [item for item in po.items if item.received_qty < item.quantity]
+        warehouse_id = SmartInventoryEngine.get_default_warehouse_id()
+        products = {p.id: p for p in Product.query.filter(Product.id.in_({i.product_id for i in open_items})).all()}
+
+        # 1. Use Smart Engine for Stock & Batch (bulk, all PO lines at once)
+        SmartInventoryEngine.process_inbound_many([{
+            'product_id': item.product_id,
+            'quantity': item.quantity - item.received_qty,
+            'cost_price': item.unit_cost,
+            'expiry_date': None # Future: Allow inputting expiry during PO Receive
+        } for item in open_items], auto_commit=False)
+
+        # Update Master Stock (Denormalization, atomic UPDATE per product)
+        StockService.adjust_many([(item.product_id, item.quantity - item.received_qty) for item in open_items])
+
+        for item in open_items:
             qty_to_receive = item.quantity - item.received_qty
             
-            # 1. Use Smart Engine for Stock & Batch
-            SmartInventoryEngine.process_inbound(
-                product_id=item.product_id,
-                quantity=qty_to_receive,
-                cost_price=item.unit_cost,
-                expiry_date=None, # Future: Allow inputting expiry during PO Receive
-                auto_commit=False
-            )
-            
-            # Update Master Stock (Denormalization)
-            product = item.product
-            product.stock_quantity += qty_to_receive
+            product = products[item.product_id]
             product.cost = item.unit_cost # Last Purchase Price
             
             item.received_qty = item.quantity
@@ -152,8 +160,10 @@ def receive_po(id):
                 product_id=product.id,
                 transaction_type='IN',
                 quantity=qty_to_receive,
+                total_amount=0,
                 supplier='PO ' + po.po_number,
                 reference='RCV-' + po.po_number,
+                warehouse_id=warehouse_id,
                 created_at=datetime.utcnow()
             )
             db.session.add(trx)
@@ -168,7 +178,6 @@ def receive_po(id):
         except Exception as e:
              print(f"Accounting Hook Error: {e}")
              
-        po.status = 'Received'
         db.session.commit()
         
         flash('Barang berhasil diterima! Stok & Akuntansi terupdate (Batch Created).', 'success')
@@ -199,8 +208,7 @@ def create_pr():
             items_json = request.form['items_json']
             
             # Generate PR Number: PR-YYYYMM-XXXX
-            count = PurchaseRequest.query.filter(func.strftime('%Y-%m', PurchaseRequest.date) == datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y-%m')).count() + 1
-            pr_number = f"PR-{datetime.now().strftime('%Y%m')}-{count:04d}"
+            pr_number = SequenceService.next_number('PR')
             
             new_pr = PurchaseRequest(
                 pr_number=pr_number,
@@ -266,8 +274,7 @@ def create_return(id):
             reason = request.form['reason']
             
             # Return Number
-            ret_count = PurchaseReturn.query.count() + 1
-            ret_number = f"RET-{datetime.now().strftime('%Y%m')}-{ret_count:04d}"
+            ret_number = SequenceService.next_number('RET')
             
             new_ret = PurchaseReturn(
                 return_number=ret_number,
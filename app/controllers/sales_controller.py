@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from app.models import SalesOrder, SalesOrderItem, Product, Customer, Transaction, SalesReturn, db
-from app.services.accounting_service import AccountingService
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app, send_from_directory
+from app.models import SalesOrder, Product, Customer, SalesReturn, db
+from app.services.stock_service import StockService
+from app.services.sales_service import SalesService
+from app.services.sales_import_service import SalesImportService
+from app.services.sales_report_service import SalesReportService
 from datetime import datetime
 import json
+import os
 
 sales_bp = Blueprint('sales', __name__, url_prefix='/sales')
 
@@ -10,20 +14,24 @@ sales_bp = Blueprint('sales', __name__, url_prefix='/sales')
 def index():
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
     
-    page = request.args.get('page', 1, type=int)
-    status_filter = request.args.get('status')
-    
-    query = SalesOrder.query.order_by(SalesOrder.created_at.desc())
-    if status_filter:
-        query = query.filter_by(status=status_filter)
-        
-    orders = query.paginate(page=page, per_page=10)
+    filters = {
+        'status': request.args.get('status') or None,
+        'start_date': request.args.get('start_date') or None,
+        'end_date': request.args.get('end_date') or None
+    }
+    try:
+        dates = {k: datetime.strptime(filters[k], '%Y-%m-%d').date() if filters[k] else None
+                 for k in ('start_date', 'end_date')}
+    except ValueError:
+        flash('Format tanggal tidak valid.', 'warning')
+        dates = {'start_date': None, 'end_date': None}
     
-    # Calculate stats
-    pending_count = SalesOrder.query.filter_by(status='Draft').count()
-    unpaid_count = SalesOrder.query.filter_by(status='Confirmed').count()
+    # Keyset page on (created_at, id) + status counters table (no OFFSET / COUNT per load)
+    orders, next_cursor = SalesService.page(dict(filters, **dates), after_id=request.args.get('after', type=int))
+    counts = SalesService.status_counts()
     
-    return render_template('sales/index.html', orders=orders, pending=pending_count, unpaid=unpaid_count)
+    return render_template('sales/index.html', orders=orders, next_cursor=next_cursor, filters=filters,
+                           counts=counts, pending=counts['Draft'], unpaid=counts['Confirmed'])
 
 @sales_bp.route('/create', methods=['GET', 'POST'])
 def create_order():
@@ -44,50 +52,12 @@ def create_order():
             if due_date_str:
                 due_date = datetime.strptime(due_date_str, '%Y-%m-%d').date()
             
-            # Generate SO Number
-            so_count = SalesOrder.query.filter(SalesOrder.date == order_date).count() + 1
-            so_number = f"SO-{order_date.strftime('%Y%m')}-{so_count:04d}"
-            
-            # Create Order Header
-            new_so = SalesOrder(
-                order_number=so_number,
-                customer_id=customer_id,
-                date=order_date,
-                due_date=due_date,
-                status='Draft',
-                notes=notes
-            )
-            
-            db.session.add(new_so)
-            db.session.flush() # Get ID
-            
-            # Process Items
-            items = json.loads(items_json)
-            total = 0
-            
-            for item in items:
-                 p_id = int(item['product_id'])
-                 qty = int(item['qty'])
-                 
-                 product = Product.query.get(p_id)
-                 price = product.price # Use current price
-                 subtotal = price * qty
-                 
-                 so_item = SalesOrderItem(
-                     sales_order_id=new_so.id,
-                     product_id=p_id,
-                     quantity=qty,
-                     price=price,
-                     subtotal=subtotal
-                 )
-                 db.session.add(so_item)
-                 total += subtotal
-            
-            new_so.total_amount = total
-            new_so.grand_total = total # No tax/discount logic yet
+            # Lines validated in one pass, items bulk inserted, stock reserved (SalesService)
+            new_so = SalesService.create_order(customer_id, order_date, json.loads(items_json or '[]'),
+                                               due_date=due_date, notes=notes)
             
             db.session.commit()
-            flash(f'Sales Order {so_number} berhasil dibuat (Draft).', 'success')
+            flash(f'Sales Order {new_so.order_number} berhasil dibuat (Draft).', 'success')
             return redirect(url_for('sales.view_order', id=new_so.id))
             
         except Exception as e:
@@ -95,12 +65,46 @@ def create_order():
             flash(f'Gagal: {str(e)}', 'danger')
             return redirect(url_for('sales.create_order'))
             
-    products = Product.query.filter(Product.stock_quantity > 0).order_by(Product.name).all()
+    # Sellable = available to promise (stock not reserved by other drafts)
+    atp = (Product.stock_quantity - Product.reserved_quantity).label('available')
+    products = db.session.query(Product.id, Product.name, Product.price, atp)\
+        .filter(Product.stock_quantity - Product.reserved_quantity > 0).order_by(Product.name).all()
     customers = Customer.query.order_by(Customer.name).all()
     today = datetime.now().strftime('%Y-%m-%d')
     
     return render_template('sales/form.html', products=products, customers=customers, today=today)
 
+@sales_bp.route('/import', methods=['GET', 'POST'])
+def import_orders():
+    """Bulk Draft orders from a CSV / JSON-lines file (marketplace, B2B)."""
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    
+    report, report_file = None, None
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Pilih file order (CSV/JSON) terlebih dahulu.', 'warning')
+            return redirect(url_for('sales.import_orders'))
+        
+        try:
+            report = SalesImportService.import_file(file.filename, file.stream,
+                                                    chunk_size=request.form.get('chunk_size', type=int))
+            if report['errors']:
+                report_file = SalesImportService.save_error_report(
+                    report['errors'], os.path.join(current_app.instance_path, 'import_reports'))
+            flash(f"Import selesai: {report['imported_orders']} order ({report['imported_lines']} baris) dibuat.", 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Gagal Import: {str(e)}', 'danger')
+    
+    return render_template('sales/import.html', report=report, report_file=report_file)
+
+@sales_bp.route('/import/report/<name>')
+def import_error_report(name):
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    return send_from_directory(os.path.join(current_app.instance_path, 'import_reports'), name,
+                               as_attachment=True, mimetype='text/csv')
+
 @sales_bp.route('/<int:id>')
 def view_order(id):
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
@@ -119,46 +123,13 @@ def confirm_order(id):
         return redirect(url_for('sales.view_order', id=id))
         
     try:
-        # 1. Deduct Stock & Create Stock Ledger (Transaction)
-        cogs_total = 0
-        
-        for item in order.items:
-            product = item.product
-            
-            # Validate Stock
-            if product.stock_quantity < item.quantity:
-                raise ValueError(f"Stok {product.name} tidak cukup! (Sisa: {product.stock_quantity})")
-                
-            product.stock_quantity -= item.quantity
-            cogs_total += product.cost * item.quantity
-            
-            # Record Stock Transaction
-            trx = Transaction(
-                product_id=product.id,
-                transaction_type='OUT',
-                quantity=item.quantity,
-                total_amount=item.subtotal,
-                reference=order.order_number,
-                customer_id=order.customer_id,
-                fulfillment_status='pending' # Trigger Warehouse Picking
-            )
-            db.session.add(trx)
-            
-        # 2. Accounting Journals
-        try:
-             AccountingService.record_sale(
-                 reference=order.order_number,
-                 total_amount=order.grand_total,
-                 cogs_amount=cogs_total
-             )
-        except Exception as e:
-             flash(f"Warning: Accounting entry failed ({e})", 'warning')
-             
-        # 3. Update Status
-        order.status = 'Confirmed'
-        db.session.commit()
+        # Reservation -> stock out, FIFO batches & COGS from layer costs (SalesService),
+        # committed as one unit (retried on a locked database)
+        result = StockService.run_with_retry(lambda: SalesService.confirm_order(id))
         
-        flash('Order dikonfirmasi! Stok berkurang & Jurnal tercatat.', 'success')
+        if result['accounting_error']:
+            flash(f"Warning: Accounting entry failed ({result['accounting_error']})", 'warning')
+        flash(f"Order dikonfirmasi! Stok berkurang & Jurnal tercatat (HPP FIFO Rp {result['cogs']:,.0f}).", 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -166,15 +137,34 @@ def confirm_order(id):
         
     return redirect(url_for('sales.view_order', id=id))
 
+@sales_bp.route('/<int:id>/cancel', methods=['POST'])
+def cancel_order(id):
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    
+    try:
+        StockService.run_with_retry(lambda: SalesService.cancel_order(id))
+        flash('Order dibatalkan, reservasi stok dilepas.', 'success')
+        
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Gagal Batal: {str(e)}', 'danger')
+        
+    return redirect(url_for('sales.view_order', id=id))
+
 @sales_bp.route('/<int:id>/paid', methods=['POST'])
 def mark_paid(id):
-     # Mark as Paid (Cash In) logic could go here later
-     # For now just status update
-     order = SalesOrder.query.get_or_404(id)
-     order.status = 'Paid'
-     db.session.commit()
-     flash('Status update: Lunas', 'success')
-     return redirect(url_for('sales.view_order', id=id))
+    if 'user_id' not in session: return redirect(url_for('auth.login_web'))
+    
+    # Mark as Paid (Cash In) logic could go here later
+    # For now just status update (Confirmed -> Paid, counted)
+    try:
+        SalesService.mark_paid(id)
+        db.session.commit()
+        flash('Status update: Lunas', 'success')
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'warning')
+    return redirect(url_for('sales.view_order', id=id))
 
 @sales_bp.route('/return_list')
 def return_list():
@@ -186,69 +176,41 @@ def return_list():
     
     return render_template('sales/return_list.html', returns=returns, eligible_orders=eligible_orders)
 
+@sales_bp.route('/<int:id>/returnable')
+def returnable_items(id):
+    """Order lines with the quantity still returnable (JSON, return form)."""
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    items = SalesService.returnable_items(id)
+    return jsonify({'success': True, 'items': [{
+        'id': item.id,
+        'product_id': item.product_id,
+        'name': item.name,
+        'sku': item.sku,
+        'quantity': item.quantity,
+        'price': item.price,
+        'returned': int(item.returned),
+        'returnable': int(item.returnable)
+    } for item in items]})
+
 @sales_bp.route('/return/process', methods=['POST'])
 def process_return():
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
     
     try:
         so_id = request.form['sales_order_id']
-        refund_amount = float(request.form['refund_amount'])
         reason = request.form['reason']
+        items_json = request.form.get('items_json') # [{sales_order_item_id, qty}] from the return form
         
-        # 1. Create Return Record
-        ret_count = SalesReturn.query.count() + 1
-        ret_number = f"RET-{datetime.now().strftime('%Y%m')}-{ret_count:04d}"
-        
-        new_return = SalesReturn(
-            return_number=ret_number,
-            sales_order_id=so_id,
-            reason=reason,
-            total_refund=refund_amount,
-            status='Approved' # Auto-approve for now
-        )
-        db.session.add(new_return)
-        
-        # 2. Accounting Adjustment (Reverse Sale)
-        # Dr. Sales Returns / Revenue (4100) -> Debit reduces Revenue
-        # Cr. Cash / AR (1100/1200)
-        try:
-             # We reuse 4100 (Revenue) to reduce it, or use a specific contra-revenue account.
-             # Let's debit Revenue (4100) directly to keep it simple.
-             from app.models import Account, JournalEntry, JournalItem
-             
-             je = JournalEntry(
-                 date=datetime.utcnow(),
-                 reference=ret_number,
-                 description=f"Retur Penjualan {new_return.sales_order.order_number}"
-             )
-             db.session.add(je)
-             db.session.flush()
-             
-             # Debit Revenue (Reduce Income)
-             rev_acc = Account.query.filter_by(code='4100').first()
-             ji1 = JournalItem(journal_entry_id=je.id, account_id=rev_acc.id, debit=refund_amount, credit=0)
-             rev_acc.balance -= refund_amount 
-             
-             # Credit Cash/AR (Refund Money)
-             cash_acc = Account.query.filter_by(code='1100').first()
-             ji2 = JournalItem(journal_entry_id=je.id, account_id=cash_acc.id, debit=0, credit=refund_amount)
-             cash_acc.balance -= refund_amount
-             
-             db.session.add(ji1)
-             db.session.add(ji2)
-             
-        except Exception as e:
-             print(f"Accounting Error (Return): {e}")
-
-        # 3. Stock Adjustment?
-        # Ideally we should know WHICH items are returned. 
-        # For this MVP step, we rely on the user to use 'Stock Opname' or 'Receiving' to add stock back physically if it's visible.
-        # Or we could auto-add all items? That's dangerous if partial return.
-        # Let's leave stock adjustment to manual Opname for accuracy on partial returns, as per prompt "Retur penjualan" usually implies financial + stock.
-        # User prompt is simple. Let's assume manual stock fix for now or add a flash message.
+        # Per-line qty validated against the order, stock back into the original batches,
+        # one reversal journal (SalesService), committed as one unit (retried on a locked database)
+        result = StockService.run_with_retry(
+            lambda: SalesService.create_return(so_id, json.loads(items_json or '[]'), reason=reason))
         
-        db.session.commit()
-        flash(f'Retur berhasil disimpan ({ret_number}).', 'success')
+        if result['accounting_error']:
+            flash(f"Warning: Accounting entry failed ({result['accounting_error']})", 'warning')
+        flash(f"Retur berhasil disimpan ({result['sales_return'].return_number}): {result['restocked'] + result['unbatched']} unit "
+              f"kembali ke stok, refund Rp {result['refund']:,.0f}.", 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -260,30 +222,31 @@ def process_return():
 def sales_report():
     if 'user_id' not in session: return redirect(url_for('auth.login_web'))
     
-    from sqlalchemy import func
+    # Order date range (default: all time)
+    start_str, end_str = request.args.get('start_date') or None, request.args.get('end_date') or None
+    try:
+        start_date = datetime.strptime(start_str, '%Y-%m-%d').date() if start_str else None
+        end_date = datetime.strptime(end_str, '%Y-%m-%d').date() if end_str else None
+    except ValueError:
+        flash('Format tanggal tidak valid.', 'warning')
+        start_str = end_str = start_date = end_date = None
+    
+    # 1. KPIs + Top Products from the daily rollups (SalesReportService), no join over all order lines
+    summary = SalesReportService.summary(start_date, end_date)
     
-    # 1. KPIs
-    total_sales = db.session.query(func.sum(SalesOrder.grand_total)).filter(SalesOrder.status.in_(['Confirmed', 'Paid'])).scalar() or 0
-    total_orders = SalesOrder.query.filter(SalesOrder.status.in_(['Confirmed', 'Paid'])).count()
-    avg_order = total_sales / total_orders if total_orders > 0 else 0
+    # 2. Recent Sales (ix_sales_orders_date)
+    recent_query = SalesOrder.query.filter(SalesOrder.status.in_(SalesReportService.REPORT_STATUSES))
+    if start_date:
+        recent_query = recent_query.filter(SalesOrder.date >= start_date)
+    if end_date:
+        recent_query = recent_query.filter(SalesOrder.date <= end_date)
+    recent_sales = recent_query.order_by(SalesOrder.date.desc(), SalesOrder.id.desc()).limit(10).all()
     
-    # 2. Recent Sales
-    recent_sales = SalesOrder.query.filter(SalesOrder.status.in_(['Confirmed', 'Paid']))\
-                                   .order_by(SalesOrder.date.desc()).limit(10).all()
-                                   
-    # 3. Top Products (Join OrderItems -> Product)
-    # SQLite might need specific group by syntax logic
-    top_products = db.session.query(
-        Product.name, 
-        func.sum(SalesOrderItem.quantity).label('sold_count'),
-        func.sum(SalesOrderItem.subtotal).label('subtotal_sum')
-    ).join(SalesOrderItem).join(SalesOrder)\
-     .filter(SalesOrder.status.in_(['Confirmed', 'Paid']))\
-     .group_by(Product.name).order_by(func.sum(SalesOrderItem.quantity).desc()).limit(5).all()
-     
+    today = datetime.now().date()
     return render_template('sales/report.html', 
-                          total_sales=total_sales, 
-                          total_orders=total_orders,
-                          avg_order_value=avg_order,
                           recent_sales=recent_sales,
-                          top_products=top_products)
\ No newline at end of file
+                          start_date=start_str,
+                          end_date=end_str,
+                          month_start=today.replace(day=1).isoformat(),
+                          year_start=today.replace(month=1, day=1).isoformat(),
+                          **summary)
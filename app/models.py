@@ -36,6 +36,10 @@ class InventoryStock(db.Model):
     
     product = db.relationship('Product', backref='stocks')
 
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'warehouse_id', name='uq_inventory_stocks_product_warehouse'),
+    )
+
 # --- Accounting Models ---
 class Account(db.Model):
     __tablename__ = 'accounts'
@@ -108,10 +112,19 @@ class SalesOrder(db.Model):
     discount_amount = db.Column(db.Float, default=0)
     grand_total = db.Column(db.Float, default=0)
     notes = db.Column(db.Text, nullable=True)
+    external_ref = db.Column(db.String(64), nullable=True) # No. order marketplace / B2B (import massal, unik)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     items = db.relationship('SalesOrderItem', backref='sales_order', lazy=True, cascade="all, delete-orphan")
     customer_rel = db.relationship('Customer', backref='sales_orders')
+
+    __table_args__ = (
+        db.Index('ix_sales_orders_external_ref', 'external_ref', unique=True),
+        # Daftar order: keyset (created_at, id) terbaru dulu, filter status + rentang tanggal
+        db.Index('ix_sales_orders_created', 'created_at', 'id'),
+        db.Index('ix_sales_orders_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_sales_orders_date', 'date'), # Laporan: penjualan terakhir per rentang tanggal
+    )
     
 class SalesOrderItem(db.Model):
     __tablename__ = 'sales_order_items'
@@ -124,6 +137,47 @@ class SalesOrderItem(db.Model):
     
     product = db.relationship('Product')
 
+    __table_args__ = (
+        db.Index('ix_sales_order_items_order', 'sales_order_id'),
+    )
+
+class SalesOrderStatusCount(db.Model):
+    # Jumlah order per status, dijaga SalesService di transaksi yang sama dengan perubahan status
+    __tablename__ = 'sales_order_status_counts'
+    status = db.Column(db.String(20), primary_key=True) # Draft, Confirmed, Paid, Cancelled
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+
+# --- Rollup Laporan Penjualan (SalesReportService) ---
+class SalesDailyProduct(db.Model):
+    # Penjualan per hari (tanggal order), status (Confirmed / Paid) dan produk
+    __tablename__ = 'sales_daily_products'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0) # Sum subtotal
+    returned_quantity = db.Column(db.Integer, nullable=False, default=0)
+    returned_amount = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('day', 'status', 'product_id', name='uq_sales_daily_products_day_status_product'),
+    )
+
+class SalesDailyTotal(db.Model):
+    # Total per hari & status: jumlah order dihitung sekali per order (tidak bisa dari baris per produk)
+    __tablename__ = 'sales_daily_totals'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0) # Sum grand_total
+    returned_amount = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('day', 'status', name='uq_sales_daily_totals_day_status'),
+    )
+
 class SalesReturn(db.Model):
     __tablename__ = 'sales_returns'
     id = db.Column(db.Integer, primary_key=True)
@@ -136,6 +190,25 @@ class SalesReturn(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     sales_order = db.relationship('SalesOrder', backref='returns')
+    items = db.relationship('SalesReturnItem', backref='sales_return', lazy=True, cascade="all, delete-orphan")
+
+class SalesReturnItem(db.Model):
+    __tablename__ = 'sales_return_items'
+    id = db.Column(db.Integer, primary_key=True)
+    sales_return_id = db.Column(db.Integer, db.ForeignKey('sales_returns.id'), nullable=False)
+    sales_order_item_id = db.Column(db.Integer, db.ForeignKey('sales_order_items.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False) # Harga jual di order asal
+    subtotal = db.Column(db.Float, nullable=False)
+    cost_amount = db.Column(db.Float, default=0) # Nilai persediaan yang kembali (cost layer batch asal)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_sales_return_items_return', 'sales_return_id'),
+        db.Index('ix_sales_return_items_order_item', 'sales_order_item_id'), # Qty sudah diretur per baris order
+    )
 
 # --- Purchasing Models ---
 class Supplier(db.Model):
@@ -219,6 +292,8 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     cost = db.Column(db.Float, nullable=False)
     stock_quantity = db.Column(db.Integer, default=0)
+    reserved_quantity = db.Column(db.Integer, nullable=False, default=0) # Cache: total reservasi aktif (ATP = stock - reserved)
+    version = db.Column(db.Integer, nullable=False, default=0) # Naik setiap perubahan stok (optimistic check)
     min_stock_threshold = db.Column(db.Integer, default=10)
     
     # Smart Inventory Fields
@@ -226,10 +301,17 @@ class Product(db.Model):
     category = db.Column(db.String(50), default='General') # For segregation
     unit = db.Column(db.String(20), default='pcs') # Satuan Barang (pcs, kg, box, ltr)
     rack_location = db.Column(db.String(50), default='Rak A-01') # New: Warehouse Layout
+    last_counted_at = db.Column(db.DateTime, nullable=True) # Opname terakhir (full / cycle count)
     
     transactions = db.relationship('Transaction', backref='product', lazy=True)
     batches = db.relationship('Batch', backref='product', lazy=True)
 
+    __table_args__ = (
+        # Typeahead: prefix range SKU / nama tanpa beda huruf besar-kecil (lihat api_search_products)
+        db.Index('ix_products_sku_nocase', db.text('sku COLLATE NOCASE')),
+        db.Index('ix_products_name_nocase', db.text('name COLLATE NOCASE')),
+    )
+
     def __repr__(self):
         return f"<Product {self.sku}>"
 
@@ -244,6 +326,14 @@ class Batch(db.Model):
     cost_price = db.Column(db.Float, nullable=False) # For FIFO Valuation
     expiry_date = db.Column(db.Date, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=True) # Lokasi layer FIFO
+
+    warehouse = db.relationship('Warehouse')
+
+    # FIFO per gudang & valuasi per gudang tanpa full scan
+    __table_args__ = (
+        db.Index('ix_batches_product_warehouse', 'product_id', 'warehouse_id', 'current_quantity'),
+    )
     
     def __repr__(self):
         return f"<Batch {self.batch_number} - {self.current_quantity}>"
@@ -255,7 +345,50 @@ class BatchTransaction(db.Model):
     transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'), nullable=False)
     batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    
+
+    # Reverse lookup: batch asal dari pergerakan OUT (retur penjualan)
+    __table_args__ = (
+        db.Index('ix_batch_transactions_transaction', 'transaction_id'),
+    )
+
+# --- Tabel Ledger Valuasi Stok (FIFO, diupdate oleh SmartInventoryEngine) ---
+class StockValuation(db.Model):
+    __tablename__ = 'stock_valuations'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, nullable=False, default=0) # 0 = belum terikat ke gudang
+    quantity = db.Column(db.Integer, default=0) # SUM(batches.current_quantity)
+    value = db.Column(db.Float, default=0) # SUM(batches.current_quantity * cost_price)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'warehouse_id', name='uq_stock_valuations_product_warehouse'),
+    )
+
+    def __repr__(self):
+        return f"<StockValuation {self.product_id}@{self.warehouse_id} = {self.value}>"
+
+class StockDiscrepancy(db.Model):
+    __tablename__ = 'stock_discrepancies'
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.String(32), nullable=False) # Satu run rekonsiliasi
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_qty = db.Column(db.Integer, default=0) # Product.stock_quantity
+    warehouse_qty = db.Column(db.Integer, default=0) # SUM(inventory_stocks.quantity)
+    batch_qty = db.Column(db.Integer, default=0) # SUM(batches.current_quantity)
+    repaired = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_stock_discrepancies_run_product', 'run_id', 'product_id'),
+    )
+
+    def __repr__(self):
+        return f"<StockDiscrepancy {self.run_id} #{self.product_id}>"
 
 
 # --- Tabel Transaksi (HANYA BOLEH ADA 1 KALI) ---
@@ -275,10 +408,55 @@ class Transaction(db.Model):
     branch_name = db.Column(db.String(100), nullable=True) # New Branch Field
     fulfillment_status = db.Column(db.String(20), default='completed') # pending, picked, packed, shipped
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=True) # New CRM Link
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=True) # Gudang yang stoknya bergerak (NULL = belum terikat)
+    stock_delta = db.Column(db.Integer, nullable=True) # Efek bertanda ke stok (OPNAME); NULL = mengikuti transaction_type
+
+    warehouse = db.relationship('Warehouse')
+
+    # Index Pack (versi 2) untuk filter yang paling sering dipakai:
+    # - dashboard / analytics / laporan  -> transaction_type + created_at
+    # - stock card / tracking            -> product_id + created_at
+    # - receipt by ref / transfer TF-%   -> reference
+    # - picking / packing                -> transaction_type + fulfillment_status
+    # - movement history per gudang      -> warehouse_id + created_at (v2)
+    # Jika menambah index di sini, naikkan TRANSACTION_INDEX_VERSION dan jalankan add_transaction_indexes.py
+    __table_args__ = (
+        db.Index('ix_transactions_type_created', 'transaction_type', 'created_at'),
+        db.Index('ix_transactions_product_created', 'product_id', 'created_at'),
+        db.Index('ix_transactions_reference', 'reference'),
+        db.Index('ix_transactions_type_fulfillment', 'transaction_type', 'fulfillment_status', 'created_at'),
+        db.Index('ix_transactions_warehouse_created', 'warehouse_id', 'created_at'),
+    )
 
     def __repr__(self):
         return f"<Transaction {self.transaction_type}>"
 
+TRANSACTION_INDEX_VERSION = 2
+
+# Tipe transaksi yang menggerakkan stok (dipakai snapshot & replay kartu stok)
+STOCK_IN_TYPES = ('IN', 'TRANSFER_IN')
+STOCK_OUT_TYPES = ('OUT', 'TRANSFER_OUT')
+STOCK_MOVEMENT_TYPES = STOCK_IN_TYPES + STOCK_OUT_TYPES + ('OPNAME',)
+
+class StockSnapshot(db.Model):
+    __tablename__ = 'stock_snapshots'
+    id = db.Column(db.Integer, primary_key=True)
+    snapshot_date = db.Column(db.Date, nullable=False) # Saldo akhir hari ini
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, nullable=False, default=0) # 0 = belum terikat ke gudang
+    quantity = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    product = db.relationship('Product')
+
+    # Hanya ditulis untuk hari yang ada pergerakan (sparse); saldo hari lain = snapshot terakhir
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'warehouse_id', 'snapshot_date', name='uq_stock_snapshots_product_warehouse_date'),
+    )
+
+    def __repr__(self):
+        return f"<StockSnapshot {self.product_id}@{self.warehouse_id} {self.snapshot_date} = {self.quantity}>"
+
 # --- Tabel Material Request (Permintaan Barang Antar Cabang) ---
 class MaterialRequest(db.Model):
     __tablename__ = 'material_requests'
@@ -295,6 +473,109 @@ class MaterialRequest(db.Model):
     def __repr__(self):
         return f"<MaterialRequest {self.branch_name} - {self.product.name}>"
 
+# --- Dokumen Transfer Antar Gudang (multi baris) ---
+class TransferDocument(db.Model):
+    __tablename__ = 'transfer_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(50), unique=True, nullable=False) # TF-...
+    source_warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
+    destination_warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
+    status = db.Column(db.String(20), default='Posted')
+    notes = db.Column(db.Text, nullable=True)
+    line_count = db.Column(db.Integer, default=0)
+    total_quantity = db.Column(db.Integer, default=0)
+    created_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    source_warehouse = db.relationship('Warehouse', foreign_keys=[source_warehouse_id])
+    destination_warehouse = db.relationship('Warehouse', foreign_keys=[destination_warehouse_id])
+    lines = db.relationship('TransferLine', backref='transfer', lazy=True, cascade="all, delete-orphan")
+
+    def __repr__(self):
+        return f"<TransferDocument {self.reference}>"
+
+class TransferLine(db.Model):
+    __tablename__ = 'transfer_lines'
+    id = db.Column(db.Integer, primary_key=True)
+    transfer_id = db.Column(db.Integer, db.ForeignKey('transfer_documents.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    product = db.relationship('Product')
+
+# --- Tabel Cycle Count (Daftar Hitung Harian per Kelas ABC) ---
+class CycleCountTask(db.Model):
+    __tablename__ = 'cycle_count_tasks'
+    id = db.Column(db.Integer, primary_key=True)
+    count_date = db.Column(db.Date, nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    abc_class = db.Column(db.String(1), nullable=False) # A, B, C (nilai pergerakan)
+    movement_value = db.Column(db.Float, default=0)
+    zone = db.Column(db.String(50)) # Zona rak (prefix rack_location)
+    status = db.Column(db.String(20), default='Pending') # Pending, Counted
+    reference = db.Column(db.String(50)) # Ref opname yang menghitung
+    counted_at = db.Column(db.DateTime)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.UniqueConstraint('count_date', 'product_id', name='uq_cycle_count_tasks_date_product'),
+        db.Index('ix_cycle_count_tasks_product_status', 'product_id', 'status'),
+    )
+
+# --- Tabel Reservasi Stok (Draft SO dll., lihat ReservationService) ---
+class StockReservation(db.Model):
+    __tablename__ = 'stock_reservations'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=True)
+    source_type = db.Column(db.String(10), nullable=False) # SO
+    source_id = db.Column(db.Integer, nullable=False)
+    reference = db.Column(db.String(50))
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='Active') # Active, Consumed, Released, Expired
+    expires_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_at = db.Column(db.DateTime, nullable=True)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_stock_reservations_source', 'source_type', 'source_id', 'status'),
+        db.Index('ix_stock_reservations_product_status', 'product_id', 'status'),
+        db.Index('ix_stock_reservations_status_expires', 'status', 'expires_at'),
+    )
+
+# --- Tabel Counter Nomor Dokumen (lihat SequenceService) ---
+class DocumentSequence(db.Model):
+    __tablename__ = 'document_sequences'
+    id = db.Column(db.Integer, primary_key=True)
+    prefix = db.Column(db.String(10), nullable=False) # SO, PO, PR, RET, REQ, OPN, CC, TF, BATCH, RCV
+    period = db.Column(db.String(8), nullable=False) # YYYYMM / YYYYMMDD
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('prefix', 'period', name='uq_document_sequences_prefix_period'),
+    )
+
+# --- Tabel Session Server-side (lihat app/session_store.py) ---
+class ServerSession(db.Model):
+    __tablename__ = 'server_sessions'
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False) # Flask tagged JSON
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# --- Tabel Metadata Cetak per Dokumen (alamat cetak, dll.) ---
+class PrintMetadata(db.Model):
+    __tablename__ = 'print_metadata'
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(50), unique=True, nullable=False)
+    doc_type = db.Column(db.String(20), default='receiving')
+    print_address = db.Column(db.Text)
+    created_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # --- Tabel User ---
 class User(db.Model):
     __tablename__ = 'users'
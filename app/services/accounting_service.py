@@ -26,9 +26,11 @@ class AccountingService:
         db.session.add(je)
         db.session.flush() # Get ID
         
-        # 3. Create Items
+        # 3. Create Items (all accounts of the journal in one query)
+        accounts = {a.code: a for a in Account.query.filter(Account.code.in_({l[0] for l in lines})).all()}
+        balance_deltas = {}
         for code, debit, credit in lines:
-            account = Account.query.filter_by(code=code).first()
+            account = accounts.get(code)
             if not account:
                 # Optional: Auto-create account? Better error for now.
                 print(f"Warning: Account {code} not found. Skipping line or using Suspense?")
@@ -47,9 +49,14 @@ class AccountingService:
             # Liab/Equity/Revenue: Credit increases (+), Debit decreases (-)
             
             if account.type in ['Asset', 'Expense']:
-                account.balance += (debit - credit)
+                delta = debit - credit
             else:
-                account.balance += (credit - debit)
+                delta = credit - debit
+            balance_deltas[account] = balance_deltas.get(account, 0) + delta
+
+        # SQL-side increment (balance = balance + x), safe under concurrent postings
+        for account, delta in balance_deltas.items():
+            account.balance = Account.balance + delta
                 
         return je
 
@@ -81,7 +88,7 @@ class AccountingService:
         )
 
     @staticmethod
-    def record_purchase(reference, amount, supplier="Supplier"):
+    def record_purchase(reference, amount, supplier="Supplier", description=None):
         """
         Automated Journal for Purchase:
         Dr. Inventory (1300)
@@ -92,10 +99,10 @@ class AccountingService:
             ('1100', 0, amount)     # Credit Cash (Assuming Cash purchase for now)
         ]
         
-        AccountingService.create_journal_entry(
+        return AccountingService.create_journal_entry(
             date=datetime.utcnow(),
             reference=reference,
-            description=f"Pembelian Stok dari {supplier}",
+            description=description or f"Pembelian Stok dari {supplier}",
             lines=lines
         )
 
@@ -133,3 +140,49 @@ class AccountingService:
             description=f"Penyesuaian Stok (Opname)",
             lines=lines
         )
+
+    @staticmethod
+    def record_opname(reference, gain_amount, loss_amount, description=None):
+        """
+        One summarised journal for a whole opname document:
+        Gain: Dr. Inventory (1300) / Cr. COGS (5100)
+        Loss: Dr. COGS (5100) / Cr. Inventory (1300)
+        Returns: JournalEntry (None if there is nothing to post)
+        """
+        lines = []
+        if gain_amount > 0:
+            lines += [('1300', gain_amount, 0), ('5100', 0, gain_amount)]
+        if loss_amount > 0:
+            lines += [('5100', loss_amount, 0), ('1300', 0, loss_amount)]
+        if not lines:
+            return None
+
+        return AccountingService.create_journal_entry(
+            date=datetime.utcnow(),
+            reference=reference,
+            description=description or f"Penyesuaian Stok (Opname) {reference}",
+            lines=lines
+        )
+
+    @staticmethod
+    def record_sales_return(reference, refund_amount, cost_amount=0, description=None):
+        """
+        One summarised reversal journal for a whole sales return (any number of lines):
+        Dr. Sales Revenue (4100) / Cr. Cash/AR (1100)   -> refund
+        Dr. Inventory (1300) / Cr. COGS (5100)          -> cost of the goods put back
+        Returns: JournalEntry (None if there is nothing to post)
+        """
+        lines = []
+        if refund_amount > 0:
+            lines += [('4100', refund_amount, 0), ('1100', 0, refund_amount)]
+        if cost_amount > 0:
+            lines += [('1300', cost_amount, 0), ('5100', 0, cost_amount)]
+        if not lines:
+            return None
+
+        return AccountingService.create_journal_entry(
+            date=datetime.utcnow(),
+            reference=reference,
+            description=description or f"Retur Penjualan {reference}",
+            lines=lines
+        )
@@ -0,0 +1,159 @@
+import math
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import contains_eager
+from app.models import db, Product, Transaction, CycleCountTask, STOCK_OUT_TYPES
+
+class CycleCountService:
+    """
+    Velocity-driven cycle counting.
+    SKUs are ranked by outbound movement value (ABC), every class is recounted on its
+    own interval and each day gets a count list that fits the count budget and is
+    spread across rack zones, so the warehouse never has to freeze for a full opname.
+    """
+
+    # Cumulative share of movement value per class (A = top 80%, B = next 15%, C = rest)
+    CLASS_SHARES = (('A', 0.80), ('B', 0.95), ('C', 1.0))
+    COUNT_INTERVAL_DAYS = {'A': 30, 'B': 90, 'C': 180}
+    VELOCITY_DAYS = 90
+
+    @staticmethod
+    def zone_of(rack_location):
+        """'Rak A-01' -> 'Rak A' (rack zone = part before the bay number)."""
+        return (rack_location or '').split('-')[0].strip() or 'Tanpa Rak'
+
+    @staticmethod
+    def classify(as_of=None, days=None):
+        """
+        ABC classes by outbound movement value in the last `days` days.
+        One grouped query over transactions; the cumulative share is a window sum.
+        Returns: dict {product_id: (abc_class, movement_value)}
+        """
+        as_of = as_of or date.today()
+        since = datetime.combine(as_of, datetime.min.time()) - timedelta(days=days or CycleCountService.VELOCITY_DAYS)
+
+        moved = db.session.query(
+            Transaction.product_id.label('product_id'),
+            func.sum(Transaction.quantity).label('qty')
+        ).filter(
+            Transaction.transaction_type.in_(STOCK_OUT_TYPES),
+            Transaction.created_at >= since
+        ).group_by(Transaction.product_id).subquery()
+
+        value = func.coalesce(moved.c.qty, 0) * func.coalesce(Product.cost, 0)
+        rows = db.session.query(
+            Product.id,
+            value.label('value'),
+            func.sum(value).over(order_by=(value.desc(), Product.id)).label('running'),
+            func.sum(value).over().label('total')
+        ).outerjoin(moved, moved.c.product_id == Product.id).all()
+
+        classes = {}
+        for row in rows:
+            if not row.total or not row.value:
+                classes[row.id] = ('C', row.value or 0)
+                continue
+            share = row.running / row.total
+            # The SKU that crosses a threshold still belongs to the higher class
+            abc = next(c for c, limit in CycleCountService.CLASS_SHARES if share - row.value / row.total < limit)
+            classes[row.id] = (abc, row.value)
+        return classes
+
+    @staticmethod
+    def daily_budget(classes):
+        """Counts per day needed so every class is recounted within its interval."""
+        intervals = CycleCountService.COUNT_INTERVAL_DAYS
+        return max(1, math.ceil(sum(1 / intervals[abc] for abc, _ in classes.values())))
+
+    @staticmethod
+    def generate_plan(count_date=None, budget=None, days=None):
+        """
+        Builds the count list for one day (idempotent: an existing plan is kept).
+        Due = never counted or last count older than the class interval.
+        Priority: class A first, then longest not counted, then movement value.
+        Picks round-robin across rack zones so no zone takes the whole budget.
+        Overdue pending tasks of earlier days stay on the list (get_plan) and use up
+        part of the budget, so the daily workload does not grow when counts slip.
+        Returns: number of tasks in the plan. Caller commits.
+        """
+        count_date = count_date or date.today()
+        existing = CycleCountTask.query.filter_by(count_date=count_date).count()
+        if existing:
+            return existing
+
+        classes = CycleCountService.classify(count_date, days)
+        budget = budget or CycleCountService.daily_budget(classes)
+
+        # Products already planned and still pending are not planned twice (they are carried over)
+        pending = {row.product_id for row in db.session.query(CycleCountTask.product_id).filter(CycleCountTask.status == 'Pending')}
+        overdue = CycleCountTask.query.filter(CycleCountTask.status == 'Pending', CycleCountTask.count_date < count_date).count()
+        budget = max(budget - overdue, 0)
+
+        day_start = datetime.combine(count_date, datetime.min.time())
+        due_by_zone = {}
+        for p in db.session.query(Product.id, Product.rack_location, Product.last_counted_at).order_by(Product.id):
+            abc, value = classes.get(p.id, ('C', 0))
+            if p.id in pending:
+                continue
+            if p.last_counted_at and p.last_counted_at > day_start - timedelta(days=CycleCountService.COUNT_INTERVAL_DAYS[abc]):
+                continue
+            priority = (abc, p.last_counted_at or datetime.min, -value, p.id)
+            due_by_zone.setdefault(CycleCountService.zone_of(p.rack_location), []).append((priority, p.id, abc, value))
+
+        queues = [sorted(items) for _, items in sorted(due_by_zone.items())]
+        picked = []
+        while queues and len(picked) < budget:
+            # One SKU per zone per round, best remaining priority first
+            queues.sort(key=lambda q: q[0][0])
+            for queue in list(queues):
+                if len(picked) >= budget:
+                    break
+                picked.append(queue.pop(0))
+                if not queue:
+                    queues.remove(queue)
+
+        zones = {p_id: zone for zone, items in due_by_zone.items() for _, p_id, _, _ in items}
+        db.session.bulk_insert_mappings(CycleCountTask, [{
+            'count_date': count_date,
+            'product_id': p_id,
+            'abc_class': abc,
+            'movement_value': value,
+            'zone': zones[p_id],
+            'status': 'Pending'
+        } for _, p_id, abc, value in picked])
+        return len(picked)
+
+    @staticmethod
+    def get_plan(count_date=None):
+        """
+        Tasks of one day plus overdue tasks still pending from earlier days
+        (not counted on their day), in walking order (zone, rack).
+        """
+        count_date = count_date or date.today()
+        return CycleCountTask.query.join(Product).filter(or_(
+            CycleCountTask.count_date == count_date,
+            and_(CycleCountTask.count_date < count_date, CycleCountTask.status == 'Pending')
+        ))\
+            .options(contains_eager(CycleCountTask.product))\
+            .order_by(CycleCountTask.zone, Product.rack_location, Product.sku).all()
+
+    @staticmethod
+    def mark_counted(product_ids, reference, counted_at=None):
+        """
+        Called by opname posting for every counted product (with or without variance):
+        stamps Product.last_counted_at and closes pending cycle-count tasks.
+        """
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        counted_at = counted_at or datetime.utcnow()
+        Product.query.filter(Product.id.in_(product_ids)).update(
+            {Product.last_counted_at: counted_at}, synchronize_session=False)
+        CycleCountTask.query.filter(
+            CycleCountTask.product_id.in_(product_ids),
+            CycleCountTask.status == 'Pending'
+        ).update({
+            CycleCountTask.status: 'Counted',
+            CycleCountTask.reference: reference,
+            CycleCountTask.counted_at: counted_at
+        }, synchronize_session=False)
@@ -1,118 +1,729 @@
 from datetime import datetime
-from app.models import db, Product, Batch, Transaction, BatchTransaction
-from sqlalchemy import func
+from app.models import db, Product, Batch, Transaction, BatchTransaction, StockValuation, InventoryStock, Warehouse
+from app.services.sequence_service import SequenceService
+from app.services.stock_service import StockConflictError
+from sqlalchemy import func, case, cast, bindparam, and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 class SmartInventoryEngine:
+
+    @staticmethod
+    def get_default_warehouse_id():
+        """
+        Gudang default untuk stok masuk/keluar tanpa gudang eksplisit: 'main', atau gudang pertama.
+        """
+        warehouse = Warehouse.query.order_by((Warehouse.type == 'main').desc(), Warehouse.id.asc()).first()
+        return warehouse.id if warehouse else None
     
     @staticmethod
-    def process_inbound(product_id, quantity, cost_price, expiry_date=None, auto_commit=True):
+    def process_inbound(product_id, quantity, cost_price, expiry_date=None, auto_commit=True, warehouse_id=None):
         """
         Smart Inbound: Creates a new batch correctly.
         """
-        product = Product.query.get(product_id)
-        if not product:
-            raise ValueError("Product not found")
-
-        # Create Batch
-        batch_number = f"BATCH-{datetime.now().strftime('%Y%m%d')}-{product_id}-{int(datetime.now().timestamp())}"
-        new_batch = Batch(
-            product_id=product_id,
-            batch_number=batch_number,
-            initial_quantity=quantity,
-            current_quantity=quantity,
-            cost_price=cost_price,
-            expiry_date=expiry_date
-        )
-        
-        db.session.add(new_batch)
+        created = SmartInventoryEngine.process_inbound_many([{
+            'product_id': product_id,
+            'quantity': quantity,
+            'cost_price': cost_price,
+            'expiry_date': expiry_date,
+            'warehouse_id': warehouse_id
+        }], auto_commit=auto_commit, return_ids=True)
+
+        return db.session.get(Batch, created[0]['id'])
+
+    @staticmethod
+    def process_inbound_many(lines, auto_commit=True, return_ids=False):
+        """
+        Bulk inbound for a whole receiving document.
+        lines: list of dicts {product_id, quantity, cost_price, expiry_date (optional), warehouse_id (optional)}
+
+        Products are validated with one IN query, batch numbers are allocated as one
+        block from the BATCH counter (BATCH-YYYYMMDD-00001, one upsert) and batches are bulk inserted.
+        Lines without warehouse_id go to the default warehouse.
+        return_ids=True fetches the new batch ids (SQLite then inserts row by row);
+        otherwise batches are written with a single executemany.
+        Returns: list of created batch dicts (including 'id' when return_ids=True).
+        """
+        if not lines:
+            return []
+
+        product_ids = {int(line['product_id']) for line in lines}
+        found = {row.id for row in db.session.query(Product.id).filter(Product.id.in_(product_ids))}
+        missing = product_ids - found
+        if missing:
+            raise ValueError(f"Product not found: {', '.join(str(p) for p in sorted(missing))}")
+
+        default_wh = None
+        if any(not line.get('warehouse_id') for line in lines):
+            default_wh = SmartInventoryEngine.get_default_warehouse_id()
+
+        # One block of consecutive batch numbers per document (never collides between writers)
+        now = datetime.utcnow()
+        batch_numbers = SequenceService.numbers('BATCH', len(lines), on=now, width=5)
+
+        batch_rows = []
+        valuation_deltas = {}
+        stock_deltas = {}
+        for seq, line in enumerate(lines, start=1):
+            p_id = int(line['product_id'])
+            qty = int(line['quantity'])
+            cost = float(line['cost_price'])
+            wh_id = line.get('warehouse_id') or default_wh
+
+            batch_rows.append({
+                'product_id': p_id,
+                'warehouse_id': wh_id,
+                'batch_number': batch_numbers[seq - 1],
+                'initial_quantity': qty,
+                'current_quantity': qty,
+                'cost_price': cost,
+                'expiry_date': line.get('expiry_date'),
+                'created_at': now
+            })
+            SmartInventoryEngine._add_delta(valuation_deltas, (p_id, wh_id or 0), qty, qty * cost)
+            if wh_id:
+                SmartInventoryEngine._add_delta(stock_deltas, (p_id, wh_id), qty)
+
+        db.session.bulk_insert_mappings(Batch, batch_rows, return_defaults=return_ids)
+        SmartInventoryEngine._apply_valuation(valuation_deltas)
+        SmartInventoryEngine._apply_warehouse_stock(stock_deltas)
+
         if auto_commit:
             db.session.commit()
-            
-        return new_batch
+
+        return batch_rows
 
     @staticmethod
-    def process_outbound_fifo(product_id, quantity_needed, transaction_id=None):
+    def process_outbound_fifo(product_id, quantity_needed, transaction_id=None, warehouse_id=None):
         """
         Smart Outbound (FIFO): Automatically picks older batches first.
         Returns: Allocated Batches List
         """
-        # Get batches ordered by created_at (FIFO)
-        batches = Batch.query.filter(
-            Batch.product_id == product_id,
+        result = SmartInventoryEngine.allocate_fifo_many(
+            [(product_id, quantity_needed)],
+            transaction_ids=[transaction_id],
+            warehouse_id=warehouse_id
+        )
+        # Partial allocation is allowed here, main logic handles the shortage
+        return result[0]['allocations']
+
+    @staticmethod
+    def _fifo_layers(demand, warehouse_id=None):
+        """
+        One windowed (running-sum) query: per product, the FEFO/FIFO ordered batches
+        needed to cover demand {product_id: qty}. Scoped to one warehouse when given.
+        Returns: {product_id: [layer dicts with the quantity to take]}
+        """
+        if not demand:
+            return {}
+
+        running_qty = func.sum(Batch.current_quantity).over(
+            partition_by=Batch.product_id,
+            order_by=(Batch.expiry_date.asc().nulls_last(), Batch.created_at.asc(), Batch.id.asc())
+        )
+        ranked = db.session.query(
+            Batch.id.label('batch_id'),
+            Batch.product_id,
+            Batch.warehouse_id,
+            Batch.batch_number,
+            Batch.current_quantity,
+            Batch.cost_price,
+            Batch.expiry_date,
+            Batch.created_at,
+            running_qty.label('running_qty')
+        ).filter(
+            Batch.product_id.in_(demand.keys()),
             Batch.current_quantity > 0
-        ).order_by(Batch.expiry_date.asc().nulls_last(), Batch.created_at.asc()).all()
-
-        allocated = []
-        remaining_qty = quantity_needed
-
-        for batch in batches:
-            if remaining_qty <= 0:
-                break
-            
-            qty_taken = min(batch.current_quantity, remaining_qty)
-            
-            # Update Batch
-            batch.current_quantity -= qty_taken
-            remaining_qty -= qty_taken
-            
-            # Record Allocation
-            allocated.append({
-                'batch_id': batch.id,
-                'batch_number': batch.batch_number,
-                'quantity': qty_taken,
-                'cost': batch.cost_price
+        )
+        if warehouse_id:
+            ranked = ranked.filter(Batch.warehouse_id == warehouse_id)
+        ranked = ranked.subquery()
+
+        needed = case(demand, value=ranked.c.product_id, else_=0)
+        rows = db.session.query(ranked)\
+            .filter(ranked.c.running_qty - ranked.c.current_quantity < needed)\
+            .order_by(ranked.c.product_id, ranked.c.running_qty).all()
+
+        layers = {}
+        for row in rows:
+            consumed_before = row.running_qty - row.current_quantity
+            layers.setdefault(row.product_id, []).append({
+                'batch_id': row.batch_id,
+                'batch_number': row.batch_number,
+                'warehouse_id': row.warehouse_id,
+                'available': row.current_quantity,
+                'quantity': min(row.current_quantity, demand[row.product_id] - consumed_before),
+                'cost': row.cost_price,
+                'expiry_date': row.expiry_date,
+                'created_at': row.created_at
             })
-            
-            # Link to Transaction if ID provided
-            if transaction_id:
-                bt = BatchTransaction(
-                    transaction_id=transaction_id,
-                    batch_id=batch.id,
-                    quantity=qty_taken
+        return layers
+
+    @staticmethod
+    def _decrement_batches(batch_updates):
+        """
+        Applies {batch_id: qty} with one guarded executemany
+        (a concurrent writer cannot push a batch below zero).
+        Raises StockConflictError if a batch changed since it was read (run_with_retry retries).
+        """
+        if not batch_updates:
+            return
+
+        batches = Batch.__table__
+        result = db.session.execute(
+            batches.update()
+            .where(batches.c.id == bindparam('b_id'))
+            .where(batches.c.current_quantity >= bindparam('b_take'))
+            .values(current_quantity=batches.c.current_quantity - bindparam('b_take')),
+            [{'b_id': b_id, 'b_take': take} for b_id, take in batch_updates.items()]
+        )
+        if result.rowcount not in (-1, None) and result.rowcount != len(batch_updates):
+            raise StockConflictError("Stok batch berubah saat alokasi FIFO, silakan ulangi.")
+
+    @staticmethod
+    def allocate_fifo_many(lines, transaction_ids=None, warehouse_id=None):
+        """
+        Set-based FIFO/FEFO allocation for a whole order.
+        lines: list of tuples (product_id, quantity)
+        transaction_ids: optional list parallel to lines, used to write BatchTransaction rows
+        warehouse_id: shipping warehouse; only its batches are allocated (None = all warehouses)
+
+        One windowed (running-sum) query picks only the batches that are actually touched,
+        then batches are updated with one executemany and BatchTransaction rows are bulk inserted.
+        Warehouse stock follows the allocated batches; quantity without batch layers (legacy stock)
+        is taken from the shipping/default warehouse.
+        Returns one dict per line: product_id, requested, allocated, shortage, allocations.
+        """
+        lines = [(int(p_id), int(qty)) for p_id, qty in lines]
+        transaction_ids = transaction_ids or [None] * len(lines)
+
+        # Total demand per product (an order may contain the same product on several lines)
+        demand = {}
+        for p_id, qty in lines:
+            if qty > 0:
+                demand[p_id] = demand.get(p_id, 0) + qty
+
+        # 1. Running sum per product in FEFO/FIFO order, keep only batches needed to cover demand
+        layers_by_product = SmartInventoryEngine._fifo_layers(demand, warehouse_id)
+
+        # 2. Spread the per-product takes over the order lines (in line order)
+        results = []
+        batch_updates = {}
+        batch_trx_rows = []
+        valuation_deltas = {}
+        stock_deltas = {}
+        shortage_wh = None
+        for (p_id, qty), trx_id in zip(lines, transaction_ids):
+            remaining_qty = max(qty, 0)
+            allocated = []
+            pool = layers_by_product.get(p_id, [])
+
+            while remaining_qty > 0 and pool:
+                layer = pool[0]
+                qty_taken = min(layer['quantity'], remaining_qty)
+                allocated.append({
+                    'batch_id': layer['batch_id'],
+                    'batch_number': layer['batch_number'],
+                    'warehouse_id': layer['warehouse_id'],
+                    'quantity': qty_taken,
+                    'cost': layer['cost']
+                })
+                batch_updates[layer['batch_id']] = batch_updates.get(layer['batch_id'], 0) + qty_taken
+                SmartInventoryEngine._add_delta(valuation_deltas, (p_id, layer['warehouse_id'] or 0), -qty_taken, -qty_taken * layer['cost'])
+                if layer['warehouse_id']:
+                    SmartInventoryEngine._add_delta(stock_deltas, (p_id, layer['warehouse_id']), -qty_taken)
+                if trx_id:
+                    batch_trx_rows.append({'transaction_id': trx_id, 'batch_id': layer['batch_id'], 'quantity': qty_taken})
+
+                layer['quantity'] -= qty_taken
+                remaining_qty -= qty_taken
+                if layer['quantity'] == 0:
+                    pool.pop(0)
+
+            if remaining_qty > 0:
+                if shortage_wh is None:
+                    shortage_wh = warehouse_id or SmartInventoryEngine.get_default_warehouse_id() or 0
+                if shortage_wh:
+                    SmartInventoryEngine._add_delta(stock_deltas, (p_id, shortage_wh), -remaining_qty)
+
+            results.append({
+                'product_id': p_id,
+                'requested': qty,
+                'allocated': qty - remaining_qty if qty > 0 else 0,
+                'shortage': remaining_qty,
+                'allocations': allocated
+            })
+
+        # 3. Apply in bulk
+        SmartInventoryEngine._decrement_batches(batch_updates)
+
+        if batch_trx_rows:
+            db.session.bulk_insert_mappings(BatchTransaction, batch_trx_rows)
+
+        SmartInventoryEngine._apply_valuation(valuation_deltas)
+        SmartInventoryEngine._apply_warehouse_stock(stock_deltas)
+
+        return results
+
+    @staticmethod
+    def return_to_batches(lines, reference, returned_references=(), transaction_ids=None, warehouse_id=None):
+        """
+        Set-based restock of returned goods into the batches they were shipped from.
+        lines: list of tuples (product_id, quantity)
+        reference: reference of the original OUT movements (order number)
+        returned_references: references of earlier returns of the same document (their restock is netted out)
+        transaction_ids: optional list parallel to lines, used to write BatchTransaction rows
+        warehouse_id: warehouse for quantity that was shipped without batch layers (default warehouse)
+
+        One grouped query over BatchTransaction -> Transaction (reverse lookup) gives, per batch,
+        what was taken minus what earlier returns already put back; the most recently allocated
+        batches are refilled first. Batches are updated with one executemany, BatchTransaction rows
+        bulk inserted. Product.stock_quantity is changed by the caller (StockService.adjust_many).
+        Returns one dict per line: product_id, requested, restocked, unbatched, allocations.
+        """
+        lines = [(int(p_id), int(qty)) for p_id, qty in lines]
+        transaction_ids = transaction_ids or [None] * len(lines)
+        product_ids = {p_id for p_id, qty in lines if qty > 0}
+
+        # 1. Open quantity per shipped batch (OUT of the document - IN of its earlier returns)
+        pools = {}
+        if product_ids:
+            signed = case((Transaction.transaction_type == 'OUT', BatchTransaction.quantity), else_=-BatchTransaction.quantity)
+            sources = db.session.query(
+                Transaction.product_id,
+                BatchTransaction.batch_id,
+                Batch.batch_number,
+                Batch.warehouse_id,
+                Batch.cost_price,
+                func.sum(signed).label('open_qty')
+            ).join(Transaction, Transaction.id == BatchTransaction.transaction_id)\
+             .join(Batch, Batch.id == BatchTransaction.batch_id)\
+             .filter(
+                Transaction.product_id.in_(product_ids),
+                or_(
+                    and_(Transaction.reference == reference, Transaction.transaction_type == 'OUT'),
+                    and_(Transaction.reference.in_(list(returned_references)), Transaction.transaction_type == 'IN')
                 )
-                db.session.add(bt)
-        
-        if remaining_qty > 0:
-            # Force Allocation (Negative Stock on newest batch or error? For now, allow partial and let main logic handle shortage)
-            # ideally we shouldn't reach here if we checked total stock first
-            pass
+            ).group_by(Transaction.product_id, BatchTransaction.batch_id)\
+             .having(func.sum(signed) > 0)\
+             .order_by(Transaction.product_id, func.min(BatchTransaction.id).desc())
+            for row in sources:
+                pools.setdefault(row.product_id, []).append({
+                    'batch_id': row.batch_id,
+                    'batch_number': row.batch_number,
+                    'warehouse_id': row.warehouse_id,
+                    'quantity': int(row.open_qty),
+                    'cost': row.cost_price
+                })
 
-        return allocated
+        # 2. Spread the returned quantity over those batches (in line order)
+        results = []
+        batch_updates = {}
+        batch_trx_rows = []
+        valuation_deltas = {}
+        stock_deltas = {}
+        fallback_wh = None
+        for (p_id, qty), trx_id in zip(lines, transaction_ids):
+            remaining_qty = max(qty, 0)
+            allocated = []
+            pool = pools.get(p_id, [])
+
+            while remaining_qty > 0 and pool:
+                layer = pool[0]
+                qty_back = min(layer['quantity'], remaining_qty)
+                allocated.append({
+                    'batch_id': layer['batch_id'],
+                    'batch_number': layer['batch_number'],
+                    'warehouse_id': layer['warehouse_id'],
+                    'quantity': qty_back,
+                    'cost': layer['cost']
+                })
+                batch_updates[layer['batch_id']] = batch_updates.get(layer['batch_id'], 0) + qty_back
+                SmartInventoryEngine._add_delta(valuation_deltas, (p_id, layer['warehouse_id'] or 0), qty_back, qty_back * layer['cost'])
+                if layer['warehouse_id']:
+                    SmartInventoryEngine._add_delta(stock_deltas, (p_id, layer['warehouse_id']), qty_back)
+                if trx_id:
+                    batch_trx_rows.append({'transaction_id': trx_id, 'batch_id': layer['batch_id'], 'quantity': qty_back})
+
+                layer['quantity'] -= qty_back
+                remaining_qty -= qty_back
+                if layer['quantity'] == 0:
+                    pool.pop(0)
+
+            if remaining_qty > 0:
+                # Shipped without layers (legacy stock): back to warehouse stock only, like the shortage on the way out
+                if fallback_wh is None:
+                    fallback_wh = warehouse_id or SmartInventoryEngine.get_default_warehouse_id() or 0
+                if fallback_wh:
+                    SmartInventoryEngine._add_delta(stock_deltas, (p_id, fallback_wh), remaining_qty)
+
+            results.append({
+                'product_id': p_id,
+                'requested': qty,
+                'restocked': qty - remaining_qty if qty > 0 else 0,
+                'unbatched': remaining_qty,
+                'allocations': allocated
+            })
+
+        # 3. Apply in bulk
+        if batch_updates:
+            batches = Batch.__table__
+            db.session.execute(
+                batches.update().where(batches.c.id == bindparam('b_id'))
+                .values(current_quantity=batches.c.current_quantity + bindparam('b_back')),
+                [{'b_id': b_id, 'b_back': qty} for b_id, qty in sorted(batch_updates.items())]
+            )
+        if batch_trx_rows:
+            db.session.bulk_insert_mappings(BatchTransaction, batch_trx_rows)
+
+        SmartInventoryEngine._apply_valuation(valuation_deltas)
+        SmartInventoryEngine._apply_warehouse_stock(stock_deltas)
+
+        return results
+
+    @staticmethod
+    def transfer_stock(lines, source_warehouse_id, dest_warehouse_id):
+        """
+        Atomic inter-warehouse transfer for many products.
+        lines: list of tuples (product_id, quantity)
+
+        Source stock is validated with one grouped query. FIFO layers move with the goods:
+        a fully moved batch is re-keyed to the destination, a partially moved batch is split
+        (same batch number, cost, expiry and age). Warehouse stock and valuation move too.
+        Raises ValueError if the source warehouse does not have enough stock.
+        Returns one dict per product: product_id, quantity, moved_batches.
+        """
+        if source_warehouse_id == dest_warehouse_id:
+            raise ValueError("Gudang asal dan tujuan tidak boleh sama.")
+
+        demand = {}
+        for p_id, qty in lines:
+            if int(qty) > 0:
+                demand[int(p_id)] = demand.get(int(p_id), 0) + int(qty)
+        if not demand:
+            return []
+
+        # 1. Validation: source stock for all products in one query
+        available = dict(db.session.query(InventoryStock.product_id, func.sum(InventoryStock.quantity))
+                         .filter(InventoryStock.warehouse_id == source_warehouse_id,
+                                 InventoryStock.product_id.in_(demand.keys()))
+                         .group_by(InventoryStock.product_id).all())
+        short = [(p_id, qty, available.get(p_id) or 0) for p_id, qty in demand.items() if (available.get(p_id) or 0) < qty]
+        if short:
+            detail = ', '.join(f"produk {p_id} (butuh {qty}, sisa {avail})" for p_id, qty, avail in short)
+            raise ValueError(f"Stok di gudang asal tidak cukup: {detail}")
+
+        # 2. Move warehouse stock
+        stock_deltas = {}
+        for p_id, qty in demand.items():
+            SmartInventoryEngine._add_delta(stock_deltas, (p_id, source_warehouse_id), -qty)
+            SmartInventoryEngine._add_delta(stock_deltas, (p_id, dest_warehouse_id), qty)
+        SmartInventoryEngine._apply_warehouse_stock(stock_deltas)
+
+        # 3. Move / split FIFO layers
+        layers_by_product = SmartInventoryEngine._fifo_layers(demand, source_warehouse_id)
+        moved_ids = []
+        split_updates = {}
+        split_rows = []
+        valuation_deltas = {}
+        results = []
+        for p_id, qty in demand.items():
+            moved = []
+            for layer in layers_by_product.get(p_id, []):
+                if layer['quantity'] == layer['available']:
+                    moved_ids.append(layer['batch_id'])
+                else:
+                    split_updates[layer['batch_id']] = layer['quantity']
+                    split_rows.append({
+                        'product_id': p_id,
+                        'warehouse_id': dest_warehouse_id,
+                        'batch_number': layer['batch_number'],
+                        'initial_quantity': layer['quantity'],
+                        'current_quantity': layer['quantity'],
+                        'cost_price': layer['cost'],
+                        'expiry_date': layer['expiry_date'],
+                        'created_at': layer['created_at'] # Umur stok tetap mengikuti batch asal
+                    })
+                value = layer['quantity'] * layer['cost']
+                SmartInventoryEngine._add_delta(valuation_deltas, (p_id, source_warehouse_id), -layer['quantity'], -value)
+                SmartInventoryEngine._add_delta(valuation_deltas, (p_id, dest_warehouse_id), layer['quantity'], value)
+                moved.append({'batch_id': layer['batch_id'], 'batch_number': layer['batch_number'], 'quantity': layer['quantity']})
+            results.append({'product_id': p_id, 'quantity': qty, 'moved_batches': moved})
+
+        if moved_ids:
+            db.session.execute(
+                Batch.__table__.update()
+                .where(Batch.__table__.c.id.in_(moved_ids))
+                .values(warehouse_id=dest_warehouse_id)
+            )
+        SmartInventoryEngine._decrement_batches(split_updates)
+        if split_rows:
+            db.session.bulk_insert_mappings(Batch, split_rows)
+        SmartInventoryEngine._apply_valuation(valuation_deltas)
+
+        return results
+
+    @staticmethod
+    def process_adjustment(product_id, quantity_diff, cost_price, transaction_id=None, warehouse_id=None):
+        """
+        Stock adjustment (opname) through the engine so batches and valuation stay in sync.
+        quantity_diff > 0: found stock -> new batch at cost_price
+        quantity_diff < 0: missing stock -> consumed FIFO
+        Returns: absolute value of the adjustment
+        """
+        if quantity_diff > 0:
+            SmartInventoryEngine.process_inbound(product_id, quantity_diff, cost_price, auto_commit=False, warehouse_id=warehouse_id)
+            return quantity_diff * cost_price
+
+        if quantity_diff < 0:
+            result = SmartInventoryEngine.allocate_fifo_many(
+                [(product_id, -quantity_diff)],
+                transaction_ids=[transaction_id],
+                warehouse_id=warehouse_id
+            )[0]
+            layer_value = sum(a['quantity'] * a['cost'] for a in result['allocations'])
+            # Stock without batch layers (legacy stock) is valued at cost_price
+            return layer_value + result['shortage'] * cost_price
+
+        return 0
+
+    @staticmethod
+    def _add_delta(deltas, key, quantity, value=None):
+        if value is None:
+            deltas[key] = deltas.get(key, 0) + quantity
+        else:
+            dq, dv = deltas.get(key, (0, 0))
+            deltas[key] = (dq + quantity, dv + value)
+
+    @staticmethod
+    def _apply_warehouse_stock(deltas):
+        """
+        Incremental update of per-warehouse stock (inventory_stocks).
+        deltas: dict {(product_id, warehouse_id): quantity_delta}
+        """
+        deltas = {key: dq for key, dq in deltas.items() if dq}
+        if not deltas:
+            return
+
+        table = InventoryStock.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id, table.c.warehouse_id],
+            set_={
+                'quantity': func.coalesce(table.c.quantity, 0) + stmt.excluded.quantity,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        now = datetime.utcnow()
+        db.session.execute(stmt, [
+            {'product_id': p_id, 'warehouse_id': wh_id, 'quantity': dq, 'updated_at': now}
+            for (p_id, wh_id), dq in deltas.items()
+        ])
+
+    @staticmethod
+    def _apply_valuation(deltas):
+        """
+        Incremental update of the valuation ledger (stock_valuations).
+        deltas: dict {(product_id, warehouse_id): (quantity_delta, value_delta)}
+        """
+        if not deltas:
+            return
+
+        table = StockValuation.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id, table.c.warehouse_id],
+            set_={
+                'quantity': table.c.quantity + stmt.excluded.quantity,
+                'value': table.c.value + stmt.excluded.value,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        now = datetime.utcnow()
+        db.session.execute(stmt, [
+            {'product_id': p_id, 'warehouse_id': wh_id, 'quantity': dq, 'value': dv, 'updated_at': now}
+            for (p_id, wh_id), (dq, dv) in deltas.items()
+        ])
+
+    @staticmethod
+    def verify_valuation_ledger(repair=False, tolerance=0.01):
+        """
+        Recomputes valuation from batches and compares it with the ledger.
+        Returns: list of drift rows. With repair=True the ledger is corrected (caller commits).
+        """
+        warehouse_key = func.coalesce(Batch.warehouse_id, 0)
+        actual = {}
+        for row in db.session.query(
+            Batch.product_id,
+            warehouse_key.label('warehouse_id'),
+            func.sum(Batch.current_quantity).label('qty'),
+            func.sum(Batch.current_quantity * Batch.cost_price).label('value')
+        ).group_by(Batch.product_id, warehouse_key):
+            actual[(row.product_id, row.warehouse_id)] = (int(row.qty or 0), float(row.value or 0))
+
+        ledger = {}
+        for row in db.session.query(StockValuation.product_id, StockValuation.warehouse_id,
+                                    StockValuation.quantity, StockValuation.value):
+            ledger[(row.product_id, row.warehouse_id)] = (row.quantity or 0, row.value or 0)
+
+        drift = []
+        for key in sorted(set(actual) | set(ledger)):
+            batch_qty, batch_value = actual.get(key, (0, 0))
+            ledger_qty, ledger_value = ledger.get(key, (0, 0))
+            if batch_qty != ledger_qty or abs(batch_value - ledger_value) > tolerance:
+                drift.append({
+                    'product_id': key[0],
+                    'warehouse_id': key[1],
+                    'ledger_qty': ledger_qty,
+                    'batch_qty': batch_qty,
+                    'ledger_value': ledger_value,
+                    'batch_value': batch_value
+                })
+
+        if repair and drift:
+            SmartInventoryEngine._apply_valuation({
+                (d['product_id'], d['warehouse_id']): (d['batch_qty'] - d['ledger_qty'], d['batch_value'] - d['ledger_value'])
+                for d in drift
+            })
+
+        return drift
 
     @staticmethod
     def calculate_valuation_fifo():
         """
         Real-time Stock Valuation based on actual remaining batches.
         More accurate than Average Cost.
+        Read from the incrementally maintained ledger (O(products) instead of O(batches)).
         """
-        valuation = db.session.query(
-            func.sum(Batch.current_quantity * Batch.cost_price)
-        ).scalar()
+        valuation = db.session.query(func.sum(StockValuation.value)).scalar()
         return valuation or 0
 
     @staticmethod
-    def get_stock_ageing_report():
-        """
-        Returns products categorized by age of stock (Days in Inventory).
-        """
-        today = datetime.utcnow()
-        batches = Batch.query.filter(Batch.current_quantity > 0).all()
-        
-        ageing_data = []
-        for b in batches:
-            age_days = (today - b.created_at).days
-            category = 'Fresh (<30 days)'
-            if 30 <= age_days < 60: category = 'Aging (30-60 days)'
-            elif 60 <= age_days < 90: category = 'Old (60-90 days)'
-            elif age_days >= 90: category = 'Obsolete (>90 days)'
-            
-            ageing_data.append({
-                'product': b.product.name,
-                'batch': b.batch_number,
-                'qty': b.current_quantity,
-                'age_days': age_days,
-                'category': category,
-                'expiry': b.expiry_date
-            })
-            
-        return ageing_data
+    def get_valuation_by_category():
+        """
+        FIFO valuation per product category, read from the valuation ledger.
+        Returns: list of (category, quantity, value) sorted by value
+        """
+        return db.session.query(
+            Product.category,
+            func.sum(StockValuation.quantity),
+            func.sum(StockValuation.value)
+        ).join(Product, Product.id == StockValuation.product_id)\
+         .group_by(Product.category)\
+         .order_by(func.sum(StockValuation.value).desc()).all()
+
+    @staticmethod
+    def get_valuation_by_warehouse():
+        """
+        FIFO valuation per warehouse, read from the valuation ledger.
+        Returns: list of (warehouse name, quantity, value); batches without warehouse show as None
+        """
+        return db.session.query(
+            Warehouse.name,
+            func.sum(StockValuation.quantity),
+            func.sum(StockValuation.value)
+        ).outerjoin(Warehouse, Warehouse.id == StockValuation.warehouse_id)\
+         .group_by(StockValuation.warehouse_id, Warehouse.name)\
+         .order_by(func.sum(StockValuation.value).desc()).all()
+
+    # Age buckets: (label, min_days, max_days)
+    AGEING_BUCKETS = [
+        ('Fresh (<30 days)', 0, 30),
+        ('Aging (30-60 days)', 30, 60),
+        ('Old (60-90 days)', 60, 90),
+        ('Obsolete (>90 days)', 90, None),
+    ]
+
+    AGEING_SORT_COLUMNS = ('age_days', 'qty', 'value', 'product', 'expiry')
+
+    @staticmethod
+    def _ageing_columns():
+        """
+        Age (days) and bucket computed in SQL, so filtering/sorting/rollups stay in the database.
+        """
+        age_days = cast(func.julianday('now') - func.julianday(Batch.created_at), db.Integer)
+        bucket = case(
+            *[(age_days < max_days, label) for label, _, max_days in SmartInventoryEngine.AGEING_BUCKETS if max_days],
+            else_=SmartInventoryEngine.AGEING_BUCKETS[-1][0]
+        )
+        return age_days, bucket
+
+    @staticmethod
+    def _ageing_query(bucket=None, category=None, sort='age_days', direction='desc'):
+        age_days, bucket_col = SmartInventoryEngine._ageing_columns()
+        value = Batch.current_quantity * Batch.cost_price
+
+        query = db.session.query(
+            Batch.id.label('batch_id'),
+            Product.name.label('product'),
+            Product.sku.label('sku'),
+            Product.category.label('product_category'),
+            Batch.batch_number.label('batch'),
+            Batch.current_quantity.label('qty'),
+            value.label('value'),
+            Batch.expiry_date.label('expiry'),
+            age_days.label('age_days'),
+            bucket_col.label('category')
+        ).join(Product, Product.id == Batch.product_id)\
+         .filter(Batch.current_quantity > 0)
+
+        if bucket:
+            query = query.filter(bucket_col == bucket)
+        if category:
+            query = query.filter(Product.category == category)
+
+        sort_map = {
+            'age_days': age_days,
+            'qty': Batch.current_quantity,
+            'value': value,
+            'product': Product.name,
+            'expiry': Batch.expiry_date,
+        }
+        sort_col = sort_map.get(sort, age_days)
+        sort_col = sort_col.asc() if direction == 'asc' else sort_col.desc()
+        return query.order_by(sort_col, Batch.id.asc())
+
+    @staticmethod
+    def get_stock_ageing_report(page=1, per_page=50, sort='age_days', direction='desc', bucket=None, category=None):
+        """
+        Returns batches categorized by age of stock (Days in Inventory), one page at a time.
+        Bucketing, filtering and sorting are done in SQL (no per-row product lazy load).
+        """
+        query = SmartInventoryEngine._ageing_query(bucket, category, sort, direction)
+        return query.paginate(page=page, per_page=per_page, error_out=False)
+
+    @staticmethod
+    def get_stock_ageing_rollup(group_by='bucket', bucket=None, category=None):
+        """
+        Aggregated ageing: group_by in ('bucket', 'category', 'product').
+        Returns rows (key, batch_count, qty, value).
+        """
+        age_days, bucket_col = SmartInventoryEngine._ageing_columns()
+        key = {
+            'bucket': bucket_col,
+            'category': Product.category,
+            'product': Product.name,
+        }.get(group_by, bucket_col)
+
+        query = db.session.query(
+            key.label('key'),
+            func.count(Batch.id).label('batch_count'),
+            func.sum(Batch.current_quantity).label('qty'),
+            func.sum(Batch.current_quantity * Batch.cost_price).label('value')
+        ).join(Product, Product.id == Batch.product_id)\
+         .filter(Batch.current_quantity > 0)
+
+        if bucket:
+            query = query.filter(bucket_col == bucket)
+        if category:
+            query = query.filter(Product.category == category)
+
+        return query.group_by(key).order_by(func.sum(Batch.current_quantity * Batch.cost_price).desc()).all()
+
+    @staticmethod
+    def iter_stock_ageing_rows(bucket=None, category=None, sort='age_days', direction='desc', chunk_size=1000):
+        """
+        Streams the full ageing report for exports without materialising the whole list.
+        """
+        query = SmartInventoryEngine._ageing_query(bucket, category, sort, direction)
+        for row in query.yield_per(chunk_size):
+            yield row
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from app.models import db, Product, Transaction, Warehouse, STOCK_MOVEMENT_TYPES
+from app.services.stock_ledger import StockLedgerService
+
+class MovementService:
+    """
+    Stock movement history (transactions) with filters and keyset pagination.
+    Rows are plain column tuples (transaction + product sku/name + warehouse name in one
+    joined SELECT), so listing never lazy-loads Transaction.product per row.
+    """
+
+    PAGE_SIZE = 100
+    MOVEMENT_TYPES = STOCK_MOVEMENT_TYPES
+
+    @staticmethod
+    def parse_filters(args):
+        """Filters from request args (start_date, end_date, type, ref, warehouse_id, product_id)."""
+        def parse_date(key):
+            try:
+                return datetime.strptime(args.get(key, ''), '%Y-%m-%d').date()
+            except ValueError:
+                return None
+
+        t_type = (args.get('type') or '').upper()
+        return {
+            'start_date': parse_date('start_date'),
+            'end_date': parse_date('end_date'),
+            'type': t_type if t_type in MovementService.MOVEMENT_TYPES else None,
+            'ref': (args.get('ref') or '').strip() or None,
+            'warehouse_id': args.get('warehouse_id', type=int),
+            'product_id': args.get('product_id', type=int)
+        }
+
+    @staticmethod
+    def query(filters):
+        """Joined column query, newest first (created_at DESC, id DESC)."""
+        query = db.session.query(
+            Transaction.id,
+            Transaction.created_at,
+            Transaction.transaction_type,
+            Transaction.quantity,
+            StockLedgerService.signed_quantity().label('delta'),
+            Transaction.reference,
+            Transaction.branch_name,
+            Transaction.supplier,
+            Transaction.product_id,
+            Product.sku,
+            Product.name.label('product_name'),
+            Warehouse.name.label('warehouse_name')
+        ).join(Product, Product.id == Transaction.product_id)\
+         .outerjoin(Warehouse, Warehouse.id == Transaction.warehouse_id)
+
+        if filters.get('type'):
+            query = query.filter(Transaction.transaction_type == filters['type'])
+        else:
+            query = query.filter(Transaction.transaction_type.in_(MovementService.MOVEMENT_TYPES))
+        if filters.get('product_id'):
+            query = query.filter(Transaction.product_id == filters['product_id'])
+        if filters.get('warehouse_id'):
+            query = query.filter(Transaction.warehouse_id == filters['warehouse_id'])
+        if filters.get('start_date'):
+            query = query.filter(Transaction.created_at >= datetime.combine(filters['start_date'], datetime.min.time()))
+        if filters.get('end_date'):
+            query = query.filter(Transaction.created_at < datetime.combine(filters['end_date'] + timedelta(days=1), datetime.min.time()))
+        if filters.get('ref'):
+            # Prefix as a range (uses ix_transactions_reference, unlike LIKE on SQLite)
+            query = query.filter(Transaction.reference >= filters['ref'], Transaction.reference < filters['ref'] + '\uffff')
+
+        return query.order_by(Transaction.created_at.desc(), Transaction.id.desc())
+
+    @staticmethod
+    def page(filters, after_id=None, limit=None):
+        """
+        One page of movements after the cursor (id of the last row of the previous page).
+        Returns: (rows, next_cursor)
+        """
+        limit = limit or MovementService.PAGE_SIZE
+        query = MovementService.query(filters)
+        if after_id:
+            cursor_at = db.session.query(Transaction.created_at).filter(Transaction.id == after_id).scalar()
+            if cursor_at is not None:
+                query = query.filter(or_(
+                    Transaction.created_at < cursor_at,
+                    and_(Transaction.created_at == cursor_at, Transaction.id < after_id)
+                ))
+
+        rows = query.limit(limit + 1).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    @staticmethod
+    def iter_rows(filters, chunk_size=1000):
+        """All matching movements, streamed from the cursor (CSV export)."""
+        return MovementService.query(filters).yield_per(chunk_size)
+
+    @staticmethod
+    def to_dict(row):
+        return {
+            'id': row.id,
+            'created_at': row.created_at.strftime('%d/%m/%Y %H:%M') if row.created_at else None,
+            'type': row.transaction_type,
+            'quantity': row.quantity,
+            'delta': int(row.delta or 0),
+            'reference': row.reference,
+            'branch_name': row.branch_name,
+            'supplier': row.supplier,
+            'product_id': row.product_id,
+            'sku': row.sku,
+            'product_name': row.product_name,
+            'warehouse': row.warehouse_name
+        }
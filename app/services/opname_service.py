@@ -0,0 +1,236 @@
+import csv
+import io
+from datetime import datetime
+from sqlalchemy import and_, func
+from app.models import db, Product, Transaction, InventoryStock
+from app.services.inventory_engine import SmartInventoryEngine
+from app.services.stock_service import StockService
+from app.services.accounting_service import AccountingService
+from app.services.cycle_count_service import CycleCountService
+from app.services.sequence_service import SequenceService
+
+class OpnameService:
+    """
+    Stock opname (physical count) posting.
+    Counts are compared to system stock chunk by chunk with set-based queries,
+    adjustments are written in bulk and every opname reference gets ONE
+    summarised gain/loss journal.
+    """
+
+    CHUNK_SIZE = 1000
+    SKU_COLUMNS = ('sku', 'kode', 'kode_barang')
+    QTY_COLUMNS = ('counted', 'real_qty', 'stok_fisik', 'quantity', 'qty')
+
+    @staticmethod
+    def iter_sheet_rows(filename, stream):
+        """
+        Streams a counted sheet row by row (the file is never loaded as a whole).
+        CSV : header with sku (or product_id) and counted/real_qty/quantity/qty
+        XLSX: first sheet, same header in the first row (openpyxl read-only mode)
+        Yields: (row_number, {column: value})
+        """
+        if (filename or '').lower().endswith(('.xlsx', '.xlsm')):
+            from openpyxl import load_workbook
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = [str(h or '').strip().lower() for h in next(rows, None) or []]
+                for no, values in enumerate(rows, start=2):
+                    if values and any(v not in (None, '') for v in values):
+                        yield no, dict(zip(header, values))
+            finally:
+                workbook.close()
+            return
+
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.reader(text)
+            header = [h.strip().lower() for h in next(reader, None) or []]
+            for no, values in enumerate(reader, start=2):
+                if any(v.strip() for v in values):
+                    yield no, dict(zip(header, values))
+        finally:
+            text.detach() # Keep the upload stream open (retry re-reads it)
+
+    @staticmethod
+    def read_counts(rows):
+        """
+        Aggregates streamed sheet rows into {product_id: counted}.
+        The same SKU on several rows (e.g. counted on two racks) is summed.
+        SKUs are resolved and product_ids checked in chunks with one IN query each.
+        Returns: (counts, errors)
+        """
+        by_sku, by_id, errors = {}, {}, []
+        for no, row in rows:
+            sku = next((str(row[c]).strip() for c in OpnameService.SKU_COLUMNS if row.get(c) not in (None, '')), None)
+            raw_qty = next((row[c] for c in OpnameService.QTY_COLUMNS if row.get(c) not in (None, '')), None)
+            try:
+                qty = int(float(raw_qty))
+            except (TypeError, ValueError):
+                errors.append(f"baris {no}: jumlah '{raw_qty}' tidak valid")
+                continue
+            if qty < 0:
+                errors.append(f"baris {no}: jumlah tidak boleh negatif")
+                continue
+
+            if sku:
+                by_sku[sku] = by_sku.get(sku, 0) + qty
+            elif str(row.get('product_id') or '').strip().isdigit():
+                p_id = int(str(row['product_id']).strip())
+                by_id[p_id] = by_id.get(p_id, 0) + qty
+            else:
+                errors.append(f"baris {no}: SKU kosong")
+
+        counts = {}
+        ids = list(by_id)
+        for i in range(0, len(ids), OpnameService.CHUNK_SIZE):
+            chunk = ids[i:i + OpnameService.CHUNK_SIZE]
+            known = {p_id for (p_id,) in db.session.query(Product.id).filter(Product.id.in_(chunk))}
+            for p_id in chunk:
+                if p_id not in known:
+                    errors.append(f"product_id '{p_id}' tidak dikenal")
+                    continue
+                counts[p_id] = by_id[p_id]
+
+        skus = list(by_sku)
+        for i in range(0, len(skus), OpnameService.CHUNK_SIZE):
+            chunk = skus[i:i + OpnameService.CHUNK_SIZE]
+            sku_map = dict(db.session.query(Product.sku, Product.id).filter(Product.sku.in_(chunk)))
+            for sku in chunk:
+                if sku not in sku_map:
+                    errors.append(f"SKU '{sku}' tidak dikenal")
+                    continue
+                counts[sku_map[sku]] = counts.get(sku_map[sku], 0) + by_sku[sku]
+
+        return counts, errors
+
+    @staticmethod
+    def post_counts(counts, reference=None, warehouse_id=None, notes='', chunk_size=None, prefix='OPN'):
+        """
+        Posts one opname document.
+        counts: {product_id: counted quantity}; products not in counts are left unchanged.
+        reference: None = next number of `prefix` (taken inside this unit of work, so a retry renumbers).
+        warehouse_id: counted warehouse, system stock = its inventory_stocks quantity.
+                      None = whole-company count against Product.stock_quantity
+                      (layers are then adjusted in the default warehouse).
+
+        Per chunk: one query reads system stock + versions, one executemany sets stock
+        (version-guarded, raises StockConflictError), OPNAME rows are bulk inserted and
+        batch layers/valuation follow via the engine (gain = new layers, loss = FIFO).
+        Caller commits (StockService.run_with_retry).
+        Returns: variance report dict
+        """
+        chunk_size = chunk_size or OpnameService.CHUNK_SIZE
+        reference = reference or SequenceService.next_number(prefix)
+        if Transaction.query.filter_by(reference=reference, transaction_type='OPNAME').first():
+            raise ValueError(f"Referensi {reference} sudah dipakai.")
+
+        layer_wh = warehouse_id or SmartInventoryEngine.get_default_warehouse_id()
+        if warehouse_id:
+            system_col = func.coalesce(InventoryStock.quantity, 0)
+        else:
+            system_col = func.coalesce(Product.stock_quantity, 0)
+
+        report = {
+            'reference': reference, 'warehouse_id': warehouse_id,
+            'counted': 0, 'matched': 0, 'gain_qty': 0, 'loss_qty': 0,
+            'gain_value': 0.0, 'loss_value': 0.0, 'rows': []
+        }
+        now = datetime.utcnow()
+        product_ids = sorted(counts)
+        for i in range(0, len(product_ids), chunk_size):
+            chunk = product_ids[i:i + chunk_size]
+            query = db.session.query(
+                Product.id, Product.sku, Product.name, Product.cost,
+                Product.stock_quantity, Product.version, system_col.label('system_qty')
+            )
+            if warehouse_id:
+                query = query.outerjoin(InventoryStock, and_(
+                    InventoryStock.product_id == Product.id,
+                    InventoryStock.warehouse_id == warehouse_id
+                ))
+            current = query.filter(Product.id.in_(chunk)).all()
+            report['counted'] += len(current)
+            CycleCountService.mark_counted([row.id for row in current], reference, now)
+
+            variances = [(row, counts[row.id] - row.system_qty) for row in current if counts[row.id] != row.system_qty]
+            report['matched'] += len(current) - len(variances)
+            if not variances:
+                continue
+
+            # 1. Master stock (absolute, optimistic version check)
+            StockService.set_quantities([
+                (row.id, (row.stock_quantity or 0) + diff, row.version) for row, diff in variances
+            ])
+
+            # 2. OPNAME movement rows (one executemany)
+            db.session.bulk_insert_mappings(Transaction, [{
+                'product_id': row.id,
+                'transaction_type': 'OPNAME',
+                'quantity': abs(diff),
+                'stock_delta': diff,
+                'total_amount': 0,
+                'reference': reference,
+                'warehouse_id': layer_wh,
+                'created_at': now,
+                'supplier': f"System: {row.system_qty} -> Real: {counts[row.id]}",
+                'branch_name': notes
+            } for row, diff in variances])
+
+            # 3. Batch layers & valuation: gains as new layers, losses consumed FIFO
+            gains = [(row, diff) for row, diff in variances if diff > 0]
+            losses = [(row, diff) for row, diff in variances if diff < 0]
+            values = {}
+            if gains:
+                SmartInventoryEngine.process_inbound_many([{
+                    'product_id': row.id, 'quantity': diff, 'cost_price': row.cost, 'warehouse_id': layer_wh
+                } for row, diff in gains], auto_commit=False)
+                values.update({row.id: diff * row.cost for row, diff in gains})
+            if losses:
+                trx_ids = dict(db.session.query(Transaction.product_id, Transaction.id).filter(
+                    Transaction.reference == reference,
+                    Transaction.transaction_type == 'OPNAME',
+                    Transaction.product_id.in_([row.id for row, _ in losses])
+                ))
+                results = SmartInventoryEngine.allocate_fifo_many(
+                    [(row.id, -diff) for row, diff in losses],
+                    transaction_ids=[trx_ids.get(row.id) for row, _ in losses],
+                    warehouse_id=layer_wh
+                )
+                for (row, _), result in zip(losses, results):
+                    # Stock without batch layers (legacy stock) is valued at Product.cost
+                    values[row.id] = sum(a['quantity'] * a['cost'] for a in result['allocations']) + result['shortage'] * row.cost
+
+            for row, diff in variances:
+                key = 'gain' if diff > 0 else 'loss'
+                report[f'{key}_qty'] += abs(diff)
+                report[f'{key}_value'] += values[row.id]
+                report['rows'].append({
+                    'product_id': row.id, 'sku': row.sku, 'name': row.name,
+                    'system': row.system_qty, 'counted': counts[row.id],
+                    'diff': diff, 'value': values[row.id] if diff > 0 else -values[row.id]
+                })
+
+        # 4. One summarised journal for the whole document
+        report['journal'] = AccountingService.record_opname(reference, report['gain_value'], report['loss_value'])
+        report['adjusted'] = len(report['rows'])
+        report['rows'].sort(key=lambda r: abs(r['value']), reverse=True)
+        return report
+
+    @staticmethod
+    def import_sheet(filename, stream, reference=None, warehouse_id=None, notes=''):
+        """
+        Counted-sheet upload: stream -> counts -> post_counts, as one unit of work
+        (retried from the start of the file on a stock conflict).
+        Returns: variance report dict (with 'errors' for skipped rows)
+        """
+        def work():
+            stream.seek(0)
+            counts, errors = OpnameService.read_counts(OpnameService.iter_sheet_rows(filename, stream))
+            if not counts:
+                raise ValueError("; ".join(errors[:5]) or "File tidak berisi hitungan stok.")
+            report = OpnameService.post_counts(counts, reference, warehouse_id=warehouse_id, notes=notes)
+            report['errors'] = errors
+            return report
+
+        return StockService.run_with_retry(work)
@@ -0,0 +1,78 @@
+from datetime import datetime
+from app.models import db, Product, Transaction
+from app.services.inventory_engine import SmartInventoryEngine
+from app.services.stock_service import StockService
+from app.services.accounting_service import AccountingService
+from app.services.sequence_service import SequenceService
+
+class ReceivingService:
+
+    @staticmethod
+    def receive(lines, supplier, reference, expiry_date=None, warehouse_id=None):
+        """
+        Receiving pipeline for one document (Surat Jalan / reference).
+        lines: list of dicts {product_id, quantity, cost (optional, <= 0 = Product.cost)}
+
+        Products are loaded with one IN query, batches/stock are applied in bulk,
+        all IN transactions are inserted at once and the document gets ONE balanced
+        purchase journal (Dr 1300 / Cr 1100) for the accumulated line costs.
+        Raises ValueError if a line refers to an unknown product (nothing is written);
+        a failed journal does not block the receipt. Caller commits.
+        Returns: dict lines, total_cost, journal, accounting_error
+        """
+        product_ids = {int(line['product_id']) for line in lines}
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()}
+        missing = product_ids - set(products)
+        if missing:
+            raise ValueError(f"Product not found: {', '.join(str(p) for p in sorted(missing))}")
+
+        received = []
+        for line in lines:
+            product = products[int(line['product_id'])]
+            qty = int(line['quantity'])
+            cost = float(line.get('cost') or 0)
+            received.append((product, qty, cost if cost > 0 else product.cost))
+
+        if not received:
+            raise ValueError("Tidak ada item yang diterima")
+
+        warehouse_id = warehouse_id or SmartInventoryEngine.get_default_warehouse_id()
+
+        # 1. Batches (1 bulk insert) & master stock (atomic UPDATE per product)
+        SmartInventoryEngine.process_inbound_many([{
+            'product_id': product.id,
+            'quantity': qty,
+            'cost_price': cost,
+            'expiry_date': expiry_date,
+            'warehouse_id': warehouse_id
+        } for product, qty, cost in received], auto_commit=False)
+        StockService.adjust_many([(product.id, qty) for product, qty, _ in received])
+
+        # 2. Stock ledger: all IN rows in one executemany (no per-row flush)
+        now = datetime.utcnow()
+        db.session.bulk_insert_mappings(Transaction, [{
+            'product_id': product.id,
+            'transaction_type': 'IN',
+            'quantity': qty,
+            'total_amount': 0,
+            'supplier': supplier,
+            'reference': reference,
+            'warehouse_id': warehouse_id,
+            'created_at': now,
+            'fulfillment_status': 'completed'
+        } for product, qty, _ in received])
+
+        # 3. One journal for the whole document
+        total_cost = sum(qty * cost for _, qty, cost in received)
+        journal = accounting_error = None
+        try:
+            journal = AccountingService.record_purchase(
+                reference=reference or SequenceService.next_number('RCV'),
+                amount=total_cost,
+                supplier=supplier,
+                description=f"Pembelian Stok dari {supplier} ({len(received)} item)"
+            )
+        except Exception as e:
+            accounting_error = str(e)
+
+        return {'lines': len(received), 'total_cost': total_cost, 'journal': journal, 'accounting_error': accounting_error}
@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import bindparam, func, select
+from app.models import db, Product, StockReservation
+from app.services.inventory_engine import SmartInventoryEngine
+from app.services.stock_service import StockConflictError
+
+class ReservationService:
+    """
+    Stock reservations (available-to-promise).
+    Every active reservation is a row in stock_reservations (per product & warehouse,
+    with expiry); Product.reserved_quantity caches their total so
+    ATP = stock_quantity - reserved_quantity is read without aggregating the ledger.
+    The cache is only changed by guarded executemany UPDATEs evaluated in the
+    database (SET reserved = reserved + :q WHERE stock - reserved >= :q), so two
+    orders can never promise the same unit.
+    """
+
+    DEFAULT_TTL = timedelta(hours=48)
+
+    @staticmethod
+    def ttl():
+        try:
+            return current_app.config.get('RESERVATION_TTL', ReservationService.DEFAULT_TTL)
+        except RuntimeError: # Outside app context (scripts)
+            return ReservationService.DEFAULT_TTL
+
+    @staticmethod
+    def available(product_ids):
+        """ATP per product in one query: dict {product_id: stock - reserved}."""
+        product_ids = {int(p_id) for p_id in product_ids}
+        if not product_ids:
+            return {}
+        atp = func.coalesce(Product.stock_quantity, 0) - func.coalesce(Product.reserved_quantity, 0)
+        return dict(db.session.query(Product.id, atp).filter(Product.id.in_(product_ids)))
+
+    @staticmethod
+    def _totals(lines):
+        totals = {}
+        for p_id, qty in lines:
+            totals[int(p_id)] = totals.get(int(p_id), 0) + int(qty)
+        return {p_id: qty for p_id, qty in sorted(totals.items()) if qty > 0}
+
+    @staticmethod
+    def _hold(totals):
+        """Adds to the reserved cache, one guarded executemany; raises ValueError if ATP is short."""
+        products = Product.__table__
+        result = db.session.execute(
+            products.update()
+            .where(products.c.id == bindparam('p_id'),
+                   products.c.stock_quantity - products.c.reserved_quantity >= bindparam('p_qty'))
+            .values(reserved_quantity=products.c.reserved_quantity + bindparam('p_qty')),
+            [{'p_id': p_id, 'p_qty': qty} for p_id, qty in totals.items()]
+        )
+        if result.rowcount not in (-1, None) and result.rowcount != len(totals):
+            current = {row.id: row for row in db.session.query(
+                Product.id, Product.name, Product.stock_quantity, Product.reserved_quantity
+            ).filter(Product.id.in_(totals.keys()))}
+            missing = [p_id for p_id in totals if p_id not in current]
+            if missing:
+                raise ValueError(f"Product not found: {', '.join(str(p) for p in missing)}")
+            # Rows that were not updated still have ATP < qty
+            atp = {p_id: (row.stock_quantity or 0) - (row.reserved_quantity or 0) for p_id, row in current.items()}
+            short = [p_id for p_id, qty in totals.items() if atp[p_id] < qty]
+            name, left = (current[short[0]].name, max(atp[short[0]], 0)) if short else ('?', '?')
+            raise ValueError(f"Stok {name} tidak cukup! (Tersedia: {left})")
+
+    @staticmethod
+    def _unhold(totals):
+        """Subtracts from the reserved cache (never below zero)."""
+        if not totals:
+            return
+        products = Product.__table__
+        db.session.execute(
+            products.update().where(products.c.id == bindparam('p_id'))
+            .values(reserved_quantity=func.max(products.c.reserved_quantity - bindparam('p_qty'), 0)),
+            [{'p_id': p_id, 'p_qty': qty} for p_id, qty in sorted(totals.items())]
+        )
+
+    @staticmethod
+    def reserve(source_type, source_id, lines, reference=None, warehouse_id=None, expires_at=None):
+        """
+        Holds stock for a document (e.g. a Draft sales order).
+        lines: list of tuples (product_id, quantity); same product on several lines is summed.
+        Due reservations of these products are expired first, so their stock is promisable again.
+        Raises ValueError if any product does not have enough ATP (caller rolls back).
+        """
+        ReservationService.reserve_many([(source_type, source_id, reference, lines)],
+                                        warehouse_id=warehouse_id, expires_at=expires_at)
+
+    @staticmethod
+    def reserve_many(documents, warehouse_id=None, expires_at=None):
+        """
+        Holds stock for many documents at once (bulk import): one guarded executemany
+        on the summed quantities and one bulk insert of reservation rows.
+        documents: list of tuples (source_type, source_id, reference, lines)
+        """
+        per_doc = [(source_type, source_id, reference, ReservationService._totals(lines))
+                   for source_type, source_id, reference, lines in documents]
+        totals = ReservationService._totals(
+            (p_id, qty) for _, _, _, doc_totals in per_doc for p_id, qty in doc_totals.items())
+        if not totals:
+            return
+        ReservationService.expire(product_ids=totals.keys())
+        ReservationService._hold(totals)
+
+        now = datetime.utcnow()
+        warehouse_id = warehouse_id or SmartInventoryEngine.get_default_warehouse_id()
+        expires_at = expires_at or now + ReservationService.ttl()
+        db.session.bulk_insert_mappings(StockReservation, [{
+            'product_id': p_id,
+            'warehouse_id': warehouse_id,
+            'source_type': source_type,
+            'source_id': source_id,
+            'reference': reference,
+            'quantity': qty,
+            'status': 'Active',
+            'expires_at': expires_at,
+            'created_at': now
+        } for source_type, source_id, reference, doc_totals in per_doc for p_id, qty in doc_totals.items()])
+        ReservationService._expire_products(totals.keys())
+
+    @staticmethod
+    def _close(rows, status, now=None):
+        """Closes reservation rows [(id, product_id, quantity)] and releases their cache."""
+        if not rows:
+            return {}
+        ids = [row[0] for row in rows]
+        closed = StockReservation.query.filter(StockReservation.id.in_(ids), StockReservation.status == 'Active')\
+            .update({'status': status, 'closed_at': now or datetime.utcnow()}, synchronize_session=False)
+        if closed != len(ids):
+            # Closed concurrently (e.g. expiry sweep): retry from a fresh read
+            raise StockConflictError("Reservasi berubah saat diproses, silakan ulangi.")
+
+        totals = ReservationService._totals((p_id, qty) for _, p_id, qty in rows)
+        ReservationService._unhold(totals)
+        ReservationService._expire_products(totals.keys())
+        return totals
+
+    @staticmethod
+    def _active_rows(source_type, source_id):
+        return db.session.query(StockReservation.id, StockReservation.product_id, StockReservation.quantity).filter(
+            StockReservation.source_type == source_type,
+            StockReservation.source_id == source_id,
+            StockReservation.status == 'Active'
+        ).all()
+
+    @staticmethod
+    def release(source_type, source_id):
+        """Drops the active reservations of a document (cancelled / edited). Returns {product_id: qty}."""
+        return ReservationService._close(ReservationService._active_rows(source_type, source_id), 'Released')
+
+    @staticmethod
+    def consume(source_type, source_id, lines, reference=None):
+        """
+        Turns a document's reservation into the actual stock-out (order confirmation).
+        What is still reserved is released; any shortfall (reservation expired or missing,
+        e.g. drafts from before reservations existed) must come from free ATP first, so
+        confirming can never take stock promised to another order.
+        Stock itself is deducted by the caller (StockService.adjust_many).
+        """
+        needed = ReservationService._totals(lines)
+        ReservationService.expire(product_ids=needed.keys())
+        held = ReservationService._totals((p_id, qty) for _, p_id, qty in ReservationService._active_rows(source_type, source_id))
+        shortfall = {p_id: qty - held.get(p_id, 0) for p_id, qty in needed.items() if qty > held.get(p_id, 0)}
+        if shortfall:
+            ReservationService.reserve(source_type, source_id, shortfall.items(), reference=reference)
+        return ReservationService._close(ReservationService._active_rows(source_type, source_id), 'Consumed')
+
+    @staticmethod
+    def expire(now=None, product_ids=None):
+        """
+        Expires due reservations (all, or only for product_ids) and releases their stock.
+        Returns: number of reservations expired. Caller commits.
+        """
+        now = now or datetime.utcnow()
+        query = db.session.query(StockReservation.id, StockReservation.product_id, StockReservation.quantity).filter(
+            StockReservation.status == 'Active',
+            StockReservation.expires_at <= now
+        )
+        if product_ids is not None:
+            query = query.filter(StockReservation.product_id.in_(list(product_ids)))
+        rows = query.all()
+        ReservationService._close(rows, 'Expired', now)
+        return len(rows)
+
+    @staticmethod
+    def rebuild_cache():
+        """
+        Recomputes Product.reserved_quantity from the active ledger (one UPDATE).
+        For the migration and as a repair tool; normal operation is incremental.
+        """
+        active = select(func.coalesce(func.sum(StockReservation.quantity), 0)).where(
+            StockReservation.product_id == Product.id,
+            StockReservation.status == 'Active'
+        ).scalar_subquery()
+        return Product.query.update({Product.reserved_quantity: active}, synchronize_session=False)
+
+    @staticmethod
+    def _expire_products(product_ids):
+        # Loaded Product objects must re-read the cache after a Core UPDATE
+        for p_id in product_ids:
+            product = db.session.identity_map.get(db.session.identity_key(Product, p_id))
+            if product is not None:
+                db.session.expire(product, ['reserved_quantity'])
@@ -0,0 +1,320 @@
+import csv
+import io
+import itertools
+import json
+import os
+import secrets
+from datetime import datetime
+from sqlalchemy import or_
+from app.models import db, Product, Customer, SalesOrder, SalesOrderItem
+from app.services.reservation_service import ReservationService
+from app.services.sales_service import SalesService
+from app.services.sequence_service import SequenceService
+from app.services.stock_service import StockService
+
+class SalesImportService:
+    """
+    Bulk sales order import (marketplace / B2B files).
+    One row = one order line; rows with the same order_ref form one Draft order.
+    Rows are streamed and grouped in a bounded window (rows of one order close together),
+    orders are processed in chunks, each chunk is one transaction: customers, products
+    and already imported refs are resolved with set lookups, order numbers are taken
+    as one block per period, orders / items / reservations are written with executemany.
+    An order with any invalid row is skipped as a whole and reported row by row.
+    """
+
+    CHUNK_SIZE = 1000 # orders per commit
+    MAX_CHUNK_SIZE = 5000 # upper bound for a caller-supplied chunk size (keeps the grouping window bounded)
+    ORDER_COLUMNS = ('order_ref', 'external_ref', 'no_order')
+    CUSTOMER_COLUMNS = ('customer_id', 'customer', 'pelanggan')
+    QTY_COLUMNS = ('qty', 'quantity', 'jumlah')
+    REPORT_COLUMNS = ['row', 'order_ref', 'error']
+
+    @staticmethod
+    def iter_rows(filename, stream):
+        """
+        Streams import rows.
+        CSV  : header order_ref, customer (id / name / email), date, due_date, notes, sku (or product_id), qty
+        JSON : JSON lines (one object per line) or one array; an object may carry its lines in "items"
+               (JSON lines are streamed, a single array is parsed as a whole)
+        Yields: (row_number, {column: value}); for JSON the row number counts order lines
+        """
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            if not (filename or '').lower().endswith(('.json', '.jsonl', '.ndjson')):
+                reader = csv.reader(text)
+                header = [h.strip().lower() for h in next(reader, None) or []]
+                for no, values in enumerate(reader, start=2):
+                    if any(v.strip() for v in values):
+                        yield no, dict(zip(header, (v.strip() for v in values)))
+                return
+
+            lines = (line for line in text if line.strip())
+            first = next(lines, '')
+            if first.lstrip().startswith('['):
+                objects = json.loads(first + ''.join(lines))
+            else:
+                objects = (json.loads(line) for line in itertools.chain([first], lines) if line.strip())
+
+            no = 0
+            for obj in objects:
+                obj = {str(k).lower(): v for k, v in obj.items()}
+                for item in obj.pop('items', None) or [None]:
+                    no += 1
+                    row = dict(obj)
+                    if item:
+                        row.update({str(k).lower(): v for k, v in item.items()})
+                    yield no, row
+        finally:
+            text.detach() # The caller owns the upload stream
+
+    @staticmethod
+    def _pick(row, columns):
+        return next((row[c] for c in columns if row.get(c) not in (None, '')), None)
+
+    @staticmethod
+    def iter_chunks(rows, chunk_size, report):
+        """
+        Groups streamed rows into chunks of chunk_size complete orders.
+        Only a window of 2 x chunk_size open orders is held in memory: rows of one order_ref
+        must follow each other within chunk_size other orders (exports list lines per order).
+        A row whose order was already handed to an earlier chunk is reported, not merged
+        (only the refs of flushed orders are kept to detect this).
+        Counts rows / orders into report and adds errors for rows without a ref.
+        Yields: list of (order_ref, [(row_number, row), ...]) in first-seen order
+        """
+        window, flushed = {}, set()
+        for no, row in rows:
+            report['lines'] += 1
+            ref = SalesImportService._pick(row, SalesImportService.ORDER_COLUMNS)
+            if ref is None:
+                report['errors'].append({'row': no, 'order_ref': '', 'error': 'order_ref kosong'})
+                continue
+            ref = str(ref).strip()
+            if ref in flushed:
+                report['errors'].append({'row': no, 'order_ref': ref,
+                                         'error': 'baris terpisah jauh dari baris lain order ini (urutkan file per order_ref)'})
+                continue
+            if ref not in window:
+                if len(window) >= 2 * chunk_size:
+                    chunk = list(itertools.islice(window.items(), chunk_size))
+                    for done, _ in chunk:
+                        del window[done]
+                        flushed.add(done)
+                    yield chunk
+                window[ref] = []
+                report['orders'] += 1
+            window[ref].append((no, row))
+
+        items = list(window.items())
+        for i in range(0, len(items), chunk_size):
+            yield items[i:i + chunk_size]
+
+    @staticmethod
+    def _parse_date(value):
+        if value in (None, ''):
+            return None
+        return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date()
+
+    @staticmethod
+    def _import_chunk(chunk):
+        """
+        One transaction for a list of (order_ref, rows). Caller commits.
+        Returns: (orders imported, lines imported, errors)
+        """
+        pick = SalesImportService._pick
+        errors = []
+
+        # 1. Set lookups: products (ids + SKUs), customers (id / name / email), refs already imported
+        p_ids, skus, c_ids, c_keys = set(), set(), set(), set()
+        for _, rows in chunk:
+            for _, row in rows:
+                raw_p = str(row.get('product_id') or '').strip()
+                if raw_p.isdigit():
+                    p_ids.add(int(raw_p))
+                elif row.get('sku') not in (None, ''):
+                    skus.add(str(row['sku']).strip())
+                raw_c = str(pick(row, SalesImportService.CUSTOMER_COLUMNS) or '').strip()
+                if raw_c.isdigit():
+                    c_ids.add(int(raw_c))
+                elif raw_c:
+                    c_keys.add(raw_c)
+
+        products, by_sku = {}, {}
+        for row in db.session.query(Product.id, Product.sku, Product.name, Product.price)\
+                .filter(or_(Product.id.in_(p_ids), Product.sku.in_(skus))):
+            products[row.id] = row
+            by_sku[row.sku] = row
+
+        customers = {}
+        for row in db.session.query(Customer.id, Customer.name, Customer.email)\
+                .filter(or_(Customer.id.in_(c_ids), Customer.name.in_(c_keys), Customer.email.in_(c_keys)))\
+                .order_by(Customer.id.desc()):
+            # Same name on several customers: the oldest one wins (deterministic)
+            customers[str(row.id)] = row.id
+            customers[row.name] = row.id
+            if row.email:
+                customers[row.email] = row.id
+
+        refs = [ref for ref, _ in chunk]
+        imported = {ref for (ref,) in db.session.query(SalesOrder.external_ref).filter(SalesOrder.external_ref.in_(refs))}
+
+        # 2. Validate every order (all rows), build its lines
+        valid = []
+        for ref, rows in chunk:
+            order_errors = []
+            head = rows[0][1]
+            if ref in imported:
+                errors += [{'row': no, 'order_ref': ref, 'error': 'order sudah pernah diimpor'} for no, _ in rows]
+                continue
+
+            raw_c = str(pick(head, SalesImportService.CUSTOMER_COLUMNS) or '').strip()
+            customer_id = customers.get(raw_c) if raw_c else None
+            if raw_c and customer_id is None:
+                order_errors.append((rows[0][0], f"customer '{raw_c}' tidak dikenal"))
+            try:
+                order_date = SalesImportService._parse_date(head.get('date')) or datetime.now().date()
+                due_date = SalesImportService._parse_date(head.get('due_date'))
+            except ValueError:
+                order_date = due_date = None
+                order_errors.append((rows[0][0], "format tanggal harus YYYY-MM-DD"))
+
+            demand = {}
+            for no, row in rows:
+                raw_p = str(row.get('product_id') or '').strip()
+                product = products.get(int(raw_p)) if raw_p.isdigit() else by_sku.get(str(row.get('sku') or '').strip())
+                if product is None:
+                    order_errors.append((no, f"produk '{raw_p or row.get('sku') or ''}' tidak dikenal"))
+                    continue
+                try:
+                    qty = int(float(pick(row, SalesImportService.QTY_COLUMNS)))
+                except (TypeError, ValueError):
+                    qty = 0
+                if qty <= 0:
+                    order_errors.append((no, "qty harus > 0"))
+                    continue
+                if not product.price or product.price <= 0:
+                    order_errors.append((no, f"harga jual {product.name} belum diatur"))
+                    continue
+                demand[product.id] = demand.get(product.id, 0) + qty
+
+            if order_errors:
+                errors += [{'row': no, 'order_ref': ref, 'error': msg} for no, msg in order_errors]
+                failed = {no for no, _ in order_errors}
+                errors += [{'row': no, 'order_ref': ref, 'error': 'dilewati: baris lain di order ini error'}
+                           for no, _ in rows if no not in failed]
+                continue
+            valid.append({
+                'ref': ref, 'rows': rows, 'customer_id': customer_id, 'date': order_date, 'due_date': due_date,
+                'notes': head.get('notes') or None, 'demand': demand
+            })
+
+        # 3. Availability in file order: an order that no longer fits ATP is skipped
+        wanted = {p_id for order in valid for p_id in order['demand']}
+        if wanted:
+            ReservationService.expire(product_ids=wanted)
+        available = ReservationService.available(wanted)
+        accepted = []
+        for order in valid:
+            short = [p_id for p_id, qty in order['demand'].items() if qty > available.get(p_id, 0)]
+            if short:
+                name = products[short[0]].name
+                errors += [{'row': no, 'order_ref': order['ref'],
+                            'error': f"Stok {name} tidak cukup! (Tersedia: {max(available.get(short[0], 0), 0)})"}
+                           for no, _ in order['rows']]
+                continue
+            for p_id, qty in order['demand'].items():
+                available[p_id] -= qty
+            accepted.append(order)
+        if not accepted:
+            return 0, 0, errors
+
+        # 4. Order numbers: one block per period (SO counter is per month of the order date)
+        by_period = {}
+        for order in accepted:
+            by_period.setdefault(SequenceService.period_of('SO', order['date']), []).append(order)
+        for period, orders in by_period.items():
+            first = SequenceService.next_block('SO', len(orders), period)
+            for n, order in enumerate(orders, start=first):
+                order['number'] = f"SO-{period}-{n:0{SequenceService.WIDTH}d}"
+
+        # 5. Headers, ids read back by number, items and reservations in bulk
+        now = datetime.utcnow()
+        for order in accepted:
+            order['total'] = sum(products[p_id].price * qty for p_id, qty in order['demand'].items())
+        db.session.bulk_insert_mappings(SalesOrder, [{
+            'order_number': order['number'],
+            'external_ref': order['ref'],
+            'customer_id': order['customer_id'],
+            'date': order['date'],
+            'due_date': order['due_date'],
+            'status': 'Draft',
+            'notes': order['notes'],
+            'total_amount': order['total'],
+            'grand_total': order['total'],
+            'created_at': now
+        } for order in accepted])
+        ids = dict(db.session.query(SalesOrder.order_number, SalesOrder.id)
+                   .filter(SalesOrder.order_number.in_([order['number'] for order in accepted])))
+        SalesService.count_status({'Draft': len(accepted)})
+
+        db.session.bulk_insert_mappings(SalesOrderItem, [{
+            'sales_order_id': ids[order['number']],
+            'product_id': p_id,
+            'quantity': qty,
+            'price': products[p_id].price,
+            'subtotal': products[p_id].price * qty
+        } for order in accepted for p_id, qty in order['demand'].items()])
+
+        ReservationService.reserve_many([
+            ('SO', ids[order['number']], order['number'], order['demand'].items()) for order in accepted
+        ])
+        return len(accepted), sum(len(order['rows']) for order in accepted), errors
+
+    @staticmethod
+    def import_orders(rows, chunk_size=None, progress=None):
+        """
+        Imports streamed rows chunk by chunk (each chunk committed, retried on a locked database);
+        memory is bounded by the grouping window (iter_chunks), not by the file size.
+        chunk_size: orders per commit, clamped to 1..MAX_CHUNK_SIZE (None = CHUNK_SIZE).
+        progress: optional callback(report) after every chunk (CLI output).
+        Returns: report dict {orders, lines, imported_orders, imported_lines, chunks, errors}
+        """
+        chunk_size = max(1, min(chunk_size or SalesImportService.CHUNK_SIZE, SalesImportService.MAX_CHUNK_SIZE))
+        report = {
+            'orders': 0, 'lines': 0,
+            'imported_orders': 0, 'imported_lines': 0, 'chunks': 0, 'errors': []
+        }
+
+        for chunk in SalesImportService.iter_chunks(rows, chunk_size, report):
+            n_orders, n_lines, chunk_errors = StockService.run_with_retry(lambda: SalesImportService._import_chunk(chunk))
+            report['imported_orders'] += n_orders
+            report['imported_lines'] += n_lines
+            report['errors'] += chunk_errors
+            report['chunks'] += 1
+            if progress:
+                progress(report)
+
+        report['errors'].sort(key=lambda e: e['row'])
+        return report
+
+    @staticmethod
+    def import_file(filename, stream, chunk_size=None, progress=None):
+        return SalesImportService.import_orders(SalesImportService.iter_rows(filename, stream),
+                                                chunk_size=chunk_size, progress=progress)
+
+    @staticmethod
+    def write_error_report(errors, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=SalesImportService.REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(errors)
+        return path
+
+    @staticmethod
+    def save_error_report(errors, directory):
+        """Stores the per-row error report for download; returns the file name."""
+        os.makedirs(directory, exist_ok=True)
+        name = f"sales_import_{datetime.now().strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(4)}.csv"
+        SalesImportService.write_error_report(errors, os.path.join(directory, name))
+        return name
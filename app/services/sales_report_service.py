@@ -0,0 +1,198 @@
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db, Product, SalesOrder, SalesOrderItem, SalesReturn, SalesReturnItem, SalesDailyProduct, SalesDailyTotal
+
+class SalesReportService:
+    """
+    Sales report from daily rollups instead of joining every order line on each request.
+    sales_daily_products holds quantity / revenue / returns per order date, status and product,
+    sales_daily_totals the order count and grand totals per order date and status.
+    Rows are moved incrementally in the caller's transaction (order confirmed, paid, returned)
+    with INSERT ... SELECT ... ON CONFLICT DO UPDATE statements evaluated in the database,
+    so a transition of any size is one statement per table. rebuild() recomputes a date range.
+    """
+
+    REPORT_STATUSES = ('Confirmed', 'Paid')
+
+    @staticmethod
+    def _returned_amount():
+        """Approved refunds of the outer order (correlated, 0 if none)."""
+        return select(func.coalesce(func.sum(SalesReturn.total_refund), 0)).where(
+            SalesReturn.sales_order_id == SalesOrder.id,
+            SalesReturn.status == 'Approved'
+        ).scalar_subquery()
+
+    @staticmethod
+    def _returned_item(column):
+        """Approved returned quantity / amount of the outer order line (correlated, 0 if none)."""
+        return select(func.coalesce(func.sum(column), 0))\
+            .join(SalesReturn, SalesReturn.id == SalesReturnItem.sales_return_id)\
+            .where(SalesReturnItem.sales_order_item_id == SalesOrderItem.id, SalesReturn.status == 'Approved')\
+            .scalar_subquery()
+
+    @staticmethod
+    def _product_rows(status, sign=1):
+        """SELECT of (day, status, product_id, quantity, revenue, returned_*) per order date & product."""
+        return select(
+            SalesOrder.date,
+            status,
+            SalesOrderItem.product_id,
+            func.sum(SalesOrderItem.quantity) * sign,
+            func.sum(SalesOrderItem.subtotal) * sign,
+            func.sum(SalesReportService._returned_item(SalesReturnItem.quantity)) * sign,
+            func.sum(SalesReportService._returned_item(SalesReturnItem.subtotal)) * sign
+        ).join(SalesOrderItem, SalesOrderItem.sales_order_id == SalesOrder.id)\
+         .where(SalesOrder.date.isnot(None))\
+         .group_by(SalesOrder.date, SalesOrderItem.product_id)
+
+    @staticmethod
+    def _total_rows(status, sign=1):
+        """SELECT of (day, status, order_count, revenue, returned_amount) per order date."""
+        return select(
+            SalesOrder.date,
+            status,
+            func.count(SalesOrder.id) * sign,
+            func.sum(SalesOrder.grand_total) * sign,
+            func.sum(SalesReportService._returned_amount()) * sign
+        ).where(SalesOrder.date.isnot(None))\
+         .group_by(SalesOrder.date)
+
+    @staticmethod
+    def _upsert(model, columns, key, rows):
+        """INSERT ... SELECT rows, adding onto existing rollup rows (SQLite upsert)."""
+        table = model.__table__
+        stmt = sqlite_insert(table).from_select([table.c[name] for name in columns], rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[name] for name in key],
+            set_={name: table.c[name] + stmt.excluded[name] for name in columns if name not in key}
+        )
+        db.session.execute(stmt)
+
+    @staticmethod
+    def _apply(order_ids, status, sign):
+        # Orders are filtered by id only: the status label is the one being left / entered
+        order_ids = list(order_ids)
+        label = literal(status)
+        SalesReportService._upsert(
+            SalesDailyProduct,
+            ['day', 'status', 'product_id', 'quantity', 'revenue', 'returned_quantity', 'returned_amount'],
+            ['day', 'status', 'product_id'],
+            SalesReportService._product_rows(label, sign).where(SalesOrder.id.in_(order_ids))
+        )
+        SalesReportService._upsert(
+            SalesDailyTotal,
+            ['day', 'status', 'order_count', 'revenue', 'returned_amount'],
+            ['day', 'status'],
+            SalesReportService._total_rows(label, sign).where(SalesOrder.id.in_(order_ids))
+        )
+
+    @staticmethod
+    def move(order_ids, from_status, to_status):
+        """
+        Moves the orders' figures between statuses after a status change
+        (Draft -> Confirmed adds them, Confirmed -> Paid moves them). Statuses outside
+        REPORT_STATUSES are not rolled up. Caller commits.
+        """
+        if from_status in SalesReportService.REPORT_STATUSES:
+            SalesReportService._apply(order_ids, from_status, -1)
+        if to_status in SalesReportService.REPORT_STATUSES:
+            SalesReportService._apply(order_ids, to_status, 1)
+
+    @staticmethod
+    def record_return(return_id):
+        """
+        Adds an approved return to the order's day / status rows: refund on the daily total,
+        returned quantity / amount per product from its lines (no-op for unreported statuses).
+        """
+        reported = (SalesOrder.date.isnot(None), SalesOrder.status.in_(SalesReportService.REPORT_STATUSES))
+        SalesReportService._upsert(
+            SalesDailyProduct,
+            ['day', 'status', 'product_id', 'quantity', 'revenue', 'returned_quantity', 'returned_amount'],
+            ['day', 'status', 'product_id'],
+            select(SalesOrder.date, SalesOrder.status, SalesReturnItem.product_id, literal(0), literal(0.0),
+                   func.sum(SalesReturnItem.quantity), func.sum(SalesReturnItem.subtotal))
+            .join(SalesReturn, SalesReturn.sales_order_id == SalesOrder.id)
+            .join(SalesReturnItem, SalesReturnItem.sales_return_id == SalesReturn.id)
+            .where(SalesReturn.id == return_id, *reported)
+            .group_by(SalesOrder.date, SalesOrder.status, SalesReturnItem.product_id)
+        )
+        SalesReportService._upsert(
+            SalesDailyTotal,
+            ['day', 'status', 'order_count', 'revenue', 'returned_amount'],
+            ['day', 'status'],
+            select(SalesOrder.date, SalesOrder.status, literal(0), literal(0.0), SalesReturn.total_refund)
+            .join(SalesReturn, SalesReturn.sales_order_id == SalesOrder.id)
+            .where(SalesReturn.id == return_id, *reported)
+        )
+
+    @staticmethod
+    def rebuild(start_date=None, end_date=None):
+        """
+        Recomputes the rollups for order dates in [start_date, end_date] (all if None):
+        the range is deleted and refilled with two INSERT ... SELECT. For the backfill
+        and as a repair tool; normal operation is incremental. Caller commits.
+        Returns: (product rows, total rows) written
+        """
+        def in_range(query, column):
+            if start_date:
+                query = query.where(column >= start_date)
+            if end_date:
+                query = query.where(column <= end_date)
+            return query
+
+        for model in (SalesDailyProduct, SalesDailyTotal):
+            db.session.execute(in_range(model.__table__.delete(), model.__table__.c.day))
+
+        reported = SalesOrder.status.in_(SalesReportService.REPORT_STATUSES)
+        written = []
+        for model, rows, columns in (
+            (SalesDailyProduct, SalesReportService._product_rows(SalesOrder.status),
+             ['day', 'status', 'product_id', 'quantity', 'revenue', 'returned_quantity', 'returned_amount']),
+            (SalesDailyTotal, SalesReportService._total_rows(SalesOrder.status),
+             ['day', 'status', 'order_count', 'revenue', 'returned_amount'])
+        ):
+            rows = in_range(rows.where(reported), SalesOrder.date).group_by(SalesOrder.status)
+            table = model.__table__
+            result = db.session.execute(table.insert().from_select([table.c[name] for name in columns], rows))
+            written.append(result.rowcount)
+        return tuple(written)
+
+    @staticmethod
+    def summary(start_date=None, end_date=None, top=5):
+        """
+        Report figures for an order date range, read from the rollups only.
+        Returns: dict {total_sales, total_returns, net_sales, total_orders, avg_order_value, top_products}
+        """
+        def in_range(query, model):
+            query = query.filter(model.status.in_(SalesReportService.REPORT_STATUSES))
+            if start_date:
+                query = query.filter(model.day >= start_date)
+            if end_date:
+                query = query.filter(model.day <= end_date)
+            return query
+
+        totals = in_range(db.session.query(
+            func.coalesce(func.sum(SalesDailyTotal.order_count), 0),
+            func.coalesce(func.sum(SalesDailyTotal.revenue), 0),
+            func.coalesce(func.sum(SalesDailyTotal.returned_amount), 0)
+        ), SalesDailyTotal).one()
+        total_orders, total_sales, total_returns = int(totals[0]), float(totals[1]), float(totals[2])
+
+        sold = func.sum(SalesDailyProduct.quantity)
+        top_products = in_range(db.session.query(
+            Product.name,
+            sold.label('sold_count'),
+            func.sum(SalesDailyProduct.revenue).label('subtotal_sum'),
+            func.sum(SalesDailyProduct.returned_quantity).label('returned_count')
+        ).join(Product, Product.id == SalesDailyProduct.product_id), SalesDailyProduct)\
+         .group_by(SalesDailyProduct.product_id, Product.name)\
+         .having(sold > 0).order_by(sold.desc()).limit(top).all()
+
+        return {
+            'total_sales': total_sales,
+            'total_returns': total_returns,
+            'net_sales': total_sales - total_returns,
+            'total_orders': total_orders,
+            'avg_order_value': total_sales / total_orders if total_orders > 0 else 0,
+            'top_products': top_products
+        }
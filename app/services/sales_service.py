@@ -0,0 +1,451 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db, Product, SalesOrder, SalesOrderItem, SalesOrderStatusCount, SalesReturn, SalesReturnItem, Transaction
+from app.services.inventory_engine import SmartInventoryEngine
+from app.services.reservation_service import ReservationService
+from app.services.sales_report_service import SalesReportService
+from app.services.sequence_service import SequenceService
+from app.services.stock_service import StockConflictError, StockService
+from app.services.accounting_service import AccountingService
+
+class SalesService:
+
+    MAX_ERRORS = 20
+    PAGE_SIZE = 10
+    STATUSES = ('Draft', 'Confirmed', 'Paid', 'Cancelled')
+    RETURNABLE_STATUSES = ('Confirmed', 'Paid')
+
+    # --- Status counters (sales_order_status_counts) ---
+
+    @staticmethod
+    def count_status(changes):
+        """
+        Applies {status: delta} to the status counters with one upsert (count = count + delta
+        evaluated in the database). Part of the caller's transaction, like the status change itself.
+        """
+        changes = {status: delta for status, delta in changes.items() if delta}
+        if not changes:
+            return
+        table = SalesOrderStatusCount.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.status],
+            set_={'order_count': table.c.order_count + stmt.excluded.order_count}
+        )
+        db.session.execute(stmt, [{'status': status, 'order_count': delta} for status, delta in sorted(changes.items())])
+
+    @staticmethod
+    def transition(order_id, from_status, to_status, message=None):
+        """
+        Guarded status change (UPDATE ... WHERE status = from_status) and the matching counter
+        and report rollup moves, so a double submit neither changes the order twice nor counts it twice.
+        Raises ValueError(message) if the order is not in from_status. Caller commits.
+        """
+        claimed = SalesOrder.query.filter_by(id=order_id, status=from_status)\
+            .update({'status': to_status}, synchronize_session=False)
+        if not claimed:
+            raise ValueError(message or 'Order sudah diproses.')
+        SalesService.count_status({from_status: -1, to_status: 1})
+        SalesReportService.move([order_id], from_status, to_status)
+
+    @staticmethod
+    def status_counts():
+        """{status: number of orders} for every status, read from the counter table (no COUNT(*))."""
+        counts = dict.fromkeys(SalesService.STATUSES, 0)
+        counts.update(db.session.query(SalesOrderStatusCount.status, SalesOrderStatusCount.order_count))
+        return counts
+
+    @staticmethod
+    def rebuild_status_counts():
+        """
+        Recomputes the counters from sales_orders (one GROUP BY).
+        For the migration and as a repair tool; normal operation is incremental.
+        Returns: {status: count}
+        """
+        counts = dict(db.session.query(SalesOrder.status, func.count(SalesOrder.id)).group_by(SalesOrder.status))
+        SalesOrderStatusCount.query.delete(synchronize_session=False)
+        if counts:
+            db.session.bulk_insert_mappings(SalesOrderStatusCount, [
+                {'status': status, 'order_count': count} for status, count in counts.items() if status
+            ])
+        return counts
+
+    # --- Order list ---
+
+    @staticmethod
+    def page(filters, after_id=None, limit=None):
+        """
+        One page of the order list, newest first (created_at DESC, id DESC), after the cursor
+        (id of the last row of the previous page). Status and created_at range filters are served
+        by ix_sales_orders_status_created / ix_sales_orders_created, so deep pages cost the same
+        as the first one (no OFFSET, no COUNT).
+        filters: dict {status, start_date, end_date}
+        Returns: (orders, next_cursor)
+        """
+        limit = limit or SalesService.PAGE_SIZE
+        query = SalesOrder.query.options(joinedload(SalesOrder.customer_rel))
+        if filters.get('status'):
+            query = query.filter(SalesOrder.status == filters['status'])
+        if filters.get('start_date'):
+            query = query.filter(SalesOrder.created_at >= datetime.combine(filters['start_date'], datetime.min.time()))
+        if filters.get('end_date'):
+            query = query.filter(SalesOrder.created_at < datetime.combine(filters['end_date'] + timedelta(days=1), datetime.min.time()))
+        if after_id:
+            cursor_at = db.session.query(SalesOrder.created_at).filter(SalesOrder.id == after_id).scalar()
+            if cursor_at is not None:
+                query = query.filter(or_(
+                    SalesOrder.created_at < cursor_at,
+                    and_(SalesOrder.created_at == cursor_at, SalesOrder.id < after_id)
+                ))
+
+        rows = query.order_by(SalesOrder.created_at.desc(), SalesOrder.id.desc()).limit(limit + 1).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    # --- Orders ---
+
+    @staticmethod
+    def resolve_lines(lines):
+        """
+        Validates order lines up front: products loaded with one IN query (ids and SKUs together),
+        availability read for all of them with one more.
+        lines: list of dicts {product_id|sku, qty|quantity}; the same product on several lines is merged.
+        Rules: product known, qty > 0, product has a selling price, qty <= available to promise.
+        Raises ValueError listing every invalid line (nothing is written).
+        Returns: list of dicts {product_id, quantity, price, subtotal} in first-seen order
+        """
+        ids, skus = set(), set()
+        for line in lines:
+            if str(line.get('product_id') or '').strip().isdigit():
+                ids.add(int(line['product_id']))
+            elif line.get('sku'):
+                skus.add(str(line['sku']).strip())
+
+        products, by_sku = {}, {}
+        if ids or skus:
+            query = db.session.query(Product.id, Product.sku, Product.name, Product.price)
+            for row in query.filter(or_(Product.id.in_(ids), Product.sku.in_(skus))):
+                products[row.id] = row
+                by_sku[row.sku] = row
+
+        demand, errors = {}, []
+        for no, line in enumerate(lines, start=1):
+            raw_id = str(line.get('product_id') or '').strip()
+            product = products.get(int(raw_id)) if raw_id.isdigit() else by_sku.get(str(line.get('sku') or '').strip())
+            if product is None:
+                errors.append(f"baris {no}: produk '{raw_id or line.get('sku')}' tidak dikenal")
+                continue
+            try:
+                qty = int(line.get('qty') if line.get('qty') is not None else line.get('quantity'))
+            except (TypeError, ValueError):
+                qty = 0
+            if qty <= 0:
+                errors.append(f"baris {no}: qty harus > 0")
+                continue
+            if not product.price or product.price <= 0:
+                errors.append(f"baris {no}: harga jual {product.name} belum diatur")
+                continue
+            demand[product.id] = demand.get(product.id, 0) + qty
+
+        if demand:
+            # Due reservations no longer count against availability
+            ReservationService.expire(product_ids=demand.keys())
+            available = ReservationService.available(demand.keys())
+            errors += [f"Stok {products[p_id].name} tidak cukup! (Tersedia: {max(available[p_id], 0)}, diminta: {qty})"
+                       for p_id, qty in demand.items() if qty > available[p_id]]
+
+        if errors:
+            extra = len(errors) - SalesService.MAX_ERRORS
+            raise ValueError("; ".join(errors[:SalesService.MAX_ERRORS]) + (f" (+{extra} lainnya)" if extra > 0 else ''))
+        if not demand:
+            raise ValueError("Order tidak memiliki item.")
+
+        return [{
+            'product_id': p_id,
+            'quantity': qty,
+            'price': products[p_id].price, # Current selling price
+            'subtotal': products[p_id].price * qty
+        } for p_id, qty in demand.items()]
+
+    @staticmethod
+    def create_order(customer_id, order_date, lines, due_date=None, notes=None, order_number=None):
+        """
+        Creates a Draft sales order: lines validated in one pass, items written with one
+        executemany, total computed in the same pass and the stock reserved (ATP guard).
+        Caller commits (or rolls back on ValueError).
+        Returns: SalesOrder
+        """
+        resolved = SalesService.resolve_lines(lines)
+        total = sum(line['subtotal'] for line in resolved)
+
+        order = SalesOrder(
+            order_number=order_number or SequenceService.next_number('SO', on=order_date),
+            customer_id=customer_id,
+            date=order_date,
+            due_date=due_date,
+            status='Draft',
+            notes=notes,
+            total_amount=total,
+            grand_total=total # No tax/discount logic yet
+        )
+        db.session.add(order)
+        db.session.flush() # Get ID
+        SalesService.count_status({'Draft': 1})
+
+        db.session.bulk_insert_mappings(SalesOrderItem, [dict(line, sales_order_id=order.id) for line in resolved])
+
+        # Hold the stock for this draft (atomic guard; the check above only reports all short lines at once)
+        ReservationService.reserve('SO', order.id, [(line['product_id'], line['quantity']) for line in resolved],
+                                   reference=order.order_number)
+        return order
+
+    @staticmethod
+    def confirm_order(order_id):
+        """
+        Draft -> Confirmed: reservation consumed, stock deducted, batches allocated FIFO/FEFO
+        from the shipping (default) warehouse and COGS posted from the real layer costs.
+
+        Items + product costs are read with one joined query, OUT rows are bulk inserted,
+        the engine allocates all lines in one windowed pass (batches updated with one
+        executemany, BatchTransaction rows bulk inserted). Quantity without batch layers
+        (legacy stock) is costed at Product.cost.
+        Caller commits (StockService.run_with_retry). Raises ValueError if the order is
+        no longer Draft or stock is short.
+        Returns: dict {cogs, allocated, shortage, accounting_error}
+        """
+        # Claim the order (Draft -> Confirmed) atomically: a double submit cannot deduct twice
+        SalesService.transition(order_id, 'Draft', 'Confirmed')
+
+        order = db.session.get(SalesOrder, order_id)
+        items = db.session.query(
+            SalesOrderItem.product_id, SalesOrderItem.quantity, SalesOrderItem.subtotal, Product.cost
+        ).join(Product, Product.id == SalesOrderItem.product_id)\
+         .filter(SalesOrderItem.sales_order_id == order_id).order_by(SalesOrderItem.id).all()
+        lines = [(item.product_id, item.quantity) for item in items]
+
+        # 1. Reservation -> stock out (an expired hold is re-checked against ATP first),
+        #    master stock with one guarded executemany (no oversell)
+        ReservationService.consume('SO', order_id, lines, reference=order.order_number)
+        StockService.adjust_many([(p_id, -qty) for p_id, qty in lines])
+
+        # 2. Stock ledger: OUT rows in one executemany, ids read back in insert order
+        shipping_wh = SmartInventoryEngine.get_default_warehouse_id()
+        now = datetime.utcnow()
+        db.session.bulk_insert_mappings(Transaction, [{
+            'product_id': item.product_id,
+            'transaction_type': 'OUT',
+            'quantity': item.quantity,
+            'total_amount': item.subtotal,
+            'reference': order.order_number,
+            'customer_id': order.customer_id,
+            'warehouse_id': shipping_wh,
+            'created_at': now,
+            'fulfillment_status': 'pending' # Trigger Warehouse Picking
+        } for item in items])
+        trx_ids = [row.id for row in db.session.query(Transaction.id).filter(
+            Transaction.reference == order.order_number,
+            Transaction.transaction_type == 'OUT'
+        ).order_by(Transaction.id)]
+
+        # 3. FIFO/FEFO layers for all lines at once (+ BatchTransaction audit rows)
+        results = SmartInventoryEngine.allocate_fifo_many(lines, transaction_ids=trx_ids, warehouse_id=shipping_wh)
+        cogs = 0.0
+        for item, result in zip(items, results):
+            cogs += sum(a['quantity'] * a['cost'] for a in result['allocations']) + result['shortage'] * (item.cost or 0)
+
+        # 4. Accounting Journals (a failed journal does not block the stock movement)
+        accounting_error = None
+        try:
+            AccountingService.record_sale(
+                reference=order.order_number,
+                total_amount=order.grand_total,
+                cogs_amount=cogs
+            )
+        except Exception as e:
+            accounting_error = str(e)
+
+        return {
+            'cogs': cogs,
+            'allocated': sum(r['allocated'] for r in results),
+            'shortage': sum(r['shortage'] for r in results),
+            'accounting_error': accounting_error
+        }
+
+    @staticmethod
+    def cancel_order(order_id):
+        """Draft -> Cancelled, reservation released. Caller commits (StockService.run_with_retry)."""
+        SalesService.transition(order_id, 'Draft', 'Cancelled', 'Hanya order Draft yang bisa dibatalkan.')
+        ReservationService.release('SO', order_id)
+
+    @staticmethod
+    def mark_paid(order_id):
+        """Confirmed -> Paid. Caller commits."""
+        SalesService.transition(order_id, 'Confirmed', 'Paid', 'Hanya order Confirmed yang bisa ditandai lunas.')
+
+    # --- Returns ---
+
+    @staticmethod
+    def returnable_items(order_id):
+        """
+        Order lines with the quantity still returnable, one query
+        (already returned = SUM of sales_return_items per order line).
+        Returns: list of rows (id, product_id, name, sku, quantity, price, returned, returnable)
+        """
+        returned = db.session.query(
+            SalesReturnItem.sales_order_item_id.label('item_id'),
+            func.sum(SalesReturnItem.quantity).label('qty')
+        ).join(SalesOrderItem, SalesOrderItem.id == SalesReturnItem.sales_order_item_id)\
+         .filter(SalesOrderItem.sales_order_id == order_id)\
+         .group_by(SalesReturnItem.sales_order_item_id).subquery()
+        returned_qty = func.coalesce(returned.c.qty, 0)
+        return db.session.query(
+            SalesOrderItem.id,
+            SalesOrderItem.product_id,
+            Product.name,
+            Product.sku,
+            SalesOrderItem.quantity,
+            SalesOrderItem.price,
+            returned_qty.label('returned'),
+            (SalesOrderItem.quantity - returned_qty).label('returnable')
+        ).join(Product, Product.id == SalesOrderItem.product_id)\
+         .outerjoin(returned, returned.c.item_id == SalesOrderItem.id)\
+         .filter(SalesOrderItem.sales_order_id == order_id)\
+         .order_by(SalesOrderItem.id).all()
+
+    @staticmethod
+    def create_return(order_id, lines, reason=None, return_date=None):
+        """
+        Item-level sales return of a Confirmed / Paid order.
+        lines: list of dicts {sales_order_item_id, qty|quantity}; the same order line on several lines is merged.
+
+        Quantities are validated against the original order lines minus earlier returns (all
+        errors reported at once), return lines and IN movements are bulk inserted, stock goes back
+        into the batches it was shipped from (reverse lookup through BatchTransaction, one grouped
+        query) and the reversal is posted as one summarised journal (refund + cost of goods back).
+        Caller commits (StockService.run_with_retry). Raises ValueError (nothing is written).
+        Returns: dict {sales_return, refund, cost, restocked, unbatched, accounting_error}
+        """
+        order = db.session.get(SalesOrder, int(order_id)) if str(order_id or '').strip().isdigit() else None
+        if order is None:
+            raise ValueError("Sales Order tidak ditemukan.")
+        if order.status not in SalesService.RETURNABLE_STATUSES:
+            raise ValueError("Hanya order Confirmed / Paid yang bisa diretur.")
+
+        # 1. Validate every line against the order (one query)
+        items = {item.id: item for item in SalesService.returnable_items(order.id)}
+        wanted, errors = {}, []
+        for no, line in enumerate(lines, start=1):
+            raw_id = str(line.get('sales_order_item_id') or '').strip()
+            item = items.get(int(raw_id)) if raw_id.isdigit() else None
+            if item is None:
+                errors.append(f"baris {no}: item '{raw_id}' bukan bagian dari {order.order_number}")
+                continue
+            try:
+                qty = int(line.get('qty') if line.get('qty') is not None else line.get('quantity'))
+            except (TypeError, ValueError):
+                qty = -1
+            if qty == 0:
+                continue # Line not returned
+            if qty < 0:
+                errors.append(f"baris {no}: qty harus > 0")
+                continue
+            wanted[item.id] = wanted.get(item.id, 0) + qty
+        errors += [f"{items[i].name}: retur {qty} melebihi sisa {items[i].returnable} (dipesan {items[i].quantity})"
+                   for i, qty in wanted.items() if qty > items[i].returnable]
+        if errors:
+            extra = len(errors) - SalesService.MAX_ERRORS
+            raise ValueError("; ".join(errors[:SalesService.MAX_ERRORS]) + (f" (+{extra} lainnya)" if extra > 0 else ''))
+        if not wanted:
+            raise ValueError("Isi qty retur minimal satu item.")
+
+        returned_lines = [(items[i], qty) for i, qty in wanted.items()]
+        refund = sum(item.price * qty for item, qty in returned_lines)
+
+        # 2. Header
+        ret_number = SequenceService.next_number('RET', on=return_date)
+        earlier = [number for (number,) in db.session.query(SalesReturn.return_number)
+                   .filter(SalesReturn.sales_order_id == order.id)]
+        sales_return = SalesReturn(
+            return_number=ret_number,
+            sales_order_id=order.id,
+            date=return_date or datetime.utcnow().date(),
+            reason=reason,
+            total_refund=refund,
+            status='Approved' # Auto-approve for now
+        )
+        db.session.add(sales_return)
+        db.session.flush()
+
+        # 3. Stock back: master stock, IN movements (ids read back in insert order), original batches
+        StockService.adjust_many([(item.product_id, qty) for item, qty in returned_lines])
+        shipping_wh = SmartInventoryEngine.get_default_warehouse_id()
+        now = datetime.utcnow()
+        db.session.bulk_insert_mappings(Transaction, [{
+            'product_id': item.product_id,
+            'transaction_type': 'IN',
+            'quantity': qty,
+            'total_amount': item.price * qty,
+            'reference': ret_number,
+            'customer_id': order.customer_id,
+            'warehouse_id': shipping_wh,
+            'supplier': f"Retur {order.order_number}",
+            'created_at': now,
+            'fulfillment_status': 'completed'
+        } for item, qty in returned_lines])
+        trx_ids = [row.id for row in db.session.query(Transaction.id).filter(
+            Transaction.reference == ret_number,
+            Transaction.transaction_type == 'IN'
+        ).order_by(Transaction.id)]
+
+        results = SmartInventoryEngine.return_to_batches(
+            [(item.product_id, qty) for item, qty in returned_lines], order.order_number,
+            returned_references=earlier, transaction_ids=trx_ids, warehouse_id=shipping_wh)
+        product_cost = dict(db.session.query(Product.id, Product.cost)
+                            .filter(Product.id.in_({item.product_id for item, _ in returned_lines})))
+
+        # 4. Return lines, costed like the sale: batch layers + unbatched qty at Product.cost
+        rows = []
+        for (item, qty), result in zip(returned_lines, results):
+            cost = sum(a['quantity'] * a['cost'] for a in result['allocations']) \
+                + result['unbatched'] * (product_cost.get(item.product_id) or 0)
+            rows.append({
+                'sales_return_id': sales_return.id,
+                'sales_order_item_id': item.id,
+                'product_id': item.product_id,
+                'quantity': qty,
+                'price': item.price,
+                'subtotal': item.price * qty,
+                'cost_amount': cost
+            })
+        db.session.bulk_insert_mappings(SalesReturnItem, rows)
+
+        # Guard against a concurrent return of the same lines (re-read after our own insert);
+        # the retry re-validates against the committed returns
+        over = [item.name for item in SalesService.returnable_items(order.id) if item.returnable < 0]
+        if over:
+            raise StockConflictError(f"Qty retur {', '.join(over)} berubah saat diproses, silakan ulangi.")
+
+        # 5. Report rollup + one reversal journal (a failed journal does not block the return)
+        cost_total = sum(row['cost_amount'] for row in rows)
+        SalesReportService.record_return(sales_return.id)
+        accounting_error = None
+        try:
+            AccountingService.record_sales_return(
+                reference=ret_number,
+                refund_amount=refund,
+                cost_amount=cost_total,
+                description=f"Retur Penjualan {order.order_number}"
+            )
+        except Exception as e:
+            accounting_error = str(e)
+
+        return {
+            'sales_return': sales_return,
+            'refund': refund,
+            'cost': cost_total,
+            'restocked': sum(r['restocked'] for r in results),
+            'unbatched': sum(r['unbatched'] for r in results),
+            'accounting_error': accounting_error
+        }
@@ -0,0 +1,55 @@
+from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db, DocumentSequence
+
+class SequenceService:
+    """
+    Document numbers (SO-202410-0001, REQ-20241031-0001, ...) from a counter table.
+    One counter row per prefix and period; a number (or a block of numbers) is taken
+    with a single upsert that increments and returns the counter in the database,
+    so concurrent writers never get the same number and no document table is scanned.
+    The increment is part of the caller's transaction: a rolled back document
+    gives its number back.
+    """
+
+    # Period (counter scope) per prefix; anything else is numbered per month
+    PERIOD_FORMATS = {
+        'SO': '%Y%m', 'PO': '%Y%m', 'PR': '%Y%m', 'RET': '%Y%m',
+        'REQ': '%Y%m%d', 'OPN': '%Y%m%d', 'CC': '%Y%m%d', 'TF': '%Y%m%d', 'BATCH': '%Y%m%d', 'RCV': '%Y%m%d'
+    }
+    WIDTH = 4
+
+    @staticmethod
+    def period_of(prefix, on=None):
+        return (on or datetime.now()).strftime(SequenceService.PERIOD_FORMATS.get(prefix, '%Y%m'))
+
+    @staticmethod
+    def next_block(prefix, count=1, period=None):
+        """
+        Takes `count` consecutive numbers of one counter (bulk imports take one block).
+        Returns: first number of the block (the block is first .. first + count - 1)
+        """
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        period = period or SequenceService.period_of(prefix)
+        table = DocumentSequence.__table__
+        stmt = sqlite_insert(table).values(prefix=prefix, period=period, last_value=count)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.prefix, table.c.period],
+            set_={'last_value': table.c.last_value + stmt.excluded.last_value}
+        ).returning(table.c.last_value)
+        last = db.session.execute(stmt).scalar_one()
+        return last - count + 1
+
+    @staticmethod
+    def numbers(prefix, count, on=None, width=None):
+        """Formatted block: ['PREFIX-PERIOD-0001', ...] (count numbers, one upsert)."""
+        period = SequenceService.period_of(prefix, on)
+        first = SequenceService.next_block(prefix, count, period)
+        width = width or SequenceService.WIDTH
+        return [f"{prefix}-{period}-{n:0{width}d}" for n in range(first, first + count)]
+
+    @staticmethod
+    def next_number(prefix, on=None, width=None):
+        """Next formatted number, e.g. next_number('SO', on=order_date) -> 'SO-202410-0042'."""
+        return SequenceService.numbers(prefix, 1, on=on, width=width)[0]
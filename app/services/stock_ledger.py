@@ -0,0 +1,260 @@
+from datetime import datetime, date, timedelta
+from app.models import db, Transaction, StockSnapshot, STOCK_IN_TYPES, STOCK_OUT_TYPES, STOCK_MOVEMENT_TYPES
+from sqlalchemy import func, case, and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+class StockLedgerService:
+    """
+    Point-in-time stock from daily snapshots + replay of the transactions after them.
+    Snapshots are sparse: a (product, warehouse) row is written only for days with movement,
+    so the latest snapshot before a date is always the balance at the end of that day.
+    """
+
+    @staticmethod
+    def signed_quantity():
+        """
+        Signed stock effect of a transaction row (SQL expression).
+        OPNAME rows carry their direction in stock_delta; other types follow transaction_type.
+        """
+        return func.coalesce(Transaction.stock_delta, case(
+            (Transaction.transaction_type.in_(STOCK_IN_TYPES), Transaction.quantity),
+            (Transaction.transaction_type.in_(STOCK_OUT_TYPES), -Transaction.quantity),
+            else_=0
+        ))
+
+    @staticmethod
+    def _warehouse_key():
+        return func.coalesce(Transaction.warehouse_id, 0)
+
+    @staticmethod
+    def _day_start(day):
+        return datetime.combine(day, datetime.min.time())
+
+    @staticmethod
+    def _as_datetime(as_of):
+        # A plain date means "end of that day"
+        if isinstance(as_of, datetime):
+            return as_of
+        return StockLedgerService._day_start(as_of + timedelta(days=1))
+
+    @staticmethod
+    def take_snapshot(snapshot_date, chunk_size=500):
+        """
+        Writes closing balances for snapshot_date (only pairs that moved that day).
+        Days must be snapshotted in order; rerunning the same day is idempotent.
+        Returns: number of snapshot rows written
+        """
+        start = StockLedgerService._day_start(snapshot_date)
+        end = start + timedelta(days=1)
+        wh_key = StockLedgerService._warehouse_key()
+
+        # 1. Net movement of the day per (product, warehouse), one grouped query
+        changes = db.session.query(
+            Transaction.product_id,
+            wh_key.label('warehouse_id'),
+            func.sum(StockLedgerService.signed_quantity()).label('delta')
+        ).filter(
+            Transaction.transaction_type.in_(STOCK_MOVEMENT_TYPES),
+            Transaction.created_at >= start,
+            Transaction.created_at < end
+        ).group_by(Transaction.product_id, wh_key).all()
+
+        if not changes:
+            return 0
+
+        # 2. Previous closing balance = latest snapshot before this day (chunked IN lists)
+        previous = {}
+        product_ids = sorted({row.product_id for row in changes})
+        for i in range(0, len(product_ids), chunk_size):
+            chunk = product_ids[i:i + chunk_size]
+            latest = db.session.query(
+                StockSnapshot.product_id,
+                StockSnapshot.warehouse_id,
+                func.max(StockSnapshot.snapshot_date).label('snapshot_date')
+            ).filter(
+                StockSnapshot.product_id.in_(chunk),
+                StockSnapshot.snapshot_date < snapshot_date
+            ).group_by(StockSnapshot.product_id, StockSnapshot.warehouse_id).subquery()
+
+            rows = db.session.query(StockSnapshot.product_id, StockSnapshot.warehouse_id, StockSnapshot.quantity)\
+                .join(latest, and_(
+                    StockSnapshot.product_id == latest.c.product_id,
+                    StockSnapshot.warehouse_id == latest.c.warehouse_id,
+                    StockSnapshot.snapshot_date == latest.c.snapshot_date
+                ))
+            for row in rows:
+                previous[(row.product_id, row.warehouse_id)] = row.quantity or 0
+
+        # 3. Upsert closing balances
+        table = StockSnapshot.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id, table.c.warehouse_id, table.c.snapshot_date],
+            set_={'quantity': stmt.excluded.quantity, 'created_at': stmt.excluded.created_at}
+        )
+        now = datetime.utcnow()
+        db.session.execute(stmt, [{
+            'snapshot_date': snapshot_date,
+            'product_id': row.product_id,
+            'warehouse_id': row.warehouse_id,
+            'quantity': previous.get((row.product_id, row.warehouse_id), 0) + int(row.delta or 0),
+            'created_at': now
+        } for row in changes])
+
+        return len(changes)
+
+    @staticmethod
+    def build_snapshots(until=None, progress=None):
+        """
+        Catches snapshots up to `until` (default: yesterday), one day per commit.
+        Starts after the latest snapshot, or at the first transaction for an empty table.
+        Returns: (days processed, rows written)
+        """
+        until = until or (date.today() - timedelta(days=1))
+
+        last = db.session.query(func.max(StockSnapshot.snapshot_date)).scalar()
+        if last:
+            day = last + timedelta(days=1)
+        else:
+            first = db.session.query(func.min(Transaction.created_at))\
+                .filter(Transaction.transaction_type.in_(STOCK_MOVEMENT_TYPES)).scalar()
+            if not first:
+                return 0, 0
+            day = first.date()
+
+        days = rows = 0
+        while day <= until:
+            written = StockLedgerService.take_snapshot(day)
+            db.session.commit()
+            days += 1
+            rows += written
+            if progress:
+                progress(day, written)
+            day += timedelta(days=1)
+
+        return days, rows
+
+    @staticmethod
+    def stock_as_of(product_id, as_of, warehouse_id=None):
+        """
+        Stock of one product at a point in time (datetime, or date = end of that day).
+        Reads the latest snapshot per warehouse before that day and replays only the
+        transactions after it, so the cost does not grow with the history length.
+        Returns: {warehouse_id: quantity} (0 = not assigned to a warehouse)
+        """
+        as_of = StockLedgerService._as_datetime(as_of)
+        wh_key = StockLedgerService._warehouse_key()
+
+        latest = db.session.query(
+            StockSnapshot.warehouse_id,
+            func.max(StockSnapshot.snapshot_date).label('snapshot_date')
+        ).filter(
+            StockSnapshot.product_id == product_id,
+            StockSnapshot.snapshot_date < as_of.date()
+        )
+        if warehouse_id is not None:
+            latest = latest.filter(StockSnapshot.warehouse_id == warehouse_id)
+        latest = latest.group_by(StockSnapshot.warehouse_id).subquery()
+
+        balances = {}
+        replay_from = {}
+        for row in db.session.query(StockSnapshot.warehouse_id, StockSnapshot.snapshot_date, StockSnapshot.quantity)\
+                .filter(StockSnapshot.product_id == product_id)\
+                .join(latest, and_(
+                    StockSnapshot.warehouse_id == latest.c.warehouse_id,
+                    StockSnapshot.snapshot_date == latest.c.snapshot_date
+                )):
+            balances[row.warehouse_id] = row.quantity or 0
+            replay_from[row.warehouse_id] = StockLedgerService._day_start(row.snapshot_date + timedelta(days=1))
+
+        movements = db.session.query(wh_key.label('warehouse_id'), func.sum(StockLedgerService.signed_quantity()))\
+            .filter(
+                Transaction.product_id == product_id,
+                Transaction.transaction_type.in_(STOCK_MOVEMENT_TYPES),
+                Transaction.created_at < as_of
+            )
+        if replay_from:
+            # Replay window per warehouse: after its snapshot, or the full history without one
+            windows = [and_(wh_key == wh, Transaction.created_at >= start) for wh, start in replay_from.items()]
+            windows.append(wh_key.notin_(list(replay_from.keys())))
+            movements = movements.filter(or_(*windows))
+        if warehouse_id is not None:
+            movements = movements.filter(wh_key == warehouse_id)
+
+        for wh, delta in movements.group_by(wh_key):
+            balances[wh] = balances.get(wh, 0) + int(delta or 0)
+
+        return balances
+
+    @staticmethod
+    def get_stock_card(product_id, start, end, warehouse_id=None, after_id=None, after_balance=None, limit=None):
+        """
+        Stock card with running balance for [start, end), keyset-paginated on (created_at, id).
+        First page: opening balance from stock_as_of(start) and closing from one aggregate over
+        the range. Next pages carry the balance at the cursor (after_balance), so they only read
+        their own rows: the running balance inside a page is a window sum on top of it.
+        after_id: id of the last row of the previous page (None = first page)
+        after_balance: balance after that row (next_balance of the previous page); without it
+                       the balance is re-aggregated from start up to the cursor
+        limit: page size (None = the whole range)
+        Returns: dict opening, closing (first page only, else None), rows [{transaction, delta, balance}],
+                 next_cursor, next_balance
+        """
+        if not isinstance(start, datetime):
+            start = StockLedgerService._day_start(start)
+        end = StockLedgerService._as_datetime(end)
+
+        signed = StockLedgerService.signed_quantity()
+        in_range = [
+            Transaction.product_id == product_id,
+            Transaction.transaction_type.in_(STOCK_MOVEMENT_TYPES),
+            Transaction.created_at >= start,
+            Transaction.created_at < end
+        ]
+        if warehouse_id is not None:
+            in_range.append(StockLedgerService._warehouse_key() == warehouse_id)
+
+        opening = closing = None
+        if not after_id or after_balance is None:
+            opening = sum(StockLedgerService.stock_as_of(product_id, start, warehouse_id).values())
+        if not after_id:
+            total = db.session.query(func.sum(signed)).filter(*in_range).scalar()
+            closing = opening + int(total or 0)
+
+        page_opening = opening
+        page_filter = list(in_range)
+        if after_id:
+            cursor_at = db.session.query(Transaction.created_at).filter(Transaction.id == after_id).scalar()
+            if cursor_at is not None:
+                if after_balance is not None:
+                    page_opening = int(after_balance)
+                else:
+                    before = db.session.query(func.sum(signed)).filter(*in_range).filter(or_(
+                        Transaction.created_at < cursor_at,
+                        and_(Transaction.created_at == cursor_at, Transaction.id <= after_id)
+                    )).scalar()
+                    page_opening = opening + int(before or 0)
+                page_filter.append(or_(
+                    Transaction.created_at > cursor_at,
+                    and_(Transaction.created_at == cursor_at, Transaction.id > after_id)
+                ))
+            elif page_opening is None:
+                page_opening = int(after_balance)
+
+        running = func.sum(signed).over(order_by=(Transaction.created_at, Transaction.id))
+        query = db.session.query(Transaction, signed.label('delta'), running.label('running'))\
+            .filter(*page_filter)\
+            .order_by(Transaction.created_at.asc(), Transaction.id.asc())
+        if limit:
+            query = query.limit(limit + 1)
+
+        rows = [{'transaction': trx, 'delta': int(delta or 0), 'balance': page_opening + int(run or 0)}
+                for trx, delta, run in query]
+
+        next_cursor = next_balance = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor, next_balance = rows[-1]['transaction'].id, rows[-1]['balance']
+
+        return {'opening': opening, 'closing': closing, 'rows': rows,
+                'next_cursor': next_cursor, 'next_balance': next_balance}
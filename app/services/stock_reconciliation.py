@@ -0,0 +1,144 @@
+from datetime import datetime
+import uuid
+from app.models import db, Product, Batch, InventoryStock, StockDiscrepancy
+from app.services.inventory_engine import SmartInventoryEngine
+from sqlalchemy import func
+
+class StockReconciliationService:
+    """
+    Stock lives in three places: Product.stock_quantity, SUM(InventoryStock.quantity)
+    and SUM(Batch.current_quantity). This job compares them per product and records drift.
+    """
+
+    @staticmethod
+    def iter_product_chunks(chunk_size=1000, start_after=0):
+        """
+        Keyset pagination over products (WHERE id > last_id ORDER BY id LIMIT n),
+        so every chunk is an index range scan regardless of catalogue size.
+        Yields: list of (product_id, stock_quantity, cost)
+        """
+        last_id = start_after
+        while True:
+            rows = db.session.query(Product.id, Product.stock_quantity, Product.cost)\
+                .filter(Product.id > last_id)\
+                .order_by(Product.id.asc())\
+                .limit(chunk_size).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].id
+
+    @staticmethod
+    def compare_chunk(rows):
+        """
+        Three totals for one chunk of products: two grouped queries (warehouses, batches).
+        Returns: list of discrepancy dicts (only products whose totals differ)
+        """
+        ids = [row.id for row in rows]
+
+        warehouse_qty = dict(db.session.query(InventoryStock.product_id, func.sum(InventoryStock.quantity))
+                             .filter(InventoryStock.product_id.in_(ids))
+                             .group_by(InventoryStock.product_id).all())
+        batch_qty = dict(db.session.query(Batch.product_id, func.sum(Batch.current_quantity))
+                         .filter(Batch.product_id.in_(ids))
+                         .group_by(Batch.product_id).all())
+
+        drift = []
+        for row in rows:
+            product = row.stock_quantity or 0
+            warehouse = int(warehouse_qty.get(row.id) or 0)
+            batch = int(batch_qty.get(row.id) or 0)
+            if product != warehouse or product != batch:
+                drift.append({
+                    'product_id': row.id,
+                    'product_qty': product,
+                    'warehouse_qty': warehouse,
+                    'batch_qty': batch,
+                    'cost': row.cost or 0
+                })
+        return drift
+
+    @staticmethod
+    def repair_chunk(drift, warehouse_id=None):
+        """
+        Aligns warehouses and batches to Product.stock_quantity (the figure every flow updates).
+        - batches short: an opening batch at Product.cost (through the engine, valuation included)
+        - batches over: excess consumed FIFO
+        - warehouses: the remaining difference is posted to the default warehouse
+        """
+        if not drift:
+            return
+
+        inbound = []
+        outbound = []
+        for d in drift:
+            batch_diff = d['product_qty'] - d['batch_qty']
+            if batch_diff > 0:
+                inbound.append({'product_id': d['product_id'], 'quantity': batch_diff,
+                                'cost_price': d['cost'], 'warehouse_id': warehouse_id})
+            elif batch_diff < 0:
+                outbound.append((d['product_id'], -batch_diff))
+
+        if inbound:
+            SmartInventoryEngine.process_inbound_many(inbound, auto_commit=False)
+        if outbound:
+            SmartInventoryEngine.allocate_fifo_many(outbound)
+
+        # The engine moves warehouse stock together with the batches; re-read and fix what is left
+        ids = [d['product_id'] for d in drift]
+        warehouse_qty = dict(db.session.query(InventoryStock.product_id, func.sum(InventoryStock.quantity))
+                             .filter(InventoryStock.product_id.in_(ids))
+                             .group_by(InventoryStock.product_id).all())
+        stock_deltas = {}
+        for d in drift:
+            diff = d['product_qty'] - int(warehouse_qty.get(d['product_id']) or 0)
+            if diff:
+                stock_deltas[(d['product_id'], warehouse_id)] = diff
+        SmartInventoryEngine._apply_warehouse_stock(stock_deltas)
+
+    @staticmethod
+    def run(chunk_size=1000, repair=False, start_after=0, progress=None):
+        """
+        Scans all products chunk by chunk, writes stock_discrepancies and optionally repairs.
+        Each chunk is committed on its own, so the database is never locked for long.
+        Returns: summary dict (run_id, scanned, discrepancies, repaired)
+        """
+        run_id = f"REC-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
+        summary = {'run_id': run_id, 'scanned': 0, 'discrepancies': 0, 'repaired': 0}
+
+        warehouse_id = None
+        if repair:
+            warehouse_id = SmartInventoryEngine.get_default_warehouse_id()
+            if not warehouse_id:
+                raise ValueError("Belum ada gudang. Buat gudang utama sebelum auto-repair.")
+
+        for rows in StockReconciliationService.iter_product_chunks(chunk_size, start_after):
+            drift = StockReconciliationService.compare_chunk(rows)
+
+            if drift:
+                if repair:
+                    StockReconciliationService.repair_chunk(drift, warehouse_id)
+                now = datetime.utcnow()
+                db.session.bulk_insert_mappings(StockDiscrepancy, [{
+                    'run_id': run_id,
+                    'product_id': d['product_id'],
+                    'product_qty': d['product_qty'],
+                    'warehouse_qty': d['warehouse_qty'],
+                    'batch_qty': d['batch_qty'],
+                    'repaired': repair,
+                    'created_at': now
+                } for d in drift])
+
+            db.session.commit()
+
+            summary['scanned'] += len(rows)
+            summary['discrepancies'] += len(drift)
+            if repair:
+                summary['repaired'] += len(drift)
+            if progress:
+                progress(rows[-1].id, summary)
+
+            # Release the identity map between chunks (large catalogues)
+            db.session.expunge_all()
+
+        return summary
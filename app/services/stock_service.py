@@ -0,0 +1,121 @@
+import random
+import time
+from app.models import db, Product
+from sqlalchemy import bindparam
+from sqlalchemy.exc import OperationalError
+
+class StockConflictError(ValueError):
+    """Product stock was changed by another writer since it was read (version mismatch)."""
+
+class StockService:
+    """
+    Single entry point for mutating Product.stock_quantity.
+    Every change is one conditional UPDATE evaluated by the database
+    (SET stock = stock - :n WHERE stock >= :n), never read-modify-write in Python,
+    so concurrent writers cannot oversell or lose updates.
+    """
+
+    MAX_RETRIES = 5
+
+    @staticmethod
+    def adjust_many(lines, allow_negative=False):
+        """
+        Atomic stock deltas for many products.
+        lines: list of tuples (product_id, delta); negative delta = stock out
+        One executemany UPDATE in id order (consistent lock order between writers).
+        Raises ValueError if a product does not have enough stock (caller rolls back).
+        """
+        deltas = {}
+        for p_id, delta in lines:
+            deltas[int(p_id)] = deltas.get(int(p_id), 0) + int(delta)
+        deltas = {p_id: delta for p_id, delta in sorted(deltas.items()) if delta}
+        if not deltas:
+            return
+
+        # One guarded executemany; rowcount is the total of matched rows
+        products = Product.__table__
+        stmt = products.update().where(products.c.id == bindparam('p_id'))
+        if not allow_negative:
+            stmt = stmt.where(products.c.stock_quantity + bindparam('p_delta') >= 0)
+        result = db.session.execute(
+            stmt.values(stock_quantity=products.c.stock_quantity + bindparam('p_delta'), version=products.c.version + 1),
+            [{'p_id': p_id, 'p_delta': delta} for p_id, delta in deltas.items()]
+        )
+
+        if result.rowcount not in (-1, None) and result.rowcount != len(deltas):
+            current = {row.id: row for row in db.session.query(Product.id, Product.name, Product.stock_quantity)
+                       .filter(Product.id.in_(deltas.keys()))}
+            missing = [p_id for p_id in deltas if p_id not in current]
+            if missing:
+                raise ValueError(f"Product not found: {', '.join(str(p) for p in missing)}")
+            # Rows that were not updated still hold stock + delta < 0
+            short = [current[p_id] for p_id, delta in deltas.items() if (current[p_id].stock_quantity or 0) + delta < 0]
+            name, left = (short[0].name, short[0].stock_quantity) if short else ('?', '?')
+            raise ValueError(f"Stok {name} tidak cukup! (Sisa: {left})")
+
+        StockService._expire(deltas.keys())
+
+    @staticmethod
+    def adjust(product_id, delta, allow_negative=False):
+        StockService.adjust_many([(product_id, delta)], allow_negative=allow_negative)
+
+    @staticmethod
+    def set_quantity(product_id, quantity, expected_version):
+        """
+        Absolute stock (e.g. opname count), guarded by an optimistic version check.
+        Raises StockConflictError if the product changed since expected_version was read.
+        """
+        StockService.set_quantities([(product_id, quantity, expected_version)])
+
+    @staticmethod
+    def set_quantities(rows):
+        """
+        Absolute stock for many products (bulk opname) in one executemany.
+        rows: list of tuples (product_id, quantity, expected_version)
+        Raises StockConflictError if any product changed since its version was read.
+        """
+        rows = sorted((int(p_id), int(qty), int(version or 0)) for p_id, qty, version in rows)
+        if not rows:
+            return
+
+        products = Product.__table__
+        result = db.session.execute(
+            products.update()
+            .where(products.c.id == bindparam('p_id'), products.c.version == bindparam('p_version'))
+            .values(stock_quantity=bindparam('p_qty'), version=products.c.version + 1),
+            [{'p_id': p_id, 'p_qty': qty, 'p_version': version} for p_id, qty, version in rows]
+        )
+        if result.rowcount not in (-1, None) and result.rowcount != len(rows):
+            label = rows[0][0] if len(rows) == 1 else f"{len(rows) - result.rowcount} dari {len(rows)}"
+            raise StockConflictError(f"Stok produk {label} berubah saat diproses, silakan ulangi.")
+
+        StockService._expire([p_id for p_id, _, _ in rows])
+
+    @staticmethod
+    def run_with_retry(work, retries=None):
+        """
+        Runs work() and commits; on a version conflict or a locked database the
+        transaction is rolled back and work() runs again (with jittered backoff).
+        Returns: the result of work()
+        """
+        retries = retries or StockService.MAX_RETRIES
+        for attempt in range(retries):
+            try:
+                result = work()
+                db.session.commit()
+                return result
+            except (StockConflictError, OperationalError) as e:
+                db.session.rollback()
+                if isinstance(e, OperationalError) and 'locked' not in str(e):
+                    raise
+                if attempt == retries - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.02 * (2 ** attempt))) # Jitter: writers do not retry in lockstep
+
+    @staticmethod
+    def _expire(product_ids):
+        # Loaded Product objects must re-read stock/version after a Core UPDATE
+        for p_id in product_ids:
+            product = db.session.identity_map.get(db.session.identity_key(Product, p_id))
+            if product is not None:
+                db.session.expire(product, ['stock_quantity', 'version'])
@@ -0,0 +1,130 @@
+import csv
+import io
+import json
+from datetime import datetime
+from app.models import db, Product, Warehouse, Transaction, TransferDocument, TransferLine
+from app.services.inventory_engine import SmartInventoryEngine
+from app.services.sequence_service import SequenceService
+
+class TransferService:
+
+    @staticmethod
+    def parse_upload(filename, content):
+        """
+        Transfer lines from an uploaded file.
+        CSV : header with product_id or sku, and quantity (qty)
+        JSON: list of {product_id|sku, quantity} or {"lines": [...]}
+        Returns: list of dicts {product_id|sku, quantity}
+        """
+        if isinstance(content, bytes):
+            content = content.decode('utf-8-sig')
+
+        if (filename or '').lower().endswith('.json'):
+            data = json.loads(content)
+            return data.get('lines', []) if isinstance(data, dict) else data
+
+        reader = csv.DictReader(io.StringIO(content))
+        lines = []
+        for row in reader:
+            row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+            lines.append({
+                'product_id': row.get('product_id') or None,
+                'sku': row.get('sku') or None,
+                'quantity': row.get('quantity') or row.get('qty') or 0
+            })
+        return lines
+
+    @staticmethod
+    def resolve_lines(lines):
+        """
+        Normalises lines to {product_id: quantity}; SKUs are resolved with one IN query.
+        Raises ValueError listing unknown products / invalid quantities.
+        """
+        skus = {str(line['sku']) for line in lines if line.get('sku') and not line.get('product_id')}
+        sku_map = dict(db.session.query(Product.sku, Product.id).filter(Product.sku.in_(skus)).all()) if skus else {}
+
+        demand = {}
+        errors = []
+        for no, line in enumerate(lines, start=1):
+            try:
+                qty = int(line.get('quantity') or 0)
+            except (TypeError, ValueError):
+                qty = 0
+            p_id = line.get('product_id') or sku_map.get(str(line.get('sku')))
+            if not p_id:
+                errors.append(f"baris {no}: produk '{line.get('sku')}' tidak dikenal")
+                continue
+            if qty <= 0:
+                errors.append(f"baris {no}: qty harus > 0")
+                continue
+            demand[int(p_id)] = demand.get(int(p_id), 0) + qty
+
+        if demand:
+            found = {row.id for row in db.session.query(Product.id).filter(Product.id.in_(demand.keys()))}
+            errors += [f"produk id {p_id} tidak dikenal" for p_id in demand if p_id not in found]
+
+        if errors:
+            raise ValueError("; ".join(errors[:20]) + (f" (+{len(errors) - 20} lainnya)" if len(errors) > 20 else ''))
+        if not demand:
+            raise ValueError("Tidak ada baris transfer.")
+        return demand
+
+    @staticmethod
+    def create_transfer(lines, source_warehouse_id, destination_warehouse_id, reference=None, notes=None, user_id=None):
+        """
+        Posts a multi-line transfer document atomically.
+        Source stock is validated with one grouped query (engine), stock and FIFO layers move
+        in bulk, and document lines + OUT/IN movement rows are written with executemany.
+        Caller commits (or rolls back on ValueError).
+        Returns: TransferDocument
+        """
+        source_warehouse_id = int(source_warehouse_id)
+        destination_warehouse_id = int(destination_warehouse_id)
+        warehouses = {w.id: w for w in Warehouse.query.filter(Warehouse.id.in_([source_warehouse_id, destination_warehouse_id]))}
+        if source_warehouse_id not in warehouses or destination_warehouse_id not in warehouses:
+            raise ValueError("Gudang tidak ditemukan.")
+
+        reference = reference or SequenceService.next_number('TF')
+        if TransferDocument.query.filter_by(reference=reference).first():
+            raise ValueError(f"Referensi {reference} sudah dipakai.")
+
+        demand = TransferService.resolve_lines(lines)
+
+        # 1. Validate + move warehouse stock and FIFO layers (raises ValueError if short)
+        SmartInventoryEngine.transfer_stock(list(demand.items()), source_warehouse_id, destination_warehouse_id)
+
+        # 2. Document header + lines
+        doc = TransferDocument(
+            reference=reference,
+            source_warehouse_id=source_warehouse_id,
+            destination_warehouse_id=destination_warehouse_id,
+            notes=notes,
+            line_count=len(demand),
+            total_quantity=sum(demand.values()),
+            created_by=user_id
+        )
+        db.session.add(doc)
+        db.session.flush()
+
+        db.session.bulk_insert_mappings(TransferLine, [
+            {'transfer_id': doc.id, 'product_id': p_id, 'quantity': qty} for p_id, qty in demand.items()
+        ])
+
+        # 3. Movement rows (OUT from source, IN to destination)
+        src, dst = warehouses[source_warehouse_id], warehouses[destination_warehouse_id]
+        now = datetime.utcnow()
+        rows = []
+        for p_id, qty in demand.items():
+            rows.append({
+                'product_id': p_id, 'transaction_type': 'OUT', 'quantity': qty, 'total_amount': 0,
+                'reference': reference, 'warehouse_id': src.id, 'created_at': now, 'fulfillment_status': 'completed',
+                'branch_name': f"Transfer to {dst.name}", 'supplier': f"From {src.name}"
+            })
+            rows.append({
+                'product_id': p_id, 'transaction_type': 'IN', 'quantity': qty, 'total_amount': 0,
+                'reference': reference, 'warehouse_id': dst.id, 'created_at': now, 'fulfillment_status': 'completed',
+                'branch_name': f"Transfer from {src.name}", 'supplier': f"To {dst.name}"
+            })
+        db.session.bulk_insert_mappings(Transaction, rows)
+
+        return doc
@@ -0,0 +1,246 @@
+import json
+import os
+import random
+import secrets
+from datetime import datetime, timedelta
+from flask import g, has_app_context
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface, session_json_serializer
+from itsdangerous import Signer, BadSignature
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.datastructures import CallbackDict
+
+# Session server-side: cookie hanya membawa session id (bertanda tangan),
+# isi session disimpan di backend (tabel server_sessions atau folder file) dengan TTL.
+# Pilih lewat Config.SESSION_BACKEND: 'sqlite' (default), 'filesystem', atau 'cookie' (perilaku lama).
+
+class ServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None, stored=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.stored = stored # Serialized data as loaded (unchanged content is not written back)
+        self.owner = (initial or {}).get('user_id')
+        self.modified = False
+
+
+class SqliteSessionBackend:
+    """
+    Sessions in the server_sessions table.
+    Reads run on the request's own db.session connection. Writes are queued and run at
+    request teardown, after the request transaction has ended and its connection is back
+    in the pool, so a request never holds two connections or two write transactions at once.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def table(self):
+        from app.models import ServerSession
+        return ServerSession.__table__
+
+    def init_app(self, app):
+        app.teardown_request(self.flush)
+
+    def load(self, sid):
+        row = self.db.session.execute(
+            select(self.table.c.data, self.table.c.expires_at).where(self.table.c.sid == sid)).first()
+        if not row or row.expires_at <= datetime.utcnow():
+            return None
+        return row.data, row.expires_at
+
+    def _queue(self, stmt):
+        if has_app_context():
+            g.setdefault('_session_writes', []).append(stmt)
+        else:
+            with self.db.engine.begin() as conn: # Scripts / no request
+                conn.execute(stmt)
+
+    def save(self, sid, data, expires_at):
+        stmt = sqlite_insert(self.table).values(sid=sid, data=data, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(index_elements=[self.table.c.sid],
+                                          set_={'data': stmt.excluded.data, 'expires_at': stmt.excluded.expires_at})
+        self._queue(stmt)
+
+    def delete(self, sid):
+        self._queue(delete(self.table).where(self.table.c.sid == sid))
+
+    def evict_expired(self):
+        with self.db.engine.begin() as conn:
+            return conn.execute(delete(self.table).where(self.table.c.expires_at <= datetime.utcnow())).rowcount
+
+    def evict_expired_later(self):
+        self._queue(delete(self.table).where(self.table.c.expires_at <= datetime.utcnow()))
+
+    def flush(self, exc=None):
+        """
+        Request teardown: end the request transaction (uncommitted work is discarded, as the
+        app-context teardown would do) so its connection is released, then one short write transaction.
+        """
+        writes = g.pop('_session_writes', None)
+        if not writes:
+            return
+        self.db.session.rollback()
+        with self.db.engine.begin() as conn:
+            for stmt in writes:
+                conn.execute(stmt)
+
+
+class FilesystemSessionBackend:
+    """One JSON file per session in a directory (e.g. a shared volume)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, f"{sid}.json")
+
+    def load(self, sid):
+        try:
+            with open(self._path(sid)) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        expires_at = datetime.fromisoformat(stored['expires_at'])
+        if expires_at <= datetime.utcnow():
+            return None
+        return stored['data'], expires_at
+
+    def save(self, sid, data, expires_at):
+        tmp = f"{self._path(sid)}.{secrets.token_hex(4)}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'data': data, 'expires_at': expires_at.isoformat()}, f)
+        os.replace(tmp, self._path(sid)) # Atomic: readers never see a half-written file
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def evict_expired(self):
+        now = datetime.utcnow()
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    expired = datetime.fromisoformat(json.load(f)['expires_at']) <= now
+            except (OSError, ValueError, KeyError):
+                expired = name.endswith('.tmp')
+            if expired:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface on top of a backend (load/save/delete/evict_expired).
+    Sessions are written only when modified or when less than half of the TTL is left
+    (sliding expiry), and expired sessions are evicted on a small share of the writes.
+    """
+
+    serializer = session_json_serializer
+    salt = 'server-side-session'
+    EVICT_PROBABILITY = 0.01
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None # Old cookie-session or tampered value: start a fresh session
+            stored = self.backend.load(sid) if sid else None
+            if stored:
+                data, expires_at = stored
+                try:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid, expires_at=expires_at, stored=data)
+                except ValueError:
+                    pass
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and not session.new:
+                # Logout / session.clear(): drop the stored session and the cookie
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = datetime.utcnow()
+        needs_refresh = session.expires_at is None or session.expires_at - now < self.ttl / 2
+        if not (session.modified or needs_refresh):
+            return
+
+        data = self.serializer.dumps(dict(session))
+        user_switched = not session.new and session.get('user_id') != session.owner
+        if data == session.stored and not needs_refresh and not user_switched:
+            return # Touched but unchanged (e.g. a flash added and shown in the same request)
+
+        if user_switched:
+            # Login / user switch: new session id so a planted id cannot be reused (session fixation)
+            self.backend.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+
+        expires_at = now + self.ttl
+        self.backend.save(session.sid, data, expires_at)
+        if random.random() < self.EVICT_PROBABILITY:
+            getattr(self.backend, 'evict_expired_later', self.backend.evict_expired)()
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+
+def make_session_backend(app, db):
+    backend = app.config.get('SESSION_BACKEND', 'sqlite')
+    if backend == 'filesystem':
+        return FilesystemSessionBackend(app.config.get('SESSION_FILE_DIR') or os.path.join(app.instance_path, 'sessions'))
+    if backend == 'sqlite':
+        return SqliteSessionBackend(db)
+    return None
+
+
+def init_session_store(app, db):
+    """Installs the configured session backend ('cookie' keeps Flask's signed cookie sessions)."""
+    backend = make_session_backend(app, db)
+    if backend is None:
+        app.session_interface = SecureCookieSessionInterface()
+        return
+    if hasattr(backend, 'init_app'):
+        backend.init_app(app)
+    app.session_interface = ServerSideSessionInterface(backend, app.config.get('SESSION_TTL', timedelta(hours=12)))
@@ -0,0 +1,150 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.models import Transaction
+
+# Benchmark Index Pack tabel transactions.
+# Membuat ledger sintetis (default 5 juta baris) di file SQLite sementara, lalu menjalankan query
+# yang sama dengan layar dashboard/analytics/laporan/stock card/tracking/receipt/transfer/picking
+# sebelum dan sesudah index dibangun. Output: query plan + latency median.
+#
+#   python bench_transaction_indexes.py                 # 5.000.000 baris
+#   python bench_transaction_indexes.py --rows 500000   # lebih cepat untuk uji lokal
+
+TYPES = ['OUT'] * 12 + ['IN'] * 6 + ['TRANSFER_IN', 'TRANSFER_OUT', 'OPNAME']
+STATUSES = ['completed'] * 17 + ['pending', 'picked', 'packed']
+
+
+def generate_rows(n_rows, n_products, days):
+    now = datetime.utcnow()
+    span = days * 86400
+    rnd = random.Random(42)
+    for i in range(n_rows):
+        t_type = rnd.choice(TYPES)
+        created = now - timedelta(seconds=rnd.randint(0, span))
+        if t_type == 'IN':
+            ref = f"SJ-{rnd.randint(1, n_rows // 20 + 1)}"
+        elif t_type in ('TRANSFER_IN', 'TRANSFER_OUT'):
+            ref = f"REQ-{created.strftime('%Y%m%d')}-{rnd.randint(1000, 9999)}"
+        elif rnd.random() < 0.02:
+            # Transfer antar gudang dicatat sebagai OUT/IN dengan referensi TF-
+            ref = f"TF-{created.strftime('%Y%m%d%H%M')}"
+        else:
+            ref = f"SO-{created.strftime('%Y%m')}-{i:07d}"
+        yield (
+            rnd.randint(1, n_products),
+            t_type,
+            rnd.randint(1, 20),
+            rnd.randint(1, 500) * 1000.0,
+            created.strftime('%Y-%m-%d %H:%M:%S.%f'),
+            ref,
+            rnd.choice(STATUSES) if t_type == 'OUT' else 'completed',
+        )
+
+
+def build_queries(n_products):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    fmt = lambda d: d.strftime('%Y-%m-%d %H:%M:%S.%f')
+    product_id = n_products // 2
+    return [
+        ('dashboard (OUT hari ini)',
+         "SELECT SUM(total_amount) FROM transactions WHERE transaction_type = ? AND created_at >= ?",
+         ('OUT', fmt(today))),
+        ('analytics (OUT 30 hari)',
+         "SELECT created_at, total_amount, quantity, product_id FROM transactions WHERE transaction_type = ? AND created_at >= ?",
+         ('OUT', fmt(today - timedelta(days=30)))),
+        ('laporan-rekap (OUT 1 bulan)',
+         "SELECT product_id, SUM(quantity), SUM(total_amount) FROM transactions WHERE transaction_type = ? AND created_at BETWEEN ? AND ? GROUP BY product_id",
+         ('OUT', fmt(today - timedelta(days=60)), fmt(today - timedelta(days=30)))),
+        ('stock card (100 terakhir)',
+         "SELECT * FROM transactions WHERE product_id = ? ORDER BY created_at DESC LIMIT 100",
+         (product_id,)),
+        ('tracking (riwayat produk)',
+         "SELECT * FROM transactions WHERE product_id = ? ORDER BY created_at DESC",
+         (product_id,)),
+        ('receipt by ref',
+         "SELECT * FROM transactions WHERE reference = ? AND transaction_type = ? ORDER BY id DESC LIMIT 50",
+         ('SJ-77', 'IN')),
+        ('riwayat transfer TF-%',
+         "SELECT * FROM transactions WHERE reference >= ? AND reference < ? ORDER BY created_at DESC LIMIT 20",
+         ('TF-', 'TF.')),
+        ('picking list',
+         "SELECT * FROM transactions WHERE transaction_type = ? AND fulfillment_status = ? ORDER BY created_at ASC",
+         ('OUT', 'pending')),
+    ]
+
+
+def run_suite(conn, queries, repeat):
+    results = {}
+    for label, sql, params in queries:
+        plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[label] = (plan, statistics.median(timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark index pack tabel transactions')
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--products', type=int, default=20_000)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='bench_trx_'), 'bench.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    dialect = sqlite_dialect.dialect()
+    conn.execute(str(CreateTable(Transaction.__table__).compile(dialect=dialect)))
+
+    print(f"Generate {args.rows:,} baris transaksi di {db_path} ...")
+    start = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO transactions (product_id, transaction_type, quantity, total_amount, created_at, reference, fulfillment_status) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        generate_rows(args.rows, args.products, args.days)
+    )
+    conn.commit()
+    print(f"Selesai dalam {time.perf_counter() - start:.1f} detik.\n")
+
+    queries = build_queries(args.products)
+    before = run_suite(conn, queries, args.repeat)
+
+    start = time.perf_counter()
+    for index in sorted(Transaction.__table__.indexes, key=lambda i: i.name):
+        conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+    conn.execute("ANALYZE transactions")
+    conn.commit()
+    print(f"Index pack dibangun dalam {time.perf_counter() - start:.1f} detik.\n")
+
+    after = run_suite(conn, queries, args.repeat)
+
+    for label, _, _ in queries:
+        plan_b, ms_b = before[label]
+        plan_a, ms_a = after[label]
+        speedup = ms_b / ms_a if ms_a > 0 else float('inf')
+        print(f"== {label}")
+        print(f"   sebelum: {ms_b:10.2f} ms | {' ; '.join(plan_b)}")
+        print(f"   sesudah: {ms_a:10.2f} ms | {' ; '.join(plan_a)}")
+        print(f"   speedup: {speedup:.1f}x\n")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import argparse
+from datetime import datetime
+from app import create_app, db
+from app.services.sales_report_service import SalesReportService
+
+app = create_app()
+
+# Rollup harian Laporan Penjualan (sales_daily_products, sales_daily_totals).
+# Rollup diperbarui otomatis saat order Confirmed / Paid / diretur; script ini untuk
+# backfill data lama (sekali setelah upgrade) atau memperbaiki rentang tanggal tertentu.
+#   python build_sales_report.py                                  -> semua tanggal
+#   python build_sales_report.py --from 2024-01-01 --to 2024-12-31
+
+def main():
+    parser = argparse.ArgumentParser(description='Bangun ulang rollup laporan penjualan')
+    parser.add_argument('--from', dest='start', help='Tanggal order awal (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='end', help='Tanggal order akhir (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, '%Y-%m-%d').date() if args.start else None
+    end = datetime.strptime(args.end, '%Y-%m-%d').date() if args.end else None
+
+    with app.app_context():
+        db.create_all()
+
+        products, totals = SalesReportService.rebuild(start, end)
+        db.session.commit()
+        print(f"Selesai: {products:,} baris produk harian, {totals:,} baris total harian ditulis.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import argparse
+from datetime import datetime
+from app import create_app, db
+from app.services.stock_ledger import StockLedgerService
+
+app = create_app()
+
+# Snapshot stok harian per produk/gudang (stock_snapshots).
+# Dijadwalkan harian (cron) setelah tengah malam; melanjutkan dari snapshot terakhir.
+#   python build_stock_snapshots.py                   -> s/d kemarin
+#   python build_stock_snapshots.py --until 2024-12-31
+
+def main():
+    parser = argparse.ArgumentParser(description='Bangun snapshot stok harian')
+    parser.add_argument('--until', help='Tanggal terakhir (YYYY-MM-DD), default kemarin')
+    args = parser.parse_args()
+
+    until = datetime.strptime(args.until, '%Y-%m-%d').date() if args.until else None
+
+    with app.app_context():
+        db.create_all()
+
+        def progress(day, written):
+            if written:
+                print(f"  {day}: {written:,} baris")
+
+        days, rows = StockLedgerService.build_snapshots(until=until, progress=progress)
+        print(f"Selesai: {days:,} hari diproses, {rows:,} baris snapshot ditulis.")
+
+if __name__ == '__main__':
+    main()
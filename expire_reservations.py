@@ -0,0 +1,31 @@
+import argparse
+from app import create_app, db
+from app.services.reservation_service import ReservationService
+
+app = create_app()
+
+# Lepas reservasi stok yang sudah lewat TTL (Config.RESERVATION_TTL).
+# Reservasi yang kedaluwarsa juga dilepas otomatis saat produk yang sama dipesan;
+# script ini untuk cron (mis. tiap jam) agar ATP di form penjualan tetap akurat.
+#   python expire_reservations.py
+#   python expire_reservations.py --rebuild   -> hitung ulang cache products.reserved_quantity
+
+def main():
+    parser = argparse.ArgumentParser(description='Lepas reservasi stok kedaluwarsa')
+    parser.add_argument('--rebuild', action='store_true', help='Hitung ulang cache reserved_quantity dari ledger')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+
+        expired = ReservationService.expire()
+        db.session.commit()
+        print(f"{expired:,} reservasi kedaluwarsa dilepas.")
+
+        if args.rebuild:
+            updated = ReservationService.rebuild_cache()
+            db.session.commit()
+            print(f"Cache reserved_quantity dihitung ulang untuk {updated:,} produk.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import time
+from app import create_app, db
+from app.services.sales_import_service import SalesImportService
+
+app = create_app()
+
+# Import massal Sales Order (Draft) dari file CSV / JSON lines (marketplace, B2B).
+#   python import_sales_orders.py orders.csv
+#   python import_sales_orders.py orders.jsonl --chunk-size 2000 --errors errors.csv
+
+def main():
+    parser = argparse.ArgumentParser(description='Import Sales Order dari file CSV / JSON lines')
+    parser.add_argument('file', help='File order (.csv, .json, .jsonl)')
+    parser.add_argument('--chunk-size', type=int, default=SalesImportService.CHUNK_SIZE, help=f'Order per commit (maks. {SalesImportService.MAX_CHUNK_SIZE})')
+    parser.add_argument('--errors', default='sales_import_errors.csv', help='Path laporan error per baris')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+
+    def progress(report):
+        elapsed = time.monotonic() - started
+        print(f"  chunk {report['chunks']}: {report['imported_orders']:,} order, "
+              f"{report['imported_lines']:,} baris ({report['imported_lines'] / max(elapsed, 0.001):,.0f} baris/detik)")
+
+    with app.app_context():
+        db.create_all()
+        with open(args.file, 'rb') as stream:
+            report = SalesImportService.import_file(args.file, stream, chunk_size=args.chunk_size, progress=progress)
+
+        elapsed = time.monotonic() - started
+        print(f"Selesai dalam {elapsed:.1f} detik: {report['imported_orders']:,} dari {report['orders']:,} order, "
+              f"{report['imported_lines']:,} dari {report['lines']:,} baris.")
+        if report['errors']:
+            SalesImportService.write_error_report(report['errors'], args.errors)
+            print(f"{len(report['errors']):,} baris error -> {args.errors}")
+
+if __name__ == '__main__':
+    main()
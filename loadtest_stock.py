@@ -0,0 +1,147 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from app.config import Config
+
+# Load test StockService: ratusan konfirmasi order bersamaan terhadap stok yang terbatas.
+# Berjalan di database SQLite sementara (tidak menyentuh instance/warehouse.db).
+# Lolos jika: tidak ada oversell, tidak ada update yang hilang, tidak ada order terkonfirmasi 2x.
+#
+#   python loadtest_stock.py                          # 300 order, stok 100
+#   python loadtest_stock.py --orders 500 --stock 250 --threads 64
+# run() dipakai juga oleh tests/test_inventory.py (jumlah thread kecil).
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test mutasi stok bersamaan')
+    parser.add_argument('--orders', type=int, default=300)
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--qty', type=int, default=1, help='Qty per order')
+    parser.add_argument('--restocks', type=int, default=200, help='Restock +1 bersamaan (uji lost update)')
+    parser.add_argument('--threads', type=int, default=300)
+    return parser.parse_args()
+
+
+def run(orders=300, stock=100, qty=1, restocks=200, threads=300):
+    """
+    Runs the load test on a fresh temporary database.
+    Returns: dict {checks: [(label, ok)], outcomes, elapsed, requests, threads, stock, confirmed, restocked, in_rows}
+    """
+    Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='loadtest_stock_'), 'load.db')
+
+    from app import create_app, db
+    from app.models import Product, SalesOrder, SalesOrderItem, Transaction, Account
+
+    app = create_app()
+
+    with app.app_context():
+        for code, name, a_type in [('1100', 'Kas', 'Asset'), ('1300', 'Persediaan', 'Asset'),
+                                   ('4100', 'Penjualan', 'Revenue'), ('5100', 'HPP', 'Expense')]:
+            db.session.add(Account(code=code, name=name, type=a_type))
+        product = Product(sku='LOAD-1', name='Load Test', price=1000, cost=600, stock_quantity=stock)
+        restock_product = Product(sku='LOAD-2', name='Restock Test', price=1000, cost=600, stock_quantity=0)
+        db.session.add_all([product, restock_product])
+        db.session.flush()
+
+        order_ids = []
+        for i in range(orders):
+            so = SalesOrder(order_number=f"SO-LOAD-{i:05d}", status='Draft', total_amount=1000 * qty,
+                            grand_total=1000 * qty)
+            so.items.append(SalesOrderItem(product_id=product.id, quantity=qty, price=1000, subtotal=1000 * qty))
+            db.session.add(so)
+            db.session.flush()
+            order_ids.append(so.id)
+        db.session.commit()
+        product_id, restock_id = product.id, restock_product.id
+
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(min(threads, orders + restocks))
+    jobs = [('confirm', order_id) for order_id in order_ids] + [('restock', None)] * restocks
+    # Dua kali submit untuk 20 order pertama: konfirmasi ganda harus ditolak
+    jobs += [('confirm', order_id) for order_id in order_ids[:20]]
+
+    def worker(chunk):
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['user_id'] = 1
+            s['role'] = 'admin'
+        try:
+            barrier.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            pass
+        for kind, order_id in chunk:
+            if kind == 'confirm':
+                client.post(f'/sales/{order_id}/confirm')
+            else:
+                client.post('/inventory/restock_web', data={'product_id': restock_id, 'amount': 1})
+            with client.session_transaction() as s:
+                flashes = s.pop('_flashes', [])
+            with lock:
+                for category, message in flashes:
+                    outcomes[(kind, category, message.split('!')[0][:40])] += 1
+
+    n_threads = min(threads, len(jobs))
+    chunks = [jobs[i::n_threads] for i in range(n_threads)]
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        final_stock = db.session.get(Product, product_id).stock_quantity
+        restocked = db.session.get(Product, restock_id).stock_quantity
+        confirmed = SalesOrder.query.filter_by(status='Confirmed').count()
+        out_qty = db.session.query(db.func.coalesce(db.func.sum(Transaction.quantity), 0))\
+            .filter_by(product_id=product_id, transaction_type='OUT').scalar()
+        in_rows = Transaction.query.filter_by(product_id=restock_id, transaction_type='IN').count()
+        cash = Account.query.filter_by(code='1100').first().balance
+
+    expected_confirmed = min(orders, stock // qty)
+    return {
+        'checks': [
+            ('tidak ada oversell (stok >= 0)', final_stock >= 0),
+            ('stok akhir = awal - qty terkonfirmasi', final_stock == stock - confirmed * qty),
+            ('ledger OUT = qty terkonfirmasi', out_qty == confirmed * qty),
+            ('jurnal kas = penjualan terkonfirmasi', abs(cash - confirmed * 1000 * qty) < 0.01),
+            ('semua stok terjual bila permintaan > stok', confirmed == expected_confirmed),
+            ('restock tanpa lost update', restocked == in_rows),
+        ],
+        'outcomes': outcomes,
+        'elapsed': elapsed,
+        'requests': len(jobs),
+        'threads': n_threads,
+        'stock': final_stock,
+        'confirmed': confirmed,
+        'restocked': restocked,
+        'in_rows': in_rows,
+    }
+
+
+def main():
+    args = parse_args()
+    result = run(args.orders, args.stock, args.qty, args.restocks, args.threads)
+
+    print(f"{result['requests']} request dari {result['threads']} thread dalam {result['elapsed']:.1f} detik")
+    for key, count in sorted(result['outcomes'].items()):
+        print(f"  {count:5d} x {key}")
+
+    print(f"\nStok akhir {result['stock']}, order terkonfirmasi {result['confirmed']}, "
+          f"restock {result['restocked']}/{args.restocks} (IN rows {result['in_rows']})")
+    failed = False
+    for label, ok in result['checks']:
+        print(f"  [{'OK' if ok else 'GAGAL'}] {label}")
+        failed = failed or not ok
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
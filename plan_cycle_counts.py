@@ -0,0 +1,41 @@
+import argparse
+from datetime import datetime
+from app import create_app, db
+from app.services.cycle_count_service import CycleCountService
+
+app = create_app()
+
+# Daftar cycle count harian (kelas ABC dari nilai pergerakan, seimbang per zona rak).
+# Dijadwalkan harian (cron) sebelum shift gudang mulai.
+#   python plan_cycle_counts.py                          -> hari ini, budget otomatis
+#   python plan_cycle_counts.py --date 2024-12-31 --budget 40
+#   python plan_cycle_counts.py --classes                -> ringkasan kelas ABC saja
+
+def main():
+    parser = argparse.ArgumentParser(description='Buat daftar cycle count harian')
+    parser.add_argument('--date', help='Tanggal hitung (YYYY-MM-DD), default hari ini')
+    parser.add_argument('--budget', type=int, help='Jumlah SKU per hari (default: otomatis dari interval kelas)')
+    parser.add_argument('--days', type=int, default=CycleCountService.VELOCITY_DAYS, help='Jendela pergerakan (hari)')
+    parser.add_argument('--classes', action='store_true', help='Tampilkan ringkasan kelas ABC tanpa membuat daftar')
+    args = parser.parse_args()
+
+    count_date = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+
+    with app.app_context():
+        db.create_all()
+
+        if args.classes:
+            classes = CycleCountService.classify(count_date, args.days)
+            for abc in ('A', 'B', 'C'):
+                members = [value for c, value in classes.values() if c == abc]
+                interval = CycleCountService.COUNT_INTERVAL_DAYS[abc]
+                print(f"  {abc}: {len(members):,} SKU, nilai {sum(members):,.0f}, hitung tiap {interval} hari")
+            print(f"Budget otomatis: {CycleCountService.daily_budget(classes)} SKU/hari")
+            return
+
+        total = CycleCountService.generate_plan(count_date, budget=args.budget, days=args.days)
+        db.session.commit()
+        print(f"Daftar hitung {count_date or datetime.now().date()}: {total:,} SKU.")
+
+if __name__ == '__main__':
+    main()
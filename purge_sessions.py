@@ -0,0 +1,14 @@
+from app import create_app
+
+app = create_app()
+
+# Hapus session server-side yang sudah kedaluwarsa (backend sqlite / filesystem).
+# Eviction juga berjalan otomatis sesekali saat session disimpan; script ini untuk cron harian.
+#   python purge_sessions.py
+
+with app.app_context():
+    backend = getattr(app.session_interface, 'backend', None)
+    if backend is None:
+        print("SESSION_BACKEND = cookie, tidak ada session server-side.")
+    else:
+        print(f"{backend.evict_expired()} session kedaluwarsa dihapus ({type(backend).__name__}).")
@@ -0,0 +1,48 @@
+import argparse
+import sys
+from app import create_app, db
+from app.models import StockDiscrepancy
+from app.services.stock_reconciliation import StockReconciliationService
+
+app = create_app()
+
+# Rekonsiliasi stok: Product.stock_quantity vs SUM(inventory_stocks) vs SUM(batches).
+# Dijalankan di luar web server (cron/scheduler), per chunk keyset dengan commit per chunk.
+#   python reconcile_stock.py                    -> catat selisih ke stock_discrepancies
+#   python reconcile_stock.py --repair           -> catat + samakan gudang & batch ke Product.stock_quantity
+#   python reconcile_stock.py --start-after 5000 -> lanjutkan run yang terhenti
+
+def main():
+    parser = argparse.ArgumentParser(description='Rekonsiliasi tiga sumber stok')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--start-after', type=int, default=0, help='Lanjut dari product_id ini')
+    parser.add_argument('--repair', action='store_true')
+    parser.add_argument('--show', type=int, default=20, help='Jumlah selisih yang ditampilkan')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+
+        def progress(last_id, summary):
+            print(f"  ... s/d produk {last_id}: {summary['scanned']:,} dipindai, {summary['discrepancies']:,} selisih")
+
+        summary = StockReconciliationService.run(
+            chunk_size=args.chunk_size,
+            repair=args.repair,
+            start_after=args.start_after,
+            progress=progress
+        )
+
+        print(f"Run {summary['run_id']}: {summary['scanned']:,} produk, "
+              f"{summary['discrepancies']:,} selisih, {summary['repaired']:,} diperbaiki.")
+
+        rows = StockDiscrepancy.query.filter_by(run_id=summary['run_id'])\
+            .order_by(StockDiscrepancy.product_id).limit(args.show).all()
+        for d in rows:
+            print(f"  Produk {d.product_id}: produk={d.product_qty} gudang={d.warehouse_qty} batch={d.batch_qty}")
+
+        if summary['discrepancies'] and not args.repair:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App on a temporary SQLite file (threads need a real file, not :memory:)."""
+    Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+    Config.TESTING = True
+
+    from app import create_app, db
+    from app.models import Account
+
+    app = create_app()
+    with app.app_context():
+        for code, name, a_type in [('1100', 'Kas', 'Asset'), ('1300', 'Persediaan', 'Asset'),
+                                   ('4100', 'Penjualan', 'Revenue'), ('5100', 'HPP', 'Expense')]:
+            db.session.add(Account(code=code, name=name, type=a_type))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def make_product(app):
+    from app import db
+    from app.models import Product
+
+    def make(sku, stock=0, cost=100, price=150):
+        product = Product(sku=sku, name=f'Produk {sku}', price=price, cost=cost, stock_quantity=stock)
+        db.session.add(product)
+        db.session.commit()
+        return product.id
+    return make
+
+
+@pytest.fixture
+def run_threads():
+    def run(app, n_threads, work):
+        """Runs work(i) in n_threads threads at once, each in its own app context; returns their errors."""
+        from app import db
+
+        barrier = threading.Barrier(n_threads)
+        errors = []
+
+        def target(i):
+            with app.app_context():
+                barrier.wait(timeout=30)
+                try:
+                    work(i)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors
+    return run
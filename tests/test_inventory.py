@@ -0,0 +1,237 @@
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Batch, BatchTransaction, Product, SalesOrder, StockReservation, Transaction, Warehouse
+from app.services.inventory_engine import SmartInventoryEngine
+from app.services.reservation_service import ReservationService
+from app.services.sales_service import SalesService
+from app.services.stock_service import StockConflictError, StockService
+
+
+def stock_of(product_id):
+    db.session.expire_all()
+    return db.session.get(Product, product_id)
+
+
+# --- StockService ---
+
+def test_adjust_many_concurrent_stock_out_never_oversells(app, make_product, run_threads):
+    product_id = make_product('OUT-1', stock=20)
+    sold = []
+    lock = threading.Lock()
+
+    def work(i):
+        for _ in range(5):
+            try:
+                StockService.run_with_retry(lambda: StockService.adjust(product_id, -1))
+            except ValueError:
+                db.session.rollback()
+                continue
+            with lock:
+                sold.append(i)
+
+    assert run_threads(app, 8, work) == []
+    product = stock_of(product_id)
+    assert len(sold) == 20
+    assert product.stock_quantity == 0
+    assert product.version == 20
+
+
+def test_adjust_many_concurrent_restock_no_lost_update(app, make_product, run_threads):
+    product_id = make_product('IN-1', stock=0)
+
+    def work(i):
+        for _ in range(10):
+            StockService.run_with_retry(lambda: StockService.adjust(product_id, 1))
+
+    assert run_threads(app, 8, work) == []
+    product = stock_of(product_id)
+    assert product.stock_quantity == 80
+    assert product.version == 80
+
+
+def test_adjust_many_shortage_rejects_whole_order(app, make_product):
+    enough = make_product('OK-1', stock=10)
+    short = make_product('SHORT-1', stock=2)
+
+    with pytest.raises(ValueError, match='tidak cukup'):
+        StockService.run_with_retry(lambda: StockService.adjust_many([(enough, -3), (short, -5)]))
+    db.session.rollback()
+
+    assert stock_of(enough).stock_quantity == 10
+    assert stock_of(short).stock_quantity == 2
+
+
+def test_adjust_many_merges_lines_of_same_product(app, make_product):
+    product_id = make_product('MERGE-1', stock=5)
+
+    with pytest.raises(ValueError):
+        StockService.adjust_many([(product_id, -3), (product_id, -3)])
+    db.session.rollback()
+
+    StockService.run_with_retry(lambda: StockService.adjust_many([(product_id, -3), (product_id, -2)]))
+    assert stock_of(product_id).stock_quantity == 0
+
+
+# --- SmartInventoryEngine.allocate_fifo_many ---
+
+def make_batches(product_id, warehouse_id, layers):
+    """layers: list of (quantity, cost); created oldest first."""
+    start = datetime(2024, 1, 1)
+    batches = []
+    for i, (qty, cost) in enumerate(layers):
+        batch = Batch(product_id=product_id, batch_number=f'B-{product_id}-{i}', initial_quantity=qty,
+                      current_quantity=qty, cost_price=cost, warehouse_id=warehouse_id,
+                      created_at=start + timedelta(days=i))
+        db.session.add(batch)
+        batches.append(batch)
+    db.session.commit()
+    return [b.id for b in batches]
+
+
+def test_allocate_fifo_many_splits_lines_over_layers(app, make_product):
+    warehouse = Warehouse(name='Main', type='main')
+    db.session.add(warehouse)
+    db.session.commit()
+    product_id = make_product('FIFO-1', stock=18)
+    b1, b2, b3 = make_batches(product_id, warehouse.id, [(3, 100), (5, 120), (10, 130)])
+
+    trx = [Transaction(product_id=product_id, transaction_type='OUT', quantity=q, total_amount=0) for q in (4, 3)]
+    db.session.add_all(trx)
+    db.session.flush()
+
+    results = SmartInventoryEngine.allocate_fifo_many([(product_id, 4), (product_id, 3)],
+                                                      transaction_ids=[t.id for t in trx])
+    db.session.commit()
+
+    # Line 1 empties the oldest layer and takes 1 from the next; line 2 continues in that layer
+    assert [(a['batch_id'], a['quantity'], a['cost']) for a in results[0]['allocations']] == [(b1, 3, 100), (b2, 1, 120)]
+    assert [(a['batch_id'], a['quantity']) for a in results[1]['allocations']] == [(b2, 3)]
+    assert all(r['shortage'] == 0 for r in results)
+
+    remaining = {b.id: b.current_quantity for b in Batch.query.filter_by(product_id=product_id)}
+    assert remaining == {b1: 0, b2: 1, b3: 10}
+    links = sorted((bt.transaction_id, bt.batch_id, bt.quantity) for bt in BatchTransaction.query)
+    assert links == sorted([(trx[0].id, b1, 3), (trx[0].id, b2, 1), (trx[1].id, b2, 3)])
+
+
+def test_allocate_fifo_many_reports_shortage(app, make_product):
+    warehouse = Warehouse(name='Main', type='main')
+    db.session.add(warehouse)
+    db.session.commit()
+    product_id = make_product('FIFO-2', stock=4)
+    b1, b2 = make_batches(product_id, warehouse.id, [(1, 100), (3, 110)])
+
+    result = SmartInventoryEngine.allocate_fifo_many([(product_id, 6)])[0]
+    db.session.commit()
+
+    assert result['allocated'] == 4
+    assert result['shortage'] == 2
+    assert [a['batch_id'] for a in result['allocations']] == [b1, b2]
+    assert Batch.query.filter(Batch.current_quantity > 0).count() == 0
+
+
+def test_lost_batch_race_is_retried(app, make_product):
+    product_id = make_product('FIFO-3', stock=5)
+    (batch_id,) = make_batches(product_id, None, [(5, 100)])
+
+    # Another writer took the batch between read and update
+    with pytest.raises(StockConflictError):
+        SmartInventoryEngine._decrement_batches({batch_id: 6})
+    db.session.rollback()
+
+    attempts = []
+
+    def work():
+        attempts.append(1)
+        SmartInventoryEngine._decrement_batches({batch_id: 6 if len(attempts) == 1 else 2})
+
+    StockService.run_with_retry(work)
+    assert len(attempts) == 2
+    assert db.session.get(Batch, batch_id).current_quantity == 3
+
+
+
+# --- ReservationService ---
+
+def create_draft(product_id, qty):
+    return StockService.run_with_retry(
+        lambda: SalesService.create_order(None, date.today(), [{'product_id': product_id, 'quantity': qty}]).id)
+
+
+def test_concurrent_drafts_cannot_reserve_the_same_unit(app, make_product, run_threads):
+    product_id = make_product('RSV-1', stock=5)
+    drafts = []
+    lock = threading.Lock()
+
+    def work(i):
+        try:
+            order_id = create_draft(product_id, 1)
+        except ValueError:
+            db.session.rollback()
+            return
+        with lock:
+            drafts.append(order_id)
+
+    assert run_threads(app, 8, work) == []
+    product = stock_of(product_id)
+    assert len(drafts) == 5
+    assert product.reserved_quantity == 5
+    assert product.stock_quantity == 5
+    assert StockReservation.query.filter_by(status='Active').count() == 5
+
+    with pytest.raises(ValueError, match='tidak cukup'):
+        create_draft(product_id, 1)
+
+
+def test_expire_releases_reserved_cache(app, make_product):
+    product_id = make_product('RSV-2', stock=5)
+    ReservationService.reserve('SO', 1, [(product_id, 2), (product_id, 1)],
+                               expires_at=datetime.utcnow() - timedelta(minutes=1))
+    db.session.commit()
+    assert stock_of(product_id).reserved_quantity == 3
+
+    assert ReservationService.expire() == 1
+    db.session.commit()
+
+    assert stock_of(product_id).reserved_quantity == 0
+    assert StockReservation.query.one().status == 'Expired'
+    assert ReservationService.available([product_id]) == {product_id: 5}
+
+
+def test_confirm_after_expiry_cannot_take_stock_reserved_for_another_order(app, make_product):
+    product_id = make_product('RSV-3', stock=5, price=1000)
+    expired_order = create_draft(product_id, 3)
+    StockReservation.query.filter_by(source_id=expired_order).update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+    db.session.commit()
+
+    # The expired hold is swept when the next draft reserves: 4 of 5 units are now promised to it
+    other_order = create_draft(product_id, 4)
+
+    with pytest.raises(ValueError, match='tidak cukup'):
+        StockService.run_with_retry(lambda: SalesService.confirm_order(expired_order))
+    db.session.rollback()
+
+    product = stock_of(product_id)
+    assert (product.stock_quantity, product.reserved_quantity) == (5, 4)
+    assert db.session.get(SalesOrder, expired_order).status == 'Draft'
+
+    StockService.run_with_retry(lambda: SalesService.confirm_order(other_order))
+    product = stock_of(product_id)
+    assert (product.stock_quantity, product.reserved_quantity) == (1, 0)
+
+
+# --- loadtest_stock.py invariants ---
+
+def test_loadtest_stock_invariants_small():
+    import loadtest_stock
+
+    result = loadtest_stock.run(orders=40, stock=15, restocks=30, threads=8)
+
+    failed = [label for label, ok in result['checks'] if not ok]
+    assert failed == []
+    assert result['confirmed'] == 15
+    assert result['restocked'] == 30
@@ -0,0 +1,74 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Batch, Product, SalesOrderItem, SalesReturnItem, Warehouse
+from app.services.sales_service import SalesService
+from app.services.stock_service import StockService
+
+
+@pytest.fixture
+def shipped_order(app, make_product):
+    """Confirmed order of 6 units shipped FIFO from two layers: 4 from the oldest, 2 from the next."""
+    warehouse = Warehouse(name='Main', type='main')
+    db.session.add(warehouse)
+    db.session.commit()
+    product_id = make_product('RET-1', stock=10, price=1000)
+    batches = [Batch(product_id=product_id, batch_number=f'B-RET-{i}', initial_quantity=qty, current_quantity=qty,
+                     cost_price=cost, warehouse_id=warehouse.id, created_at=datetime(2024, 1, 1) + timedelta(days=i))
+               for i, (qty, cost) in enumerate([(4, 100), (6, 120)])]
+    db.session.add_all(batches)
+    db.session.commit()
+
+    order_id = StockService.run_with_retry(
+        lambda: SalesService.create_order(None, date.today(), [{'product_id': product_id, 'quantity': 6}]).id)
+    StockService.run_with_retry(lambda: SalesService.confirm_order(order_id))
+    item_id = SalesOrderItem.query.filter_by(sales_order_id=order_id).one().id
+    return order_id, item_id, product_id, [b.id for b in batches]
+
+
+def batch_quantities(batch_ids):
+    db.session.expire_all()
+    return [db.session.get(Batch, b_id).current_quantity for b_id in batch_ids]
+
+
+def create_return(order_id, item_id, qty):
+    return StockService.run_with_retry(
+        lambda: SalesService.create_return(order_id, [{'sales_order_item_id': item_id, 'qty': qty}]))
+
+
+def test_return_goes_back_into_the_original_batches(shipped_order):
+    order_id, item_id, product_id, (b1, b2) = shipped_order
+    assert batch_quantities([b1, b2]) == [0, 4]
+
+    # Most recently allocated layer first: 2 back to the second batch, 1 to the oldest
+    result = create_return(order_id, item_id, 3)
+    assert (result['restocked'], result['unbatched']) == (3, 0)
+    assert result['cost'] == 2 * 120 + 1 * 100
+    assert batch_quantities([b1, b2]) == [1, 6]
+
+    create_return(order_id, item_id, 3)
+    assert batch_quantities([b1, b2]) == [4, 6]
+    assert db.session.get(Product, product_id).stock_quantity == 10
+
+
+def test_return_cannot_exceed_shipped_minus_returned(shipped_order):
+    order_id, item_id, product_id, batch_ids = shipped_order
+
+    with pytest.raises(ValueError, match='melebihi sisa 6'):
+        create_return(order_id, item_id, 7)
+    db.session.rollback()
+    assert SalesReturnItem.query.count() == 0
+
+    create_return(order_id, item_id, 4)
+
+    # Split over two lines of the same order item: merged before the check
+    with pytest.raises(ValueError, match='melebihi sisa 2'):
+        StockService.run_with_retry(lambda: SalesService.create_return(
+            order_id, [{'sales_order_item_id': item_id, 'qty': 2}, {'sales_order_item_id': item_id, 'qty': 1}]))
+    db.session.rollback()
+
+    assert [row.returnable for row in SalesService.returnable_items(order_id)] == [2]
+    assert db.session.get(Product, product_id).stock_quantity == 8
+    assert sum(batch_quantities(batch_ids)) == 8
@@ -0,0 +1,58 @@
+import sqlite3
+from datetime import date
+
+from app import db
+from app.models import DocumentSequence, MaterialRequest, SalesOrder
+from app.services.sequence_service import SequenceService
+
+
+def test_blocks_are_contiguous_per_period(app):
+    assert SequenceService.next_block('SO', 3, '202401') == 1
+    assert SequenceService.next_block('SO', 2, '202401') == 4
+    assert SequenceService.next_block('SO', 1, '202402') == 1 # Own counter per period
+    assert SequenceService.numbers('SO', 2, on=date(2024, 1, 20)) == ['SO-202401-0006', 'SO-202401-0007']
+    assert SequenceService.next_number('REQ', on=date(2024, 1, 20)) == 'REQ-20240120-0001'
+    db.session.rollback()
+
+    # A rolled back document gives its numbers back
+    assert SequenceService.next_block('SO', 1, '202401') == 1
+
+
+def test_concurrent_blocks_never_overlap(app, run_threads):
+    blocks = []
+
+    def work(i):
+        for size in (1, 3, 2):
+            first = SequenceService.next_block('SO', size, '202403')
+            db.session.commit()
+            blocks.append((first, size))
+
+    assert run_threads(app, 6, work) == []
+    taken = sorted(n for first, size in blocks for n in range(first, first + size))
+    assert taken == list(range(1, 6 * 6 + 1))
+    assert DocumentSequence.query.filter_by(prefix='SO', period='202403').one().last_value == 36
+
+
+def test_seeding_continues_from_highest_existing_number(app, make_product, tmp_path):
+    import add_document_sequences
+
+    product_id = make_product('SEQ-1')
+    for number in ('SO-202401-0007', 'SO-202401-0012', 'SO-202402-0003'):
+        db.session.add(SalesOrder(order_number=number, status='Draft', total_amount=0, grand_total=0))
+    db.session.add(MaterialRequest(request_number='REQ-20240105-0009', product_id=product_id, quantity=1,
+                                   branch_name='Cabang', status='PENDING'))
+    # Counters already in use: seeding only raises them (behind the old numbers), never lowers them
+    SequenceService.next_block('SO', 2, '202401')
+    SequenceService.next_block('SO', 10, '202402')
+    db.session.commit()
+    db.session.remove()
+
+    db_path = str(tmp_path / 'test.db')
+    add_document_sequences.upgrade_db(db_path)
+    add_document_sequences.upgrade_db(db_path) # Safe to re-run
+
+    assert SequenceService.next_number('SO', on=date(2024, 1, 31)) == 'SO-202401-0013'
+    assert SequenceService.next_number('SO', on=date(2024, 2, 1)) == 'SO-202402-0011'
+    assert SequenceService.next_number('REQ', on=date(2024, 1, 5)) == 'REQ-20240105-0010'
+    assert SequenceService.next_number('PO', on=date(2024, 1, 5)) == 'PO-202401-0001'
+    db.session.commit()
@@ -0,0 +1,29 @@
+import sys
+from app import create_app, db
+from app.services.inventory_engine import SmartInventoryEngine
+
+app = create_app()
+
+# Verifikasi ledger valuasi (stock_valuations) terhadap tabel batches.
+#   python verify_valuation.py           -> laporan drift saja
+#   python verify_valuation.py --repair  -> laporan + koreksi ledger (juga untuk backfill database lama)
+
+with app.app_context():
+    repair = '--repair' in sys.argv
+    drift = SmartInventoryEngine.verify_valuation_ledger(repair=repair)
+
+    if not drift:
+        print("Ledger valuasi sesuai dengan batches. Tidak ada drift.")
+    else:
+        print(f"Ditemukan {len(drift)} baris drift:")
+        for d in drift:
+            print(f"  Produk {d['product_id']} / Gudang {d['warehouse_id']}: "
+                  f"qty ledger={d['ledger_qty']} batch={d['batch_qty']} | "
+                  f"nilai ledger={d['ledger_value']:,.2f} batch={d['batch_value']:,.2f}")
+
+        if repair:
+            db.session.commit()
+            print("Ledger valuasi sudah dikoreksi.")
+        else:
+            print("Jalankan dengan --repair untuk mengoreksi ledger.")
+            sys.exit(1)